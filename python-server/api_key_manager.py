@@ -1,104 +1,287 @@
 """
-API Key Manager with Round-Robin Fallback for Python
-Handles multiple API keys with automatic fallback and rotation
+API Key Manager with Load-Aware Fallback for Python
+Handles multiple API keys with per-key rate limiting, cooldown and automatic recovery
 """
 
+import asyncio
 import os
-import logging
+import random
+import threading
+import time
 from typing import List, Callable, Any, Optional
 
+from tracing import logger
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` requests per second with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available"""
+        self._refill(now)
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class KeyState:
+    def __init__(self, key: str, index: int, rate: float, burst: float):
+        self.key = key
+        self.index = index
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.latency = None  # exponentially weighted moving average, seconds
+        self.requests = 0
+
+
 class ApiKeyManager:
-    def __init__(self, api_keys: List[str], service_name: str):
+    def __init__(self, api_keys: List[str], service_name: str, rate: float = 10.0, burst: float = 10.0,
+                 cooldown: float = 5.0, max_cooldown: float = 300.0, max_wait: float = 30.0):
         self.api_keys = [key.strip() for key in api_keys if key and key.strip()]
         self.service_name = service_name
-        self.current_index = 0
-        self.failed_keys = set()
-        
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.rotations = 0
+        self.total_failures = 0
+        self.next_index = 0
+
         if not self.api_keys:
             raise ValueError(f"No valid {service_name} API keys provided")
-        
-        print(f"🔑 Initialized {service_name} with {len(self.api_keys)} API keys")
-
-    def get_next_key(self) -> str:
-        """Get the next available API key using round-robin"""
-        if len(self.failed_keys) == len(self.api_keys):
-            # All keys have failed, reset failed keys and try again
-            print(f"⚠️ All {self.service_name} keys failed, resetting and retrying...")
-            self.failed_keys.clear()
-
-        # Find next available key
-        attempts = 0
-        while attempts < len(self.api_keys):
-            key = self.api_keys[self.current_index]
-            self.current_index = (self.current_index + 1) % len(self.api_keys)
-            
-            if key not in self.failed_keys:
-                print(f"🔑 Using {self.service_name} key #{self.current_index} ({key[:8]}...)")
+
+        self.states = {key: KeyState(key, i, rate, burst) for i, key in enumerate(self.api_keys)}
+
+        logger.info(f"🔑 Initialized {service_name} with {len(self.api_keys)} API keys")
+
+    @property
+    def failed_keys(self) -> set:
+        """Keys currently cooling down after a failure"""
+        now = time.monotonic()
+        with self.lock:
+            return {key for key, state in self.states.items() if state.cooldown_until > now}
+
+    def _pick(self, now: float, exclude) -> Optional[KeyState]:
+        """Choose the least loaded, fastest usable key (lock must be held)"""
+        candidates = [
+            state for state in self.states.values()
+            if state.key not in exclude and state.cooldown_until <= now
+        ]
+        # Rotate the starting point so equal keys share load round-robin
+        count = len(self.api_keys)
+        candidates.sort(key=lambda state: (
+            state.in_flight,
+            state.latency if state.latency is not None else 0.0,
+            (state.index - self.next_index) % count,
+        ))
+        for state in candidates:
+            if state.bucket.try_acquire(now):
+                self.next_index = (state.index + 1) % count
+                return state
+        return None
+
+    def _wait_time(self, now: float, exclude) -> float:
+        """Seconds until some key could be usable again (lock must be held)"""
+        waits = [
+            max(state.cooldown_until - now, state.bucket.wait_time(now))
+            for state in self.states.values() if state.key not in exclude
+        ]
+        return min(waits) if waits else 0.0
+
+    def _reserve(self, exclude, deadline: float):
+        """Reserve a key, or return the seconds to wait before trying again"""
+        with self.lock:
+            now = time.monotonic()
+            state = self._pick(now, exclude)
+            if state is not None:
+                state.in_flight += 1
+                state.requests += 1
+                logger.info(f"🔑 Using {self.service_name} key #{state.index + 1} ({state.key[:8]}...)")
+                return state.key, 0.0
+            wait = self._wait_time(now, exclude)
+
+        if not wait or now + wait > deadline:
+            raise Exception(f"No available {self.service_name} API keys")
+        return None, min(wait, 1.0)
+
+    def get_next_key(self, exclude=()) -> str:
+        """Reserve the best available API key, waiting for rate limits or cooldowns.
+
+        The caller must hand the key back with release_key().
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            key, wait = self._reserve(exclude, deadline)
+            if key is not None:
+                return key
+            time.sleep(wait)
+
+    async def aget_next_key(self, exclude=()) -> str:
+        """Async get_next_key: waits without blocking the event loop"""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            key, wait = self._reserve(exclude, deadline)
+            if key is not None:
                 return key
-            attempts += 1
-        
-        raise Exception(f"No available {self.service_name} API keys")
+            await asyncio.sleep(wait)
+
+    def release_key(self, key: str, latency: Optional[float] = None, success: bool = True):
+        """Return a reserved key, recording latency and clearing its cooldown on success"""
+        with self.lock:
+            state = self.states[key]
+            state.in_flight = max(0, state.in_flight - 1)
+            if success:
+                state.failures = 0
+                state.cooldown_until = 0.0
+                if latency is not None:
+                    state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
 
     def mark_key_as_failed(self, key: str):
-        """Mark a key as failed"""
-        self.failed_keys.add(key)
-        print(f"❌ Marked {self.service_name} key as failed: {key[:8]}...")
+        """Put a key on cooldown, doubling the cooldown on each consecutive failure"""
+        with self.lock:
+            state = self.states[key]
+            state.failures += 1
+            self.total_failures += 1
+            delay = min(self.max_cooldown, self.cooldown * 2 ** (state.failures - 1))
+            delay *= random.uniform(0.8, 1.2)
+            state.cooldown_until = time.monotonic() + delay
+        logger.error(f"❌ Marked {self.service_name} key as failed for {delay:.0f}s: {key[:8]}...")
 
     def execute_with_fallback(self, api_function: Callable, *args, **kwargs) -> Any:
         """Execute a function with automatic key rotation on failure"""
         last_error = None
-        max_attempts = len(self.api_keys)
-        
-        for attempt in range(max_attempts):
+        tried = set()
+
+        for attempt in range(len(self.api_keys)):
+            try:
+                api_key = self.get_next_key(exclude=tried)
+            except Exception:
+                if last_error is None:
+                    raise
+                break
+
+            started = time.monotonic()
             try:
-                api_key = self.get_next_key()
                 result = api_function(api_key, *args, **kwargs)
-                
-                # If successful, remove key from failed set (in case it was temporarily failing)
-                self.failed_keys.discard(api_key)
-                return result
-                
             except Exception as error:
                 last_error = error
-                current_key = self.api_keys[(self.current_index - 1) % len(self.api_keys)]
-                
-                # Check if it's an API key related error
-                if self.is_api_key_error(error):
-                    self.mark_key_as_failed(current_key)
-                    print(f"🔄 Trying next {self.service_name} key due to auth error...")
-                    continue
-                else:
-                    # If it's not an API key error, don't try other keys
-                    raise error
-        
+                self._rotate_or_raise(api_key, error, tried)
+                continue
+
+            self.release_key(api_key, latency=time.monotonic() - started)
+            return result
+
         raise Exception(f"All {self.service_name} API keys failed. Last error: {str(last_error)}")
 
+    async def aexecute_with_fallback(self, api_function: Callable, *args, **kwargs) -> Any:
+        """Async execute_with_fallback for coroutine functions taking the key first"""
+        last_error = None
+        tried = set()
+
+        for attempt in range(len(self.api_keys)):
+            try:
+                api_key = await self.aget_next_key(exclude=tried)
+            except Exception:
+                if last_error is None:
+                    raise
+                break
+
+            started = time.monotonic()
+            try:
+                result = await api_function(api_key, *args, **kwargs)
+            except Exception as error:
+                last_error = error
+                self._rotate_or_raise(api_key, error, tried)
+                continue
+
+            self.release_key(api_key, latency=time.monotonic() - started)
+            return result
+
+        raise Exception(f"All {self.service_name} API keys failed. Last error: {str(last_error)}")
+
+    def _rotate_or_raise(self, api_key: str, error: Exception, tried: set):
+        """Release a key after a failed call; cool it down on key errors, re-raise others"""
+        self.release_key(api_key, success=False)
+
+        # Check if it's an API key related error
+        if not self.is_api_key_error(error):
+            # If it's not an API key error, don't try other keys
+            raise error
+
+        self.mark_key_as_failed(api_key)
+        tried.add(api_key)
+        with self.lock:
+            self.rotations += 1
+        logger.info(f"🔄 Trying next {self.service_name} key due to auth error...")
+
     def is_api_key_error(self, error: Exception) -> bool:
         """Check if error is related to API key authentication or quota issues"""
         error_message = str(error).lower()
-        
+
         # Check for common authentication and quota error patterns
         auth_patterns = [
-            'unauthorized', 'invalid api key', 'authentication', 
+            'unauthorized', 'invalid api key', 'authentication',
             'forbidden', '401', '403', '429', 'invalid_api_key',
             'api key', 'authentication failed', 'insufficient credits',
             'quota exceeded', 'rate limit', 'credits are insufficient',
             'top up', 'billing', 'payment required'
         ]
-        
+
         return any(pattern in error_message for pattern in auth_patterns)
 
     def get_status(self) -> dict:
         """Get current status of all keys"""
-        return {
-            'total': len(self.api_keys),
-            'failed': len(self.failed_keys),
-            'available': len(self.api_keys) - len(self.failed_keys),
-            'current_index': self.current_index
-        }
+        now = time.monotonic()
+        with self.lock:
+            cooling = [state for state in self.states.values() if state.cooldown_until > now]
+            return {
+                'total': len(self.api_keys),
+                'failed': len(cooling),
+                'available': len(self.api_keys) - len(cooling),
+                'in_flight': sum(state.in_flight for state in self.states.values()),
+                'rotations': self.rotations,
+                'failures': self.total_failures,
+                'keys': [
+                    {
+                        'key': f"{state.key[:8]}...",
+                        'in_flight': state.in_flight,
+                        'requests': state.requests,
+                        'latency': round(state.latency, 3) if state.latency is not None else None,
+                        'cooldown': round(max(0.0, state.cooldown_until - now), 1),
+                    }
+                    for state in self.states.values()
+                ],
+            }
 
 
 def initialize_stability_key_manager() -> ApiKeyManager:
     """Initialize Stability AI key manager from environment"""
     stability_keys = os.getenv('STABILITY_KEY', '').split(',')
-    return ApiKeyManager(stability_keys, 'Stability AI')
\ No newline at end of file
+    return ApiKeyManager(
+        stability_keys,
+        'Stability AI',
+        rate=float(os.getenv('STABILITY_KEY_RATE', 10)),
+        burst=float(os.getenv('STABILITY_KEY_BURST', 10)),
+        cooldown=float(os.getenv('STABILITY_KEY_COOLDOWN', 5)),
+        max_cooldown=float(os.getenv('STABILITY_KEY_MAX_COOLDOWN', 300)),
+        max_wait=float(os.getenv('STABILITY_KEY_MAX_WAIT', 30)),
+    )
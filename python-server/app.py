@@ -1,110 +1,320 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, abort, send_from_directory
 import os
 import json
-import base64
-import requests
-from io import BytesIO
-from generation import generate_characters_description, get_panels, generate_comic
-from create_strip import create_strip
+import queue
+from pipeline import (
+    SCRIPT_MODES,
+    ImageSettings,
+    parse_flag,
+    storage,
+    run_comic_pipeline,
+    get_session,
+    edit_panel,
+)
+from encoding import OUTPUT_FORMATS
+from jobs import initialize_job_manager, QueueFullError
+from sessions import SessionBusyError, SessionNotFoundError
+from metrics import REGISTRY, register_status
+from scheduler import request_context_from, set_request_context, request_context_var
+from tracing import configure_logging, set_trace_id, get_trace_id, trace_id_var, logger
 from dotenv import load_dotenv
 
 load_dotenv()
+configure_logging()
 
 app = Flask(__name__)
 
-# Fixed parameters for comic generation
-FIXED_NUM_CHARACTERS = 2
-FIXED_STYLE = "manga, black and white"
-AUTO_GENERATE_CHARACTERS = True
+job_manager = initialize_job_manager()
+register_status("comic_jobs", job_manager.get_status, {'active': 'gauge', 'tracked': 'gauge'})
 
-def upload_to_imgbb(image, api_key):
-    """Upload image to imgbb and return the URL"""
+
+@app.before_request
+def start_trace():
+    """Tag the request with the caller's X-Request-ID or a fresh trace id"""
+    g.trace_token = set_trace_id(request.headers.get('X-Request-ID'))
+
+
+@app.after_request
+def add_trace_header(response):
+    response.headers['X-Request-ID'] = get_trace_id()
+    return response
+
+
+@app.teardown_request
+def end_trace(error=None):
+    token = g.pop('context_token', None)
+    if token is not None:
+        request_context_var.reset(token)
+    token = g.pop('trace_token', None)
+    if token is not None:
+        trace_id_var.reset(token)
+
+
+def wants_async(data):
+    """Whether the client asked for job-submission mode"""
+    flag = data.get('async', request.args.get('async', False))
+    return str(flag).lower() in ('1', 'true', 'yes')
+
+
+def image_settings_error(data):
+    """Error response for an invalid generation profile or seed, else None"""
     try:
-        # Convert PIL image to base64
-        buffer = BytesIO()
-        image.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        
-        # Upload to imgbb
-        url = "https://api.imgbb.com/1/upload"
-        payload = {
-            "key": api_key,
-            "image": img_str,
-        }
-        
-        response = requests.post(url, data=payload)
-        result = response.json()
-        
-        if result.get("success"):
-            return result["data"]["url"]
-        else:
-            raise Exception(f"imgbb upload failed: {result.get('error', {}).get('message', 'Unknown error')}")
-            
-    except Exception as e:
-        print(f"Error uploading to imgbb: {e}")
-        raise
+        ImageSettings(data.get('profile'), data.get('seed'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return None
+
+
+def enter_request_context(data, default_priority):
+    """Set the scheduling context (tenant, priority, deadline) for this request.
+
+    Returns an error response for an invalid priority or timeout, else None.
+    Jobs and panel threads inherit the context with the trace id.
+    """
+    try:
+        context = request_context_from(
+            request.headers.get('X-Tenant-ID') or data.get('tenant') or request.remote_addr,
+            data.get('priority'),
+            data.get('timeout'),
+            default_priority,
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    g.context_token = set_request_context(context)
+    return None
+
 
 @app.route('/generate-comic', methods=['POST'])
 def generate_comic_strip():
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         story = data.get('story')
-        
+
         if not story:
             return jsonify({"error": "Story is required"}), 400
-            
+
+        script_mode = data.get('script_mode')
+        if script_mode and script_mode not in SCRIPT_MODES:
+            return jsonify({"error": f"script_mode must be one of {', '.join(SCRIPT_MODES)}"}), 400
+
+        output_format = data.get('output_format')
+        if output_format and output_format not in OUTPUT_FORMATS:
+            return jsonify({"error": f"output_format must be one of {', '.join(OUTPUT_FORMATS)}"}), 400
+
+        error = image_settings_error(data)
+        if error:
+            return error
+
         imgbb_api_key = os.getenv('IMGBB_API_KEY')
-        if not imgbb_api_key:
+        if storage.backend.requires_api_key and not imgbb_api_key:
             return jsonify({"error": "IMGBB_API_KEY not configured"}), 500
-        
-        print(f"🎨 Starting comic generation for story: {story[:100]}...")
-        
-        # Generate character descriptions automatically
-        characters_description = generate_characters_description(story)
-        print(f"📝 Generated characters: {characters_description}")
-        
-        # Create scenario with characters
-        scenario = f"Characters: {characters_description}\nStory: {story}"
-        
-        # Generate panels
-        panels = get_panels(scenario, FIXED_STYLE)
-        print(f"📋 Generated {len(panels)} panels")
-        
-        # Generate comic images (returns PIL Image directly)
-        comic_image = generate_comic(panels, FIXED_STYLE, characters_description)
-        
-        if not comic_image:
-            return jsonify({"error": "Comic generation failed - no image generated"}), 500
-            
-        # Upload the comic strip directly to imgbb (no local file needed)
-        comic_url = upload_to_imgbb(comic_image, imgbb_api_key)
-        
-        print(f"✅ Comic uploaded to: {comic_url}")
-        
-        # Prepare panel data for response
-        panel_data = []
-        for i, panel in enumerate(panels):
-            panel_data.append({
-                "panelNumber": i + 1,
-                "description": panel.get("description", ""),
-                "text": panel.get("text", ""),
-            })
-        
-        return jsonify({
-            "success": True,
-            "comic_url": comic_url,
-            "panels": panel_data,
-            "characters_description": characters_description,
-            "style": FIXED_STYLE
-        })
-        
+
+        panel_uploads = parse_flag(data.get('panel_uploads'))
+
+        # Queued jobs are background work unless the client says otherwise
+        error = enter_request_context(data, "batch" if wants_async(data) else "interactive")
+        if error:
+            return error
+
+        if wants_async(data):
+            try:
+                job_id = job_manager.submit(
+                    run_comic_pipeline, story, imgbb_api_key,
+                    script_mode=script_mode, output_format=output_format, panel_uploads=panel_uploads,
+                    profile=data.get('profile'), seed=data.get('seed'),
+                )
+            except QueueFullError as e:
+                response = jsonify({"error": str(e)})
+                response.headers['Retry-After'] = '30'
+                return response, 429
+
+            logger.info(f"📥 Queued comic job {job_id}")
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "status_url": f"/jobs/{job_id}",
+                "result_url": f"/jobs/{job_id}/result",
+            }), 202
+
+        return jsonify(run_comic_pipeline(
+            story, imgbb_api_key, script_mode=script_mode, output_format=output_format, panel_uploads=panel_uploads,
+            profile=data.get('profile'), seed=data.get('seed'),
+        ))
+
+    except Exception as e:
+        logger.error(f"❌ Comic generation error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def sse_event(event, payload):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.route('/generate-comic/stream', methods=['POST'])
+def generate_comic_stream():
+    """Run the pipeline as a job and stream its intermediate results over SSE.
+
+    Events: job, characters, script, panel (one per panel, with a thumbnail),
+    strip, complete or error. With REFINE_MODE "stream" panels render while
+    the script is written: a first script event has no panels and
+    "streaming" true, and the full script event comes once it is finished,
+    usually after some panel events. The job keeps running if the client disconnects
+    and its result stays available from /jobs/<id>/result.
+    """
+    data = request.get_json(silent=True) or {}
+    story = data.get('story')
+
+    if not story:
+        return jsonify({"error": "Story is required"}), 400
+
+    script_mode = data.get('script_mode')
+    if script_mode and script_mode not in SCRIPT_MODES:
+        return jsonify({"error": f"script_mode must be one of {', '.join(SCRIPT_MODES)}"}), 400
+
+    output_format = data.get('output_format')
+    if output_format and output_format not in OUTPUT_FORMATS:
+        return jsonify({"error": f"output_format must be one of {', '.join(OUTPUT_FORMATS)}"}), 400
+
+    error = image_settings_error(data)
+    if error:
+        return error
+
+    imgbb_api_key = os.getenv('IMGBB_API_KEY')
+    if storage.backend.requires_api_key and not imgbb_api_key:
+        return jsonify({"error": "IMGBB_API_KEY not configured"}), 500
+
+    error = enter_request_context(data, "interactive")
+    if error:
+        return error
+
+    events = queue.Queue()
+
+    def run(*args, **kwargs):
+        try:
+            result = run_comic_pipeline(*args, **kwargs)
+            events.put(("complete", result))
+            return result
+        except Exception as e:
+            events.put(("error", {"error": str(e)}))
+            raise
+
+    try:
+        job_id = job_manager.submit(
+            run, story, imgbb_api_key, script_mode=script_mode, output_format=output_format,
+            panel_uploads=parse_flag(data.get('panel_uploads')),
+            profile=data.get('profile'), seed=data.get('seed'),
+            on_event=lambda event, payload: events.put((event, payload)),
+        )
+    except QueueFullError as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+
+    logger.info(f"📡 Streaming comic job {job_id}")
+
+    def stream():
+        yield sse_event("job", {"job_id": job_id, "status_url": f"/jobs/{job_id}"})
+        while True:
+            try:
+                event, payload = events.get(timeout=15)
+            except queue.Empty:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_event(event, payload)
+            if event in ("complete", "error"):
+                break
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify({
+        "job_id": job_id,
+        "status": job["status"],
+        "stages": job["stages"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "error": job["error"],
+    })
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    if job["status"] == "completed":
+        return jsonify(job["result"])
+    if job["status"] == "failed":
+        return jsonify({"error": job["error"]}), 500
+
+    return jsonify({"job_id": job_id, "status": job["status"]}), 202
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+def get_comic_session(session_id):
+    try:
+        return jsonify(get_session(session_id))
+    except SessionNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.route('/sessions/<session_id>/panels/<int:panel_number>', methods=['POST'])
+def edit_comic_panel(session_id, panel_number):
+    """Re-render or re-caption one panel of a stored comic and re-upload its strip.
+
+    Body fields (all optional, at least one required): text, description,
+    seed, profile, regenerate. See pipeline.edit_panel.
+    """
+    data = request.get_json(silent=True) or {}
+
+    imgbb_api_key = os.getenv('IMGBB_API_KEY')
+    if storage.backend.requires_api_key and not imgbb_api_key:
+        return jsonify({"error": "IMGBB_API_KEY not configured"}), 500
+
+    error = enter_request_context(data, "interactive")
+    if error:
+        return error
+
+    try:
+        return jsonify(edit_panel(
+            session_id, panel_number, imgbb_api_key,
+            text=data.get('text'), description=data.get('description'), seed=data.get('seed'),
+            profile=data.get('profile'), regenerate=bool(parse_flag(data.get('regenerate'))),
+        ))
+    except SessionNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except SessionBusyError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"❌ Comic generation error: {e}")
+        logger.error(f"❌ Panel edit error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/comics/<path:filename>', methods=['GET'])
+def get_comic_file(filename):
+    """Serve strips written by the local storage backend"""
+    if storage.backend.name != "local":
+        abort(404)
+    return send_from_directory(storage.backend.directory, filename)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "OK", "message": "Comic generation server is running"})
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5001, host="0.0.0.0")
+    # Development only; use start.py for the production server
+    app.run(debug=os.getenv('FLASK_DEBUG', 'true').lower() in ('1', 'true', 'yes'), port=5001, host="0.0.0.0")
@@ -0,0 +1,325 @@
+"""
+ASGI variant of the comic generation server
+Same routes as app.py, served by Quart on one event loop: comics run as
+coroutines instead of holding a thread each, so one process can hold
+hundreds of them in flight.
+"""
+import asyncio
+import json
+import os
+
+from quart import Quart, request, jsonify, Response, g, abort, send_from_directory
+from dotenv import load_dotenv
+
+from pipeline import (
+    SCRIPT_MODES, ImageSettings, parse_flag, storage, arun_comic_pipeline, get_session, aedit_panel,
+)
+from encoding import OUTPUT_FORMATS
+from jobs import initialize_job_manager, QueueFullError
+from sessions import SessionBusyError, SessionNotFoundError
+from metrics import REGISTRY, register_status
+from scheduler import request_context_from, set_request_context, request_context_var
+from tracing import configure_logging, set_trace_id, get_trace_id, trace_id_var, logger
+from utils import aclose_async_http_client
+
+load_dotenv()
+configure_logging()
+
+app = Quart(__name__)
+
+job_manager = initialize_job_manager()
+register_status("comic_jobs", job_manager.get_status, {'active': 'gauge', 'tracked': 'gauge'})
+
+# Comics awaited directly by /generate-comic at the same time in this process
+ASYNC_MAX_COMICS = int(os.getenv("ASYNC_MAX_COMICS", 200))
+comic_slots = {"active": 0}
+register_status("comic_async", lambda: comic_slots, {'active': 'gauge'})
+
+
+@app.before_request
+async def start_trace():
+    """Tag the request with the caller's X-Request-ID or a fresh trace id"""
+    g.trace_token = set_trace_id(request.headers.get('X-Request-ID'))
+
+
+@app.after_request
+async def add_trace_header(response):
+    response.headers['X-Request-ID'] = get_trace_id()
+    return response
+
+
+@app.teardown_request
+async def end_trace(error=None):
+    token = g.pop('context_token', None)
+    if token is not None:
+        request_context_var.reset(token)
+    token = g.pop('trace_token', None)
+    if token is not None:
+        trace_id_var.reset(token)
+
+
+@app.after_serving
+async def drain_jobs():
+    """Let running comic jobs and background uploads finish, then release this loop's HTTP clients"""
+    await job_manager.ashutdown()
+    await asyncio.to_thread(storage.shutdown)
+    await aclose_async_http_client()
+
+
+def too_busy(message):
+    response = jsonify({"error": message})
+    response.headers['Retry-After'] = '30'
+    return response, 429
+
+
+async def read_comic_request():
+    """Validate the request body; returns (data, error_response)"""
+    data = await request.get_json(silent=True) or {}
+    if not data.get('story'):
+        return data, (jsonify({"error": "Story is required"}), 400)
+
+    script_mode = data.get('script_mode')
+    if script_mode and script_mode not in SCRIPT_MODES:
+        return data, (jsonify({"error": f"script_mode must be one of {', '.join(SCRIPT_MODES)}"}), 400)
+
+    output_format = data.get('output_format')
+    if output_format and output_format not in OUTPUT_FORMATS:
+        return data, (jsonify({"error": f"output_format must be one of {', '.join(OUTPUT_FORMATS)}"}), 400)
+
+    try:
+        ImageSettings(data.get('profile'), data.get('seed'))
+    except ValueError as e:
+        return data, (jsonify({"error": str(e)}), 400)
+
+    if storage.backend.requires_api_key and not os.getenv('IMGBB_API_KEY'):
+        return data, (jsonify({"error": "IMGBB_API_KEY not configured"}), 500)
+
+    # Scheduling context (tenant, priority, deadline), inherited by jobs and panels.
+    # Queued jobs are background work unless the client says otherwise
+    try:
+        g.request_context = request_context_from(
+            request.headers.get('X-Tenant-ID') or data.get('tenant') or request.remote_addr,
+            data.get('priority'),
+            data.get('timeout'),
+            "batch" if wants_async(data) else "interactive",
+        )
+    except (TypeError, ValueError) as e:
+        return data, (jsonify({"error": str(e)}), 400)
+    g.context_token = set_request_context(g.request_context)
+    return data, None
+
+
+def wants_async(data):
+    """Whether the client asked for job-submission mode"""
+    flag = data.get('async', request.args.get('async', False))
+    return str(flag).lower() in ('1', 'true', 'yes')
+
+
+@app.route('/generate-comic', methods=['POST'])
+async def generate_comic_strip():
+    try:
+        data, error = await read_comic_request()
+        if error:
+            return error
+        imgbb_api_key = os.getenv('IMGBB_API_KEY')
+
+        if wants_async(data):
+            try:
+                job_id = job_manager.asubmit(
+                    arun_comic_pipeline, data['story'], imgbb_api_key,
+                    script_mode=data.get('script_mode'), output_format=data.get('output_format'),
+                    panel_uploads=parse_flag(data.get('panel_uploads')),
+                    profile=data.get('profile'), seed=data.get('seed'),
+                )
+            except QueueFullError as e:
+                return too_busy(str(e))
+
+            logger.info(f"📥 Queued comic job {job_id}")
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "status_url": f"/jobs/{job_id}",
+                "result_url": f"/jobs/{job_id}/result",
+            }), 202
+
+        if comic_slots["active"] >= ASYNC_MAX_COMICS:
+            return too_busy(f"Server is busy ({comic_slots['active']} comics in progress)")
+
+        comic_slots["active"] += 1
+        try:
+            result = await arun_comic_pipeline(
+                data['story'], imgbb_api_key,
+                script_mode=data.get('script_mode'), output_format=data.get('output_format'),
+                panel_uploads=parse_flag(data.get('panel_uploads')),
+                profile=data.get('profile'), seed=data.get('seed'),
+            )
+        except asyncio.CancelledError:
+            # Client went away: drop this comic's panels still waiting for Stability
+            g.request_context.cancel()
+            raise
+        finally:
+            comic_slots["active"] -= 1
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error(f"❌ Comic generation error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+def sse_event(event, payload):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.route('/generate-comic/stream', methods=['POST'])
+async def generate_comic_stream():
+    """Run the pipeline as a job and stream its intermediate results over SSE.
+
+    Same events as the Flask server: job, characters, script, panel, strip,
+    complete or error (and the provisional script event of REFINE_MODE "stream").
+    """
+    data, error = await read_comic_request()
+    if error:
+        return error
+
+    events = asyncio.Queue()
+
+    async def run(*args, **kwargs):
+        try:
+            result = await arun_comic_pipeline(*args, **kwargs)
+            events.put_nowait(("complete", result))
+            return result
+        except Exception as e:
+            events.put_nowait(("error", {"error": str(e)}))
+            raise
+
+    try:
+        job_id = job_manager.asubmit(
+            run, data['story'], os.getenv('IMGBB_API_KEY'),
+            script_mode=data.get('script_mode'), output_format=data.get('output_format'),
+            panel_uploads=parse_flag(data.get('panel_uploads')),
+            profile=data.get('profile'), seed=data.get('seed'),
+            on_event=lambda event, payload: events.put_nowait((event, payload)),
+        )
+    except QueueFullError as e:
+        return too_busy(str(e))
+
+    logger.info(f"📡 Streaming comic job {job_id}")
+
+    async def stream():
+        yield sse_event("job", {"job_id": job_id, "status_url": f"/jobs/{job_id}"})
+        while True:
+            try:
+                event, payload = await asyncio.wait_for(events.get(), timeout=15)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_event(event, payload)
+            if event in ("complete", "error"):
+                break
+
+    response = Response(
+        stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    response.timeout = None
+    return response
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+async def get_job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify({
+        "job_id": job_id,
+        "status": job["status"],
+        "stages": job["stages"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "error": job["error"],
+    })
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+async def get_job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    if job["status"] == "completed":
+        return jsonify(job["result"])
+    if job["status"] == "failed":
+        return jsonify({"error": job["error"]}), 500
+
+    return jsonify({"job_id": job_id, "status": job["status"]}), 202
+
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+async def get_comic_session(session_id):
+    try:
+        return jsonify(await asyncio.to_thread(get_session, session_id))
+    except SessionNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@app.route('/sessions/<session_id>/panels/<int:panel_number>', methods=['POST'])
+async def edit_comic_panel(session_id, panel_number):
+    """Re-render or re-caption one panel of a stored comic, like the Flask route"""
+    data = await request.get_json(silent=True) or {}
+
+    imgbb_api_key = os.getenv('IMGBB_API_KEY')
+    if storage.backend.requires_api_key and not imgbb_api_key:
+        return jsonify({"error": "IMGBB_API_KEY not configured"}), 500
+
+    try:
+        context = request_context_from(
+            request.headers.get('X-Tenant-ID') or data.get('tenant') or request.remote_addr,
+            data.get('priority'),
+            data.get('timeout'),
+            "interactive",
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    g.context_token = set_request_context(context)
+
+    try:
+        return jsonify(await aedit_panel(
+            session_id, panel_number, imgbb_api_key,
+            text=data.get('text'), description=data.get('description'), seed=data.get('seed'),
+            profile=data.get('profile'), regenerate=bool(parse_flag(data.get('regenerate'))),
+        ))
+    except asyncio.CancelledError:
+        context.cancel()
+        raise
+    except SessionNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except SessionBusyError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"❌ Panel edit error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/comics/<path:filename>', methods=['GET'])
+async def get_comic_file(filename):
+    """Serve strips written by the local storage backend"""
+    if storage.backend.name != "local":
+        abort(404)
+    return await send_from_directory(storage.backend.directory, filename)
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    return jsonify({"status": "OK", "message": "Comic generation server is running"})
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    # Reads the other workers' snapshots when there are several
+    return Response(await asyncio.to_thread(REGISTRY.render), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1 @@
+"""Offline benchmark harness for the comic generation pipeline"""
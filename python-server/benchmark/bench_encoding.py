@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for strip output formats
+
+Encodes one strip in every OUTPUT_FORMATS entry and uploads it to a local
+imgbb stand-in, reporting encode time, encoded bytes and upload latency.
+The legacy row is the original base64 PNG form upload.
+
+Usage (from python-server/):
+    python -m benchmark.bench_encoding --bandwidth-mbps 20
+    python -m benchmark.bench_encoding --image strip.png --max-kb 400
+"""
+
+import argparse
+import base64
+import io
+import statistics
+import time
+
+import requests
+from PIL import Image
+
+from benchmark.fakes import FakeImgbbServer, synthetic_image
+from compositing import IncrementalStripBuilder
+from encoding import OUTPUT_FORMATS, encode_image
+from storage import imgbb_files
+
+
+def sample_strip():
+    """Six synthetic panels composed like a real comic"""
+    builder = IncrementalStripBuilder(6)
+    for i in range(6):
+        builder.add_panel(i, synthetic_image(1024, 1024, seed=i), f"Mika: This is panel {i + 1}.\nRen: Let's keep going.")
+    return builder.result()
+
+
+def legacy_upload(image, url):
+    started = time.perf_counter()
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    img_str = base64.b64encode(buffer.getvalue()).decode()
+    encoded = time.perf_counter()
+    requests.post(url, data={"key": "bench", "image": img_str}).json()
+    return encoded - started, time.perf_counter() - encoded, len(img_str)
+
+
+def format_upload(image, url, format, quality, max_bytes):
+    started = time.perf_counter()
+    encoded = encode_image(image, format, quality, max_bytes)
+    done = time.perf_counter()
+    requests.post(url, data={"key": "bench"}, files=imgbb_files(encoded)).json()
+    return done - started, time.perf_counter() - done, len(encoded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Output encoding benchmark")
+    parser.add_argument("--image", help="strip to encode (defaults to a synthetic one)")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--quality", type=int, default=None, help="lossy quality (default OUTPUT_QUALITY)")
+    parser.add_argument("--max-kb", type=int, default=0, help="size target in KiB (0 = none)")
+    parser.add_argument("--latency", type=float, default=0.05, help="fixed fake upload latency, seconds")
+    parser.add_argument("--bandwidth-mbps", type=float, default=20, help="simulated uplink, Mbit/s (0 = unlimited)")
+    args = parser.parse_args()
+
+    image = Image.open(args.image).convert("RGB") if args.image else sample_strip()
+    imgbb = FakeImgbbServer(latency=args.latency, bandwidth=args.bandwidth_mbps * 125_000).start()
+
+    runs = [("legacy (b64 png)", lambda: legacy_upload(image, imgbb.upload_url))]
+    for format in OUTPUT_FORMATS:
+        runs.append((format, lambda format=format: format_upload(
+            image, imgbb.upload_url, format, args.quality, args.max_kb * 1024,
+        )))
+
+    print(f"\n🗜️ Encoding benchmark ({image.width}x{image.height}, {args.bandwidth_mbps} Mbit/s uplink)")
+    print("=" * 72)
+    print(f"{'format':<18} {'bytes':>10} {'encode':>10} {'upload':>10} {'total':>10}")
+    for name, run in runs:
+        results = [run() for _ in range(args.iterations)]
+        encode = statistics.median(r[0] for r in results)
+        upload = statistics.median(r[1] for r in results)
+        size = results[-1][2]
+        print(f"{name:<18} {size / 1024:>8.0f}KB {encode * 1000:>8.0f}ms {upload * 1000:>8.0f}ms "
+              f"{(encode + upload) * 1000:>8.0f}ms")
+
+    imgbb.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+Local stand-ins for the external services used by the comic pipeline
+- FakeGroqServer: Groq-compatible chat completions endpoint with canned answers,
+  streamed line by line when the request asks for it
+- FakeStabilityServer: Stability gRPC GenerationService returning synthetic images
+- FakeStabilityRestServer: Stability REST text-to-image endpoint (asyncio pipeline)
+- FakeImgbbServer: imgbb-compatible upload endpoint
+- FakeS3Server: S3-compatible PutObject endpoint (path-style buckets)
+"""
+
+import base64
+import io
+import json
+import re
+import threading
+import time
+import uuid
+from concurrent import futures
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+from PIL import Image, ImageDraw
+import stability_sdk.interfaces.gooseai.generation.generation_pb2 as generation
+import stability_sdk.interfaces.gooseai.generation.generation_pb2_grpc as generation_grpc
+
+CHARACTERS = (
+    "Mika: A short girl with black bob hair wearing a school uniform.\n"
+    "Ren: A tall boy with spiky white hair wearing a hoodie."
+)
+
+PANEL_SCRIPT = "\n".join(
+    f"# Panel {i}\n"
+    f"description: a short girl with black bob hair, a tall boy with spiky white hair, scene {i}, city street\n"
+    f"text:\n```\nMika: This is panel {i}.\nRen: Let's keep going.\n```\n# end"
+    for i in range(1, 7)
+)
+
+REFINED_PROMPT = "a short girl with black bob hair and a tall boy with spiky white hair, standing on a city street"
+
+
+def canned_completion(prompt):
+    """Pick the canned answer matching the prompt template that was sent"""
+    if "JSON with the characters" in prompt:
+        return json.dumps({
+            "characters": CHARACTERS,
+            "panels": [
+                {"description": f"a short girl with black bob hair, a tall boy, scene {i}", "text": f"Mika: Panel {i}."}
+                for i in range(1, 7)
+            ],
+        })
+    if "JSON array of strings" in prompt:
+        # Only count the panels after the example section
+        panels = prompt[prompt.rfind("Characters:"):]
+        count = len(re.findall(r'^Panel \d+:', panels, re.MULTILINE)) or 6
+        return json.dumps([f"{REFINED_PROMPT}, scene {i + 1}" for i in range(count)])
+    if "Split the scenario" in prompt:
+        return PANEL_SCRIPT
+    if "Description of Characters" in prompt:
+        return CHARACTERS
+    # Per-panel refinement: keep panels distinct so their images are not coalesced
+    scene = re.findall(r'scene (\d+)', prompt)
+    return f"{REFINED_PROMPT}, scene {scene[-1]}" if scene else REFINED_PROMPT
+
+
+class _Server:
+    """Run an HTTP server on a background thread on an ephemeral port"""
+
+    handler = None
+
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        handler = type("Handler", (self.handler,), {"fake": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self):
+        with self.lock:
+            self.requests += 1
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+
+class _GroqHandler(_JsonHandler):
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            return self.send_json(404, {"error": {"message": "not found"}})
+
+        request = json.loads(self.read_body() or b"{}")
+        self.fake.count()
+
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        content = canned_completion(prompt)
+        if request.get("stream"):
+            return self.send_stream(request, content)
+
+        time.sleep(self.fake.latency)
+        self.send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": (len(prompt) + len(content)) // 4,
+            },
+        })
+
+
+    def send_stream(self, request, content):
+        """Server-sent chunks, one line each, with the latency spread over them"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        lines = content.splitlines(keepends=True) or [content]
+
+        def chunk(delta, finish_reason=None):
+            payload = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+            self.wfile.flush()
+
+        chunk({"role": "assistant", "content": ""})
+        for line in lines:
+            time.sleep(self.fake.latency / len(lines))
+            chunk({"content": line})
+        chunk({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class FakeGroqServer(_Server):
+    """Groq-compatible chat endpoint; point GROQ_API_BASE at .url"""
+
+    handler = _GroqHandler
+
+
+class _ImgbbHandler(_JsonHandler):
+    def do_POST(self):
+        body = self.read_body()
+        self.fake.count()
+        # Simulated transfer time on top of the fixed latency
+        transfer = len(body) / self.fake.bandwidth if self.fake.bandwidth else 0
+        time.sleep(self.fake.latency + transfer)
+        with self.fake.lock:
+            self.fake.bytes_received += len(body)
+        # Multipart uploads carry a file name; base64 form uploads are PNG
+        match = re.search(rb'filename="[^"]*\.(\w+)"', body[:1024])
+        extension = match.group(1).decode() if match else "png"
+        name = uuid.uuid4().hex
+        self.send_json(200, {
+            "success": True,
+            "data": {"url": f"{self.fake.url}/images/{name}.{extension}"},
+            "status": 200,
+        })
+
+
+class FakeImgbbServer(_Server):
+    """imgbb-compatible upload endpoint; point IMGBB_UPLOAD_URL at .upload_url
+
+    bandwidth (bytes per second, 0 = unlimited) adds a size-dependent delay.
+    """
+
+    handler = _ImgbbHandler
+
+    def __init__(self, *args, bandwidth=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bandwidth = bandwidth
+        self.bytes_received = 0
+
+    @property
+    def upload_url(self):
+        return f"{self.url}/1/upload"
+
+
+class _S3Handler(_JsonHandler):
+    # HTTP/1.1 so boto3's "Expect: 100-continue" is answered instead of timing out
+    protocol_version = "HTTP/1.1"
+
+    def do_PUT(self):
+        body = self.read_body()
+        self.fake.count()
+        time.sleep(self.fake.latency)
+        with self.fake.lock:
+            # The first `errors` uploads fail to exercise client retries
+            if self.fake.errors > 0:
+                self.fake.errors -= 1
+                fail = True
+            else:
+                fail = False
+                self.fake.objects[self.path] = body
+                self.fake.bytes_received += len(body)
+        if fail:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", f'"{uuid.uuid4().hex}"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class FakeS3Server(_Server):
+    """S3-compatible object store; point S3_ENDPOINT_URL at .url
+
+    Objects are kept in memory under their request path (/bucket/key).
+    """
+
+    handler = _S3Handler
+
+    def __init__(self, *args, errors=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.errors = errors
+        self.objects = {}
+        self.bytes_received = 0
+
+
+def synthetic_image(width, height, seed=0):
+    """Black and white line art roughly as compressible as a real manga panel"""
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    step = max(8, width // 64)
+    for i in range(0, width + height, step):
+        offset = (seed + i * 7) % step
+        draw.line([(i + offset, 0), (0, i + offset)], fill=0, width=2)
+    draw.ellipse([width // 4, height // 4, width * 3 // 4, height * 3 // 4], outline=0, width=6)
+    return image.convert("RGB")
+
+
+@lru_cache(maxsize=None)
+def synthetic_png(width, height):
+    """PNG bytes of the synthetic image, rendered once per size"""
+    buffer = io.BytesIO()
+    synthetic_image(width, height).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class _GenerationServicer(generation_grpc.GenerationServiceServicer):
+    def __init__(self, fake):
+        self.fake = fake
+
+    def Generate(self, request, context):
+        self.fake.count(max(1, request.image.samples or 1))
+        time.sleep(self.fake.latency)
+        params = request.image
+        width, height = params.width or 1024, params.height or 1024
+        png = synthetic_png(width, height)
+
+        artifacts = [
+            generation.Artifact(
+                id=i,
+                type=generation.ARTIFACT_IMAGE,
+                mime="image/png",
+                binary=png,
+                seed=(params.seed[0] if params.seed else 0) + i,
+                finish_reason=generation.NULL,
+            )
+            for i in range(max(1, params.samples or 1))
+        ]
+        yield generation.Answer(
+            answer_id=uuid.uuid4().hex,
+            request_id=request.request_id,
+            artifacts=artifacts,
+        )
+
+
+class FakeStabilityServer:
+    """Insecure gRPC GenerationService; point STABILITY_HOST at .host"""
+
+    def __init__(self, latency=0.0, max_workers=64, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.requests = 0
+        self.images = 0
+        self.lock = threading.Lock()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+        generation_grpc.add_GenerationServiceServicer_to_server(_GenerationServicer(self), self.server)
+        self.port = self.server.add_insecure_port(f"{host}:{port}")
+        self.host = f"{host}:{self.port}"
+
+    def count(self, images=1):
+        with self.lock:
+            self.requests += 1
+            self.images += images
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.server.stop(grace=None)
+
+
+def rest_artifacts(request):
+    samples = max(1, request.get("samples") or 1)
+    png = base64.b64encode(synthetic_png(request.get("width") or 1024, request.get("height") or 1024)).decode()
+    return [
+        {"base64": png, "seed": (request.get("seed") or 0) + i, "finishReason": "SUCCESS"}
+        for i in range(samples)
+    ]
+
+
+class _StabilityRestHandler(_JsonHandler):
+    def do_POST(self):
+        if self.path.endswith("/batch"):
+            return self.batch()
+        if not self.path.endswith("/text-to-image"):
+            return self.send_json(404, {"message": "not found"})
+
+        request = json.loads(self.read_body() or b"{}")
+        self.fake.count(max(1, request.get("samples") or 1))
+        time.sleep(self.fake.latency)
+        self.send_json(200, {"artifacts": rest_artifacts(request)})
+
+    def batch(self):
+        """Several text-to-image requests in one call, like a batching inference server"""
+        requests = json.loads(self.read_body() or b"{}").get("requests", [])
+        self.fake.count(sum(max(1, request.get("samples") or 1) for request in requests))
+        # A batch shares the GPU pass: each extra image adds only batch_overhead of a call
+        time.sleep(self.fake.latency * (1 + self.fake.batch_overhead * max(0, len(requests) - 1)))
+        self.send_json(200, {"results": [{"artifacts": rest_artifacts(request)} for request in requests]})
+
+
+class FakeStabilityRestServer(_Server):
+    """Stability REST text-to-image endpoint; point STABILITY_API_HOST at .url.
+
+    POST .batch_url takes {"requests": [...]} and answers {"results": [...]}.
+    """
+
+    handler = _StabilityRestHandler
+
+    def __init__(self, *args, batch_overhead=0.25, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.images = 0
+        self.batch_overhead = batch_overhead
+
+    @property
+    def batch_url(self):
+        return f"{self.url}/v1/generation/batch"
+
+    def count(self, images=1):
+        with self.lock:
+            self.requests += 1
+            self.images += images
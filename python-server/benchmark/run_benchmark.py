@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the comic generation pipeline
+
+Starts local stand-ins for Groq, Stability and imgbb (or S3), then drives
+app.generate_comic_strip through the Flask test client and reports
+latency percentiles, throughput and per-stage timings.
+
+Usage (from python-server/):
+    python -m benchmark.run_benchmark --requests 24 --concurrency 6
+    python -m benchmark.run_benchmark --save-baseline benchmark/baseline.json
+    python -m benchmark.run_benchmark --runtime asyncio
+    python -m benchmark.run_benchmark --storage s3 --background-upload
+    python -m benchmark.run_benchmark --cache --dedup
+    python -m benchmark.run_benchmark --batch 4 --batch-wait 0.05
+    python -m benchmark.run_benchmark --baseline benchmark/baseline.json --tolerance 0.15
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark.fakes import FakeGroqServer, FakeImgbbServer, FakeS3Server, FakeStabilityRestServer, FakeStabilityServer
+
+# Metrics compared in regression mode and whether higher values are better
+REGRESSION_METRICS = {
+    "p50": False,
+    "p95": False,
+    "throughput": True,
+}
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies):
+    return {
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "mean": round(statistics.mean(latencies), 3) if latencies else 0.0,
+    }
+
+
+def start_fakes(args):
+    """Start the fake backends and point the server configuration at them"""
+    groq = FakeGroqServer(latency=args.llm_latency).start()
+    if args.runtime == "asyncio" or args.batch:
+        stability = FakeStabilityRestServer(latency=args.image_latency).start()
+        os.environ["STABILITY_API_HOST"] = stability.url
+        if args.batch:
+            os.environ["STABILITY_BATCH_URL"] = stability.batch_url
+            os.environ["STABILITY_BATCH_MAX_SIZE"] = str(args.batch)
+            os.environ["STABILITY_BATCH_MAX_WAIT"] = str(args.batch_wait)
+    else:
+        stability = FakeStabilityServer(latency=args.image_latency).start()
+        os.environ["STABILITY_HOST"] = stability.host
+    os.environ["PIPELINE_RUNTIME"] = args.runtime
+    os.environ["STORAGE_BACKEND"] = args.storage
+    os.environ["STORAGE_BACKGROUND_UPLOAD"] = str(args.background_upload).lower()
+    uploads = None
+    if args.storage == "s3":
+        uploads = FakeS3Server(latency=args.upload_latency, errors=args.storage_errors).start()
+        os.environ["S3_BUCKET"] = "comics"
+        os.environ["S3_ENDPOINT_URL"] = uploads.url
+        os.environ["S3_ADDRESSING_STYLE"] = "path"
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "fake-access-key")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "fake-secret-key")
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    elif args.storage == "local":
+        os.environ.setdefault("STORAGE_LOCAL_DIR", os.path.join("cache", "benchmark-comics"))
+    else:
+        uploads = FakeImgbbServer(latency=args.upload_latency).start()
+        os.environ["IMGBB_API_KEY"] = "fake-imgbb-key"
+        os.environ["IMGBB_UPLOAD_URL"] = uploads.upload_url
+
+    os.environ["GROQ_API_KEY"] = "fake-groq-key"
+    os.environ["GROQ_API_BASE"] = groq.url
+    os.environ["STABILITY_KEY"] = ",".join(f"fake-stability-key-{i}" for i in range(args.keys))
+    os.environ["COMIC_DEDUP_ENABLED"] = str(args.dedup).lower()
+    if not args.cache:
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+        os.environ["IMAGE_CACHE_ENABLED"] = "false"
+    return groq, stability, uploads
+
+
+def run(args):
+    groq, stability, uploads = start_fakes(args)
+
+    # Import after the environment points at the fakes
+    from app import app
+
+    client = app.test_client()
+    stories = [
+        f"Story {i if not args.cache else 0}: two friends find a portal in their backyard and save the forest."
+        for i in range(args.requests)
+    ]
+
+    def one(story):
+        started = time.perf_counter()
+        response = client.post("/generate-comic", json={"story": story, **args.payload})
+        elapsed = time.perf_counter() - started
+        body = response.get_json(silent=True) or {}
+        return response.status_code, elapsed, body.get("timings", {})
+
+    for _ in range(args.warmup):
+        one("Warmup story about a cat and a dog.")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(one, stories))
+    wall = time.perf_counter() - started
+
+    # Let background uploads land before counting them
+    from pipeline import storage
+    storage.shutdown()
+
+    ok = [r for r in results if r[0] == 200]
+    latencies = [r[1] for r in ok]
+    stages = {}
+    for _, _, timings in ok:
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+
+    report = {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "llm_latency": args.llm_latency,
+            "image_latency": args.image_latency,
+            "upload_latency": args.upload_latency,
+            "keys": args.keys,
+            "cache": args.cache,
+            "dedup": args.dedup,
+            "batch": args.batch,
+            "runtime": args.runtime,
+            "storage": args.storage,
+            "background_upload": args.background_upload,
+            "payload": args.payload,
+        },
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_seconds": round(wall, 3),
+        "throughput": round(len(ok) / wall, 3) if wall else 0.0,
+        **summarize(latencies),
+        "stages": {stage: summarize(values) for stage, values in stages.items()},
+        "backend_calls": {
+            "groq": groq.requests,
+            "stability": stability.requests,
+            "stability_images": stability.images,
+            "storage": uploads.requests if uploads else 0,
+            "storage_bytes": uploads.bytes_received if uploads else 0,
+        },
+    }
+
+    for fake in (groq, stability, uploads):
+        if fake:
+            fake.stop()
+    return report
+
+
+def print_report(report):
+    print("\n📊 Benchmark results")
+    print("=" * 40)
+    print(f"Requests:   {report['succeeded']} ok, {report['failed']} failed")
+    print(f"Wall time:  {report['wall_seconds']}s")
+    print(f"Throughput: {report['throughput']} comics/s")
+    print(f"Latency:    p50={report['p50']}s p95={report['p95']}s p99={report['p99']}s")
+    print("Stages:")
+    for stage, summary in report["stages"].items():
+        print(f"   {stage:<12} p50={summary['p50']}s p95={summary['p95']}s")
+    print(f"Backend calls: {report['backend_calls']}")
+
+
+def compare(report, baseline, tolerance):
+    """Return human-readable regressions relative to the baseline"""
+    regressions = []
+    for metric, higher_is_better in REGRESSION_METRICS.items():
+        old, new = baseline.get(metric), report.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline comic pipeline benchmark")
+    parser.add_argument("--requests", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds per fake Groq call")
+    parser.add_argument("--image-latency", type=float, default=1.0, help="seconds per fake Stability call")
+    parser.add_argument("--upload-latency", type=float, default=0.2, help="seconds per fake imgbb upload")
+    parser.add_argument("--keys", type=int, default=2, help="number of fake Stability keys")
+    parser.add_argument("--cache", action="store_true", help="keep LLM/image caches on and repeat one story")
+    parser.add_argument("--dedup", action="store_true",
+                        help="coalesce identical requests (with --cache every request repeats one story)")
+    parser.add_argument("--batch", type=int, default=0,
+                        help="micro-batch up to N panels per Stability call through the fake batch endpoint")
+    parser.add_argument("--batch-wait", type=float, default=0.05, help="seconds a batch waits to fill")
+    parser.add_argument("--runtime", choices=["threads", "asyncio"], default="threads",
+                        help="pipeline implementation behind the sync route")
+    parser.add_argument("--storage", choices=["imgbb", "local", "s3"], default="imgbb",
+                        help="storage backend (imgbb and s3 use local stand-ins)")
+    parser.add_argument("--background-upload", action="store_true", help="upload strips in the background")
+    parser.add_argument("--storage-errors", type=int, default=0, help="initial fake S3 uploads that fail with 503")
+    parser.add_argument("--payload", type=json.loads, default={}, help="extra JSON fields for each request")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="compare against a stored report and fail on regressions")
+    parser.add_argument("--save-baseline", help="store this report as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("❌ Regressions against baseline:")
+            for regression in regressions:
+                print(f"   - {regression}")
+            sys.exit(1)
+        print("✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+In-memory compositing for captions and comic strips
+Fonts and text metrics are cached, and panels are scaled once straight into
+a canvas allocated at the final strip resolution.
+"""
+
+import os
+import threading
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manga-temple.ttf")
+
+# Caption geometry at full panel resolution
+CAPTION_WIDTH = 1024
+CAPTION_HEIGHT = 128
+CAPTION_FONT_SIZE = 30
+TEXT_COLOR = (0, 0, 0)
+
+# Strip geometry: full-resolution panels on a grid, downscaled to OUTPUT_SIZE
+PANEL_SIZE = (1024, 1024 + CAPTION_HEIGHT)
+COLUMNS, ROWS = 2, 3
+GAP = 10
+OUTPUT_SIZE = (1024, 1536)
+
+# Downscaling filter; with reducing_gap=1 Pillow box-reduces by the whole factor
+# first and only runs bicubic over the small remainder
+RESAMPLE = Image.Resampling.BICUBIC
+REDUCING_GAP = 1.0
+
+# Text measurement needs a draw context but no real pixels. Pillow's FreeType
+# calls hold the GIL, so cached fonts can be shared between threads.
+_measure_draw = ImageDraw.Draw(Image.new("L", (1, 1)))
+
+
+@lru_cache(maxsize=16)
+def load_font(size):
+    """Load the caption font once per size"""
+    return ImageFont.truetype(font=FONT_PATH, size=size)
+
+
+def measure_text(text, font):
+    """(width, height) of the rendered text, measured like ImageDraw.textbbox"""
+    if "\n" not in text:
+        _, _, width, height = font.getbbox(text)
+    else:
+        _, _, width, height = _measure_draw.multiline_textbbox((0, 0), text, font=font)
+    return width, height
+
+
+@lru_cache(maxsize=1024)
+def text_size(text, size):
+    """Cached measure_text for the caption font"""
+    return measure_text(text, load_font(size))
+
+
+def draw_caption(image, text, box, font_size=CAPTION_FONT_SIZE):
+    """Draw text centered in box (left, top, right, bottom) of image"""
+    if not text:
+        return
+    left, top, right, bottom = box
+    text_width, text_height = text_size(text, font_size)
+    x = left + (right - left - text_width) // 2
+    y = top + (bottom - top - text_height) // 2
+    ImageDraw.Draw(image).text((x, y), text, fill=TEXT_COLOR, font=load_font(font_size))
+
+
+class StripLayout:
+    """Slot boxes of the strip grid at output resolution"""
+
+    def __init__(self, panel_size=PANEL_SIZE, columns=COLUMNS, rows=ROWS, gap=GAP, output_size=OUTPUT_SIZE):
+        self.panel_size = panel_size
+        self.columns = columns
+        self.rows = rows
+        self.output_size = output_size
+        full_width = columns * panel_size[0] + (columns - 1) * gap
+        full_height = rows * panel_size[1] + (rows - 1) * gap
+        self.scale = (output_size[0] / full_width, output_size[1] / full_height)
+
+        self.slots = []
+        for i in range(columns * rows):
+            x = (i % columns) * (panel_size[0] + gap)
+            y = (i // columns) * (panel_size[1] + gap)
+            self.slots.append((
+                round(x * self.scale[0]),
+                round(y * self.scale[1]),
+                round((x + panel_size[0]) * self.scale[0]),
+                round((y + panel_size[1]) * self.scale[1]),
+            ))
+
+    def scaled(self, size):
+        """Size of a full-resolution image once placed on the strip"""
+        return max(1, round(size[0] * self.scale[0])), max(1, round(size[1] * self.scale[1]))
+
+    def caption_box(self, index):
+        """Area of slot index below the panel image, where its caption goes"""
+        left, top, right, bottom = self.slots[index]
+        return left, bottom - self.scaled((0, CAPTION_HEIGHT))[1], right, bottom
+
+    def new_canvas(self):
+        return Image.new("RGB", self.output_size, "white")
+
+    def paste(self, canvas, index, image):
+        """Scale a captioned panel once and paste it into slot index.
+
+        Panels of another size are centered on black, like the original
+        full-resolution grid did.
+        """
+        left, top, right, bottom = self.slots[index]
+        slot_size = (right - left, bottom - top)
+        if image.size == self.panel_size:
+            canvas.paste(image.resize(slot_size, RESAMPLE, reducing_gap=REDUCING_GAP), (left, top))
+            return
+
+        canvas.paste((0, 0, 0), (left, top, right, bottom))
+        scaled = image.resize(self.scaled(image.size), RESAMPLE, reducing_gap=REDUCING_GAP)
+        offset = ((slot_size[0] - scaled.width) // 2, (slot_size[1] - scaled.height) // 2)
+        crop = (max(0, -offset[0]), max(0, -offset[1]),
+                min(scaled.width, slot_size[0] - offset[0]), min(scaled.height, slot_size[1] - offset[1]))
+        canvas.paste(scaled.crop(crop), (left + max(0, offset[0]), top + max(0, offset[1])))
+
+
+    def image_size(self, index):
+        """Size of the uncaptioned panel image in slot index, above its caption"""
+        left, top, right, _ = self.caption_box(index)
+        return right - left, top - self.slots[index][1]
+
+    def fit_image(self, index, image):
+        """Uncaptioned panel scaled to its size in slot index"""
+        size = self.image_size(index)
+        if image.size == size:
+            return image
+        return image.resize(size, RESAMPLE, reducing_gap=REDUCING_GAP)
+
+    def paste_with_caption(self, canvas, index, image, text):
+        """Scale an uncaptioned panel into slot index and draw its caption at output resolution.
+
+        image may be None for a blank (placeholder) panel.
+        """
+        left, top, right, bottom = self.caption_box(index)
+        slot_top = self.slots[index][1]
+        canvas.paste("white", (left, slot_top, right, top))
+        if image is not None:
+            canvas.paste(self.fit_image(index, image), (left, slot_top))
+        # Drawn on its own image so a long caption is clipped to its box instead of
+        # spilling into a neighbouring slot that another thread may be pasting
+        caption = Image.new("RGB", (right - left, bottom - top), "white")
+        draw_caption(caption, text, (0, 0, caption.width, caption.height),
+                     max(1, round(CAPTION_FONT_SIZE * self.scale[0])))
+        canvas.paste(caption, (left, top))
+
+
+class IncrementalStripBuilder:
+    """Strip canvas that panels are pasted into as soon as they are ready.
+
+    Panels may arrive in any order and from several threads; each is
+    captioned and scaled straight into its slot, so the caller can drop the
+    full-resolution image right away.
+    """
+
+    def __init__(self, count=None, layout=None):
+        self.layout = layout or strip_layout(PANEL_SIZE)
+        # Like the original grid, panels beyond the last slot are left out.
+        # Without a count (script still streaming) every slot is expected
+        self.count = len(self.layout.slots) if count is None else min(count, len(self.layout.slots))
+        self.canvas = self.layout.new_canvas()
+        self.placed = set()
+        self.lock = threading.Lock()
+
+    def add_panel(self, index, image, text=None):
+        """Place an uncaptioned panel image, captioning it when text is given.
+
+        image may be None for a blank panel. Without text, image is treated
+        as already captioned.
+        """
+        if not self.fits(index):
+            return
+        # Slots never overlap, so threads can scale and paste concurrently
+        if text is None:
+            self.layout.paste(self.canvas, index, image)
+        else:
+            self.layout.paste_with_caption(self.canvas, index, image, text)
+        with self.lock:
+            self.placed.add(index)
+
+    def fits(self, index):
+        """Whether panel index has a slot on the strip"""
+        return index < len(self.layout.slots)
+
+    def slot_image(self, index):
+        """Copy of the composed slot, e.g. for a preview; None for a panel beyond the last slot"""
+        if not self.fits(index):
+            return None
+        return self.canvas.crop(self.layout.slots[index])
+
+    @property
+    def complete(self):
+        with self.lock:
+            return len(self.placed) >= self.count
+
+    def result(self):
+        """The composed strip; slots never filled stay white"""
+        return self.canvas
+
+
+@lru_cache(maxsize=8)
+def strip_layout(panel_size):
+    return StripLayout(panel_size=panel_size)
+
+
+def compose_strip(images):
+    """Compose captioned panels into a strip at output resolution"""
+    layout = strip_layout(images[0].size)
+    canvas = layout.new_canvas()
+    for i, image in enumerate(images[:len(layout.slots)]):
+        layout.paste(canvas, i, image)
+    return canvas
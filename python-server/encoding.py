@@ -0,0 +1,95 @@
+"""
+Output encoding for comic strips and panels
+Lossless PNG, palette PNG (small for black and white manga), WebP and
+progressive JPEG, with an optional size target
+"""
+
+import io
+import os
+
+from PIL import Image
+
+from metrics import timed
+
+# png: lossless RGB, png8: palette PNG, webp / jpeg: lossy with OUTPUT_QUALITY
+OUTPUT_FORMATS = ("png", "png8", "webp", "jpeg")
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "png")
+OUTPUT_QUALITY = int(os.getenv("OUTPUT_QUALITY", 85))
+# Palette size for png8; manga pages rarely need more than a few grey levels
+OUTPUT_PNG_COLORS = int(os.getenv("OUTPUT_PNG_COLORS", 32))
+# Upper bound on encoded size in bytes (0 = none); lossy formats lower their
+# quality and png8 its palette until the image fits
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_BYTES", 0))
+
+MIN_QUALITY = 40
+MIN_COLORS = 4
+
+MIME_TYPES = {"png": "image/png", "png8": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+EXTENSIONS = {"png": "png", "png8": "png", "webp": "webp", "jpeg": "jpg"}
+
+
+class EncodedImage:
+    """Encoded bytes of an image with the metadata needed to upload them"""
+
+    def __init__(self, data: bytes, format: str):
+        self.data = data
+        self.format = format
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES[self.format]
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS[self.format]
+
+    def __len__(self):
+        return len(self.data)
+
+
+def _save(image, format, quality, colors):
+    buffer = io.BytesIO()
+    if format == "png":
+        image.save(buffer, format="PNG")
+    elif format == "png8":
+        palette = image.convert("RGB").quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+        palette.save(buffer, format="PNG", optimize=True)
+    elif format == "webp":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    elif format == "jpeg":
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality, progressive=True, optimize=True)
+    else:
+        raise ValueError(f"Unknown output format {format!r}, expected one of {', '.join(OUTPUT_FORMATS)}")
+    return buffer.getvalue()
+
+
+def encode_image(image, format=None, quality=None, max_bytes=None) -> EncodedImage:
+    """Encode image for upload, honouring the size target when one is set"""
+    format = format or OUTPUT_FORMAT
+    quality = quality or OUTPUT_QUALITY
+    max_bytes = OUTPUT_MAX_BYTES if max_bytes is None else max_bytes
+    colors = OUTPUT_PNG_COLORS
+
+    with timed(f"encode_{format}"):
+        data = _save(image, format, quality, colors)
+        if not max_bytes or len(data) <= max_bytes:
+            return EncodedImage(data, format)
+
+        if format in ("webp", "jpeg"):
+            # Binary search for the highest quality that fits
+            low, high, best = MIN_QUALITY, quality - 1, None
+            while low <= high:
+                middle = (low + high) // 2
+                candidate = _save(image, format, middle, colors)
+                if len(candidate) <= max_bytes:
+                    best, low = candidate, middle + 1
+                else:
+                    high = middle - 1
+            data = best or _save(image, format, MIN_QUALITY, colors)
+        elif format == "png8":
+            while len(data) > max_bytes and colors > MIN_COLORS:
+                colors //= 2
+                data = _save(image, format, quality, colors)
+
+    # Lossless PNG cannot shrink; an oversized result is still returned
+    return EncodedImage(data, format)
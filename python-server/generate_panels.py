@@ -1,60 +1,139 @@
 import re
 import json
-from langchain_groq import ChatGroq
 from langchain.prompts.chat import (
     ChatPromptTemplate,
     HumanMessagePromptTemplate,
 )
 from dotenv import load_dotenv
-import os
 
 from prompts import CONTENT_GENERATION_PROMPT
+from utils import invoke_llm_cached, ainvoke_llm_cached, stream_llm_cached, astream_llm_cached
+from metrics import timed
+from tracing import logger
 
 load_dotenv()
 
 
-def generate_panels(scenario):
-    model = ChatGroq(
-        model="openai/gpt-oss-20b",
-        temperature=0.2,
-        groq_api_key=os.getenv("GROQ_API_KEY")
-    )
-
+def panel_messages(scenario):
     human_message_prompt = HumanMessagePromptTemplate.from_template(CONTENT_GENERATION_PROMPT)
 
     chat_prompt = ChatPromptTemplate.from_messages([human_message_prompt])
 
-    chat_prompt.format_messages(scenario=scenario)
+    return chat_prompt.format_messages(scenario=scenario)
+
 
-    result = model.invoke(chat_prompt.format_messages(scenario=scenario))
+def generate_panels(scenario):
+    with timed("panels_llm"):
+        content = invoke_llm_cached(
+            panel_messages(scenario), "Groq", "openai/gpt-oss-20b", validate=complete_script,
+        )
 
-    print(result.content)
+    logger.info(content)
 
-    return extract_panel_info(result.content)
+    return extract_panel_info(content)
 
 
-def extract_panel_info(text):
-    panel_info_list = []
-    panel_blocks = text.split('# Panel')
+async def agenerate_panels(scenario):
+    with timed("panels_llm"):
+        content = await ainvoke_llm_cached(
+            panel_messages(scenario), "Groq", "openai/gpt-oss-20b", validate=complete_script,
+        )
+
+    logger.info(content)
+
+    return extract_panel_info(content)
+
+
+def stream_panels(scenario):
+    """Yield panels one by one while the LLM is still writing the later ones"""
+    parser = PanelStreamParser()
+    with timed("panels_llm"):
+        chunks = stream_llm_cached(panel_messages(scenario), "Groq", "openai/gpt-oss-20b", validate=complete_script)
+        for chunk in chunks:
+            yield from parser.feed(chunk)
+        yield from parser.close()
+
+    logger.info(parser.text)
 
-    for block in panel_blocks:
-        if block.strip() != '':
-            panel_info = {}
 
-            # Extracting panel number
-            panel_number = re.search(r'\d+', block)
-            if panel_number is not None:
-                panel_info['number'] = panel_number.group()
+async def astream_panels(scenario):
+    """Async stream_panels"""
+    parser = PanelStreamParser()
+    with timed("panels_llm"):
+        chunks = astream_llm_cached(panel_messages(scenario), "Groq", "openai/gpt-oss-20b", validate=complete_script)
+        async for chunk in chunks:
+            for panel in parser.feed(chunk):
+                yield panel
+        for panel in parser.close():
+            yield panel
 
-            # Extracting panel description
-            panel_description = re.search(r'description: (.+)', block)
-            if panel_description is not None:
-                panel_info['description'] = panel_description.group(1)
+    logger.info(parser.text)
 
-            # Extracting panel text
-            panel_text = re.search(r'text:\n```\n(.+)\n```', block, re.DOTALL)
-            if panel_text is not None:
-                panel_info['text'] = panel_text.group(1)
 
+def parse_panel_block(block):
+    """Panel info of the text following one '# Panel' header, or None if it is blank"""
+    if block.strip() == '':
+        return None
+    panel_info = {}
+
+    # Extracting panel number
+    panel_number = re.search(r'\d+', block)
+    if panel_number is not None:
+        panel_info['number'] = panel_number.group()
+
+    # Extracting panel description
+    panel_description = re.search(r'description: (.+)', block)
+    if panel_description is not None:
+        panel_info['description'] = panel_description.group(1)
+
+    # Extracting panel text
+    panel_text = re.search(r'text:\n```\n(.+)\n```', block, re.DOTALL)
+    if panel_text is not None:
+        panel_info['text'] = panel_text.group(1)
+
+    return panel_info
+
+
+def extract_panel_info(text):
+    panel_info_list = []
+    for block in text.split('# Panel'):
+        panel_info = parse_panel_block(block)
+        if panel_info is not None:
             panel_info_list.append(panel_info)
     return panel_info_list
+
+
+def complete_script(text):
+    """Whether a panel script is worth memoizing: at least one panel, each with a description and text"""
+    panels = extract_panel_info(text)
+    return bool(panels) and all(panel.get('description') and 'text' in panel for panel in panels)
+
+
+class PanelStreamParser:
+    """Incremental extract_panel_info: a block is complete at its '# end'
+    marker or, failing that, once the next '# Panel' header arrives"""
+
+    def __init__(self):
+        self.chunks = []
+        self.pending = ""
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    def feed(self, chunk):
+        """Add streamed text and return the panels it completed"""
+        self.chunks.append(chunk)
+        # A header split across chunks is matched once its remainder arrives
+        *complete, self.pending = (self.pending + chunk).split('# Panel')
+        end = self.pending.find('# end')
+        if end >= 0:
+            complete.append(self.pending[:end])
+            self.pending = self.pending[end + len('# end'):]
+        return [panel for panel in map(parse_panel_block, complete) if panel is not None]
+
+    def close(self):
+        """Panels of the final block"""
+        panel_info = parse_panel_block(self.pending)
+        self.pending = ""
+        return [panel_info] if panel_info is not None else []
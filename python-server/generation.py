@@ -1,16 +1,33 @@
+import asyncio
+import functools
 import json
-from generate_panels import generate_panels
-from stability_ai import text_to_image
-from add_text import add_text_to_panel
-from create_strip import create_strip
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from generate_panels import generate_panels, agenerate_panels, stream_panels, astream_panels
+from stability_ai import text_to_image, atext_to_image
+from compositing import IncrementalStripBuilder
 from dotenv import load_dotenv
-from utils import load_llm_model
+from utils import invoke_llm_cached, ainvoke_llm_cached
 from langchain.prompts import PromptTemplate
-from langchain_groq import ChatGroq
-from prompts import CHARACTER_DESCRIPTION_PROMPT, IMAGE_PROMPT_REFINE
+from prompts import CHARACTER_DESCRIPTION_PROMPT, IMAGE_PROMPT_REFINE, IMAGE_PROMPT_REFINE_BATCH, COMIC_SCRIPT_PROMPT
+from metrics import timed, PANEL_FAILURES
+from tracing import logger, submit_with_context
 
 load_dotenv()
 
+# Maximum number of panels of a single comic rendered at the same time
+PANEL_CONCURRENCY = int(os.getenv("PANEL_CONCURRENCY", 6))
+# ... and having their prompt refined, or being captioned and composited (see PanelStages)
+REFINE_CONCURRENCY = int(os.getenv("REFINE_CONCURRENCY", 6))
+COMPOSITE_CONCURRENCY = int(os.getenv("COMPOSITE_CONCURRENCY", 2))
+
+# "batch" refines every panel prompt in one LLM call, "panel" makes one call per panel,
+# "stream" also streams the script and starts each panel as soon as the LLM has written it
+REFINE_MODE = os.getenv("REFINE_MODE", "batch")
+
 
 # SCENARIO = """
 # Characters: Adrien is a guy with blond hair. Vincent is a guy with black hair.
@@ -20,51 +37,468 @@ load_dotenv()
 
 
 def generate_characters_description(story):
-    llm = load_llm_model("Groq", "openai/gpt-oss-20b")
     prompt = PromptTemplate.from_template(CHARACTER_DESCRIPTION_PROMPT)
-    characters_description = llm.invoke(prompt.format(scenario=story))
-    return characters_description.content
+    with timed("characters_llm"):
+        return invoke_llm_cached(prompt.format(scenario=story), "Groq", "openai/gpt-oss-20b")
+
+
+async def agenerate_characters_description(story):
+    prompt = PromptTemplate.from_template(CHARACTER_DESCRIPTION_PROMPT)
+    with timed("characters_llm"):
+        return await ainvoke_llm_cached(prompt.format(scenario=story), "Groq", "openai/gpt-oss-20b")
+
+
+def generate_comic_script(story):
+    """Generate the character description and the panels in one structured call.
+
+    Returns (characters_description, panels) with panels in the same format
+    as get_panels.
+    """
+    prompt = PromptTemplate.from_template(COMIC_SCRIPT_PROMPT)
+    with timed("script_llm"):
+        answer = invoke_llm_cached(
+            prompt.format(scenario=story), "Groq", "openai/gpt-oss-20b", json_mode=True, validate=parse_comic_script,
+        )
+    return parse_comic_script(answer)
+
+
+async def agenerate_comic_script(story):
+    prompt = PromptTemplate.from_template(COMIC_SCRIPT_PROMPT)
+    with timed("script_llm"):
+        answer = await ainvoke_llm_cached(
+            prompt.format(scenario=story), "Groq", "openai/gpt-oss-20b", json_mode=True, validate=parse_comic_script,
+        )
+    return parse_comic_script(answer)
+
+
+def parse_comic_script(answer):
+    """Turn the structured script answer into (characters_description, panels)"""
+    match = re.search(r'\{.*\}', answer, re.DOTALL)
+    if not match:
+        raise ValueError("Comic script response contains no JSON object")
+    script = json.loads(match.group())
+
+    characters_description = script.get("characters")
+    if isinstance(characters_description, list):
+        characters_description = "\n".join(
+            f"{c.get('name', '')}: {c.get('description', '')}" if isinstance(c, dict) else str(c)
+            for c in characters_description
+        )
+    if not characters_description or not script.get("panels"):
+        raise ValueError("Comic script response is missing characters or panels")
+
+    panels = []
+    for i, panel in enumerate(script["panels"]):
+        if not isinstance(panel, dict) or not panel.get("description"):
+            raise ValueError(f"Comic script panel {i + 1} has no description")
+        panels.append({
+            "number": str(i + 1),
+            "description": panel["description"],
+            "text": panel.get("text", ""),
+        })
+    return characters_description, panels
 
 
 def refine_image_gen_prompt(panel):
-    llm = load_llm_model("Groq", "openai/gpt-oss-20b")
     prompt = PromptTemplate.from_template(IMAGE_PROMPT_REFINE)
-    refined_prompt = llm.invoke(prompt.format(characters_description=panel))
-    return refined_prompt.content
+    with timed("refine_llm"):
+        return invoke_llm_cached(prompt.format(characters_description=panel), "Groq", "openai/gpt-oss-20b")
+
+
+async def arefine_image_gen_prompt(panel):
+    prompt = PromptTemplate.from_template(IMAGE_PROMPT_REFINE)
+    with timed("refine_llm"):
+        return await ainvoke_llm_cached(prompt.format(characters_description=panel), "Groq", "openai/gpt-oss-20b")
+
+
+def parse_refined_prompts(text, expected):
+    """Extract the list of refined prompts from a batch refinement answer"""
+    match = re.search(r'\[.*\]', text, re.DOTALL)
+    if match:
+        try:
+            prompts = json.loads(match.group())
+            if isinstance(prompts, list) and all(isinstance(p, str) and p.strip() for p in prompts):
+                if len(prompts) == expected:
+                    return [p.strip() for p in prompts]
+        except ValueError:
+            pass
+
+    # Fall back to "Panel N: ..." lines
+    prompts = re.findall(r'^\s*(?:Panel\s*)?\d+\s*[:.)-]\s*(.+)$', text, re.MULTILINE)
+    if len(prompts) == expected:
+        return [p.strip().strip('"') for p in prompts]
+    return None
+
+
+def refine_image_gen_prompts(panels, characters_description):
+    """Refine every panel prompt with a single LLM call.
+
+    Returns None when the answer cannot be parsed so callers can fall back
+    to per-panel refinement.
+    """
+    try:
+        with timed("refine_batch_llm"):
+            answer = invoke_llm_cached(
+                batch_refine_prompt(panels, characters_description), "Groq", "openai/gpt-oss-20b",
+                validate=lambda answer: parse_refined_prompts(answer, len(panels)),
+            )
+    except Exception as e:
+        logger.warning(f"⚠️ Batch prompt refinement failed: {e}")
+        return None
+    return _parse_batch_refinement(answer, len(panels))
+
+
+async def arefine_image_gen_prompts(panels, characters_description):
+    try:
+        with timed("refine_batch_llm"):
+            answer = await ainvoke_llm_cached(
+                batch_refine_prompt(panels, characters_description), "Groq", "openai/gpt-oss-20b",
+                validate=lambda answer: parse_refined_prompts(answer, len(panels)),
+            )
+    except Exception as e:
+        logger.warning(f"⚠️ Batch prompt refinement failed: {e}")
+        return None
+    return _parse_batch_refinement(answer, len(panels))
+
+
+def batch_refine_prompt(panels, characters_description):
+    prompt = PromptTemplate.from_template(IMAGE_PROMPT_REFINE_BATCH)
+    panel_lines = "\n".join(
+        f"Panel {i + 1}: {panel.get('description', '')}" for i, panel in enumerate(panels)
+    )
+    return prompt.format(characters_description=characters_description, panels=panel_lines)
+
+
+def _parse_batch_refinement(answer, expected):
+    refined = parse_refined_prompts(answer, expected)
+    if refined is None:
+        logger.warning("⚠️ Could not parse batch prompt refinement, falling back to per-panel calls")
+    return refined
 
 
 def get_panels(scenario, style):
     SCENARIO = scenario
     STYLE = style
-    print(f"Generate panels with style '{STYLE}' for this scenario: \n {SCENARIO}")
+    logger.info(f"Generate panels with style '{STYLE}' for this scenario: \n {SCENARIO}")
     panels = generate_panels(SCENARIO)
     return panels
 
 
-def generate_comic(panels, style, characters_description):
-    STYLE = style
-    # No need to save panels.json locally - just log for debugging
-    print(f"📋 Processing {len(panels)} panels: {json.dumps(panels, indent=2)}")
+async def aget_panels(scenario, style):
+    logger.info(f"Generate panels with style '{style}' for this scenario: \n {scenario}")
+    return await agenerate_panels(scenario)
 
-    panel_images = []
 
-    for panel in panels:
-        panel_prompt = panel["description"] + ", cartoon box, " + STYLE
-        panel_prompt = "Characters: " + characters_description + "\n Story : " + panel_prompt#
-        panel_prompt = refine_image_gen_prompt(panel_prompt)
-        panel_prompt = panel_prompt + ", cartoon box, " + STYLE#
-        print(f"Generate panel {panel['number']} with prompt: {panel_prompt}")
+def get_panel_stream(scenario, style):
+    """Like get_panels, but yields each panel as soon as the LLM has written it"""
+    logger.info(f"Stream panels with style '{style}' for this scenario: \n {scenario}")
+    return stream_panels(scenario)
+
+
+def aget_panel_stream(scenario, style):
+    """Async get_panel_stream; returns an async iterator"""
+    logger.info(f"Stream panels with style '{style}' for this scenario: \n {scenario}")
+    return astream_panels(scenario)
+
+
+def refine_request(panel, style, characters_description):
+    """Text sent to the per-panel prompt refinement"""
+    panel_prompt = panel["description"] + ", cartoon box, " + style
+    return "Characters: " + characters_description + "\n Story : " + panel_prompt
+
+
+def render_panel_image(panel, style, characters_description, refined_prompt=None):
+    """Refine the prompt (unless already refined) and render a single uncaptioned panel"""
+    if refined_prompt is None:
+        refined_prompt = refine_image_gen_prompt(refine_request(panel, style, characters_description))
+    panel_prompt = refined_prompt + ", cartoon box, " + style
+    logger.info(f"Generate panel {panel['number']} with prompt: {panel_prompt}")
+    with timed("text_to_image"):
         panel_image = text_to_image(panel_prompt)
+    if panel_image is None:
+        raise Exception(f"No image returned for panel {panel['number']}")
+    return panel_image
+
+
+async def arender_panel_image(panel, style, characters_description, refined_prompt=None):
+    """Async render_panel_image"""
+    if refined_prompt is None:
+        refined_prompt = await arefine_image_gen_prompt(refine_request(panel, style, characters_description))
+    panel_prompt = refined_prompt + ", cartoon box, " + style
+    logger.info(f"Generate panel {panel['number']} with prompt: {panel_prompt}")
+    with timed("text_to_image"):
+        panel_image = await atext_to_image(panel_prompt)
+    if panel_image is None:
+        raise Exception(f"No image returned for panel {panel['number']}")
+    return panel_image
+
+
+def place_panel(builder, index, panel, panel_image):
+    """Caption and paste a panel into its strip slot, keeping the bare image on failure"""
+    try:
+        with timed("add_text"):
+            builder.add_panel(index, panel_image, panel.get("text", ""))
+    except Exception as e:
+        logger.warning(f"Error adding text to panel {panel.get('number', index + 1)}: {e}")
+        builder.add_panel(index, panel_image)
+
+
+class PanelStages:
+    """Per-comic limits of the panel stages: refine, render, then caption and composite.
+
+    A panel holds a stage's slot only while it is in that stage, so one
+    panel's prompt is refined while another renders, and a rendered panel
+    frees its render slot before it is captioned. semaphore is
+    threading.Semaphore or asyncio.Semaphore.
+    """
+
+    def __init__(self, semaphore):
+        self.refine = semaphore(max(1, REFINE_CONCURRENCY))
+        self.render = semaphore(max(1, PANEL_CONCURRENCY))
+        self.composite = semaphore(max(1, COMPOSITE_CONCURRENCY))
+        # Set when the comic failed; panels still waiting for a stage stop there
+        self.abandoned = False
+
+    def abandon(self):
+        self.abandoned = True
+
+    @staticmethod
+    def workers():
+        """Threads needed to keep every stage busy"""
+        return max(1, REFINE_CONCURRENCY) + max(1, PANEL_CONCURRENCY) + max(1, COMPOSITE_CONCURRENCY)
+
+
+def build_panel(stages, builder, index, panel, style, characters_description, refined_prompt=None, on_render=None):
+    """Run a panel through the stages and place it straight into the strip; the full-size image is dropped afterwards"""
+    if refined_prompt is None:
+        with stages.refine:
+            if stages.abandoned:
+                return
+            refined_prompt = refine_image_gen_prompt(refine_request(panel, style, characters_description))
+    with stages.render:
+        if stages.abandoned:
+            return
+        panel_image = render_panel_image(panel, style, characters_description, refined_prompt)
+    with stages.composite:
+        if on_render:
+            on_render(index, panel_image, refined_prompt)
+        place_panel(builder, index, panel, panel_image)
+
+
+async def abuild_panel(stages, builder, index, panel, style, characters_description, refined_prompt=None,
+                       on_render=None):
+    """Async build_panel; on_render and compositing run in worker threads"""
+    if refined_prompt is None:
+        async with stages.refine:
+            refined_prompt = await arefine_image_gen_prompt(refine_request(panel, style, characters_description))
+    async with stages.render:
+        panel_image = await arender_panel_image(panel, style, characters_description, refined_prompt)
+    async with stages.composite:
+        if on_render:
+            await asyncio.to_thread(on_render, index, panel_image, refined_prompt)
+        await asyncio.to_thread(place_panel, builder, index, panel, panel_image)
+
+
+def place_placeholder(builder, index, panel):
+    """Blank captioned slot used when a panel could not be generated"""
+    try:
+        builder.add_panel(index, None, panel.get("text", ""))
+    except Exception:
+        builder.add_panel(index, None, "")
+
+
+async def aiterate(panels):
+    """Iterate a list or an async iterable of panels"""
+    if hasattr(panels, "__aiter__"):
+        async for panel in panels:
+            yield panel
+    else:
+        for panel in panels:
+            yield panel
+
+
+class PanelTracker:
+    """Completion bookkeeping of generate_comic, fed from the calling thread or loop"""
+
+    def __init__(self, builder, progress, on_panel, streamed):
+        self.builder = builder
+        self.streamed = streamed
+        self.progress = progress
+        self.on_panel = on_panel
+        self.panels = []
+        self.failed = []
+        self.completed = 0
+
+    def dispatched(self, index, panel):
+        self.panels.append(panel)
+        if self.streamed:
+            logger.info(f"📋 Dispatching panel {index + 1}: {json.dumps(panel)}")
+
+    def fits(self, index, panel):
+        """Whether a panel has a slot on the strip; the rest are not rendered"""
+        if self.builder.fits(index):
+            return True
+        logger.warning(f"⚠️ Panel {panel.get('number', index + 1)} does not fit the strip, skipping it")
+        return False
+
+    def finished(self, index, error):
+        if error is not None:
+            # One bad panel should not throw away the others
+            logger.error(f"❌ Panel {self.panels[index].get('number', index + 1)} failed: {error}")
+            PANEL_FAILURES.inc()
+            self.failed.append(index)
+        elif self.on_panel and self.builder.fits(index):
+            self.on_panel(index, self.builder.slot_image(index))
+        self.completed += 1
+        if self.progress:
+            self.progress("images", "running", completed=self.completed, total=len(self.panels))
+
+    @property
+    def pending(self):
+        return len(self.panels) - self.completed
+
+    def check(self):
+        if self.panels and len(self.failed) == len(self.panels):
+            raise Exception("Comic generation failed - all panels failed")
+
+    def done(self):
+        if self.progress:
+            self.progress("images", "done", completed=self.completed, total=len(self.panels), failed=len(self.failed))
+            self.progress("strip", "done")
+
+
+def generate_comic(panels, style, characters_description, progress=None, on_panel=None, on_render=None):
+    """Render all panels and assemble the strip.
+
+    panels is a list, or an iterable yielding panels while the script is
+    still being written (see generate_panels.stream_panels); each panel is
+    dispatched as soon as it arrives. Panels then move through the stages
+    of PanelStages on their own and are captioned and pasted into the strip
+    as soon as their image arrives. on_panel is an optional
+    callable(index, image) invoked with the composed strip slot of each
+    panel, in completion order. on_render is an optional
+    callable(index, image, refined_prompt) invoked from the panel worker
+    with the uncaptioned full-size image.
+    """
+    STYLE = style
+    streamed = not isinstance(panels, list)
+    if not streamed:
+        # No need to save panels.json locally - just log for debugging
+        logger.info(f"📋 Processing {len(panels)} panels: {json.dumps(panels, indent=2)}")
+
+    builder = IncrementalStripBuilder(None if streamed else len(panels))
+    tracker = PanelTracker(builder, progress, on_panel, streamed)
+    if progress:
+        progress("images", "running", completed=0, total=None if streamed else len(panels))
+        progress("strip", "running")
+
+    # Batch refinement needs the whole script; streamed panels are refined one by one
+    refined_prompts = []
+    if REFINE_MODE == "batch" and not streamed and panels:
+        refined_prompts = refine_image_gen_prompts(panels[:builder.count], characters_description) or refined_prompts
+
+    stages = PanelStages(threading.Semaphore)
+    finished = queue.Queue()
+
+    def drain():
+        # Report panels that finished while later ones were still arriving
+        while True:
+            try:
+                tracker.finished(*finished.get_nowait())
+            except queue.Empty:
+                return
+
+    # Each worker pastes its panel into its own slot, so completion order does not matter
+    workers = stages.workers() if streamed else max(1, min(stages.workers(), len(panels)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="panel") as executor:
         try:
-            panel_image_with_text = add_text_to_panel(panel["text"], panel_image)
-        except Exception as e:
-            print(f"Error adding text to panel {panel['number']}: {e}")
-            panel_image_with_text = panel_image
-        # No need to save individual panels - keep in memory
-        panel_images.append(panel_image_with_text)
+            for i, panel in enumerate(panels):
+                if not tracker.fits(i, panel):
+                    # Keep reading a streamed script so it still completes
+                    continue
+                tracker.dispatched(i, panel)
+                future = submit_with_context(
+                    executor, build_panel, stages, builder, i, panel, STYLE, characters_description,
+                    refined_prompts[i] if i < len(refined_prompts) else None, on_render,
+                )
+                future.add_done_callback(lambda future, i=i: finished.put((i, future.exception())))
+                drain()
+            while tracker.pending:
+                tracker.finished(*finished.get())
+        except BaseException:
+            # The script stream failed: drop queued panels and stop the others before their next
+            # stage, so only renders already running are waited for (agenerate_comic cancels its tasks)
+            stages.abandon()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    tracker.check()
+    for i in tracker.failed:
+        place_placeholder(builder, i, tracker.panels[i])
+    tracker.done()
 
     # Return the comic strip image directly instead of saving to file
-    return create_strip(panel_images)
+    return builder.result()
+
+
+async def agenerate_comic(panels, style, characters_description, progress=None, on_panel=None, on_render=None):
+    """Async generate_comic: panels are rendered as coroutines on the running
+    loop, compositing is offloaded to worker threads.
+
+    panels is a list or an async iterable of panels (see
+    generate_panels.astream_panels). progress and on_panel are called from
+    the event loop, on_render from a worker thread.
+    """
+    streamed = not isinstance(panels, list)
+    if not streamed:
+        logger.info(f"📋 Processing {len(panels)} panels: {json.dumps(panels, indent=2)}")
+
+    builder = IncrementalStripBuilder(None if streamed else len(panels))
+    tracker = PanelTracker(builder, progress, on_panel, streamed)
+    if progress:
+        progress("images", "running", completed=0, total=None if streamed else len(panels))
+        progress("strip", "running")
+
+    refined_prompts = []
+    if REFINE_MODE == "batch" and not streamed and panels:
+        refined_prompts = await arefine_image_gen_prompts(panels[:builder.count], characters_description) or \
+            refined_prompts
+
+    stages = PanelStages(asyncio.Semaphore)
+    finished = asyncio.Queue()
+    tasks = []
+
+    def on_done(i, task):
+        if not task.cancelled():
+            finished.put_nowait((i, task.exception()))
+
+    try:
+        async for panel in aiterate(panels):
+            # Panels beyond the last slot all land on index len(tasks) and are skipped
+            i = len(tasks)
+            if not tracker.fits(i, panel):
+                continue
+            tracker.dispatched(i, panel)
+            task = asyncio.create_task(abuild_panel(
+                stages, builder, i, panel, style, characters_description,
+                refined_prompts[i] if i < len(refined_prompts) else None, on_render,
+            ))
+            task.add_done_callback(functools.partial(on_done, i))
+            tasks.append(task)
+            while not finished.empty():
+                tracker.finished(*finished.get_nowait())
+        while tracker.pending:
+            tracker.finished(*await finished.get())
+    except BaseException:
+        # The script stream failed or the comic was cancelled: stop its panels too
+        for task in tasks:
+            task.cancel()
+        raise
 
+    tracker.check()
+    for i in tracker.failed:
+        await asyncio.to_thread(place_placeholder, builder, i, tracker.panels[i])
+    tracker.done()
+    return builder.result()
 # desc = generate_characters_description("Adrien and Vincent work at the office and want to start a new product, and they create it in one night before presenting it to the board.")
 # print(desc)
@@ -0,0 +1,147 @@
+"""
+Content-addressed cache for generated images
+In-memory LRU tier in front of a size-bounded on-disk tier
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image
+
+from tracing import logger
+
+
+class ImageCache:
+    def __init__(self, memory_items: int = 64, disk_dir: Optional[str] = None, disk_max_bytes: int = 1024 ** 3):
+        self.memory_items = memory_items
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_bytes = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self.disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    @staticmethod
+    def make_key(**params) -> str:
+        """Hash generation parameters into a stable cache key"""
+        payload = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def _disk_entries(self):
+        """List (mtime, path, size) for every cached file on disk"""
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        """Return a copy of the cached image, or None on a miss"""
+        with self.lock:
+            image = self.memory.get(key)
+            if image is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return image.copy()
+
+        if self.disk_dir:
+            path = self._path(key)
+            try:
+                with Image.open(path) as cached:
+                    image = cached.copy()
+                # Touch the file so disk eviction stays least-recently-used
+                os.utime(path)
+            except (OSError, ValueError):
+                image = None
+
+            if image is not None:
+                with self.lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._remember(key, image)
+                return image.copy()
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, image: Image.Image):
+        """Store an image in both tiers"""
+        with self.lock:
+            self._remember(key, image.copy())
+
+        if self.disk_dir:
+            path = self._path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                image.save(tmp_path, format="PNG")
+                old_size = os.path.getsize(path) if os.path.exists(path) else 0
+                os.replace(tmp_path, path)
+                with self.lock:
+                    self.disk_bytes += os.path.getsize(path) - old_size
+                    if self.disk_bytes > self.disk_max_bytes:
+                        self._evict_disk()
+            except OSError as e:
+                logger.warning(f"⚠️ Could not write image cache entry {key[:12]}: {e}")
+
+    def _remember(self, key: str, image: Image.Image):
+        """Insert into the memory tier (lock must be held)"""
+        self.memory[key] = image
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _evict_disk(self):
+        """Delete least recently used files until under budget (lock must be held)"""
+        entries = sorted(self._disk_entries())
+        self.disk_bytes = sum(size for _, _, size in entries)
+        target = self.disk_max_bytes * 0.9
+        for _, path, size in entries:
+            if self.disk_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self.disk_bytes -= size
+            except OSError:
+                continue
+
+    def get_status(self) -> dict:
+        """Get hit/miss counters and tier sizes"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'memory_items': len(self.memory),
+                'disk_bytes': self.disk_bytes,
+            }
+
+
+def initialize_image_cache() -> Optional[ImageCache]:
+    """Initialize image cache from environment, or None when disabled"""
+    if os.getenv('IMAGE_CACHE_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    return ImageCache(
+        memory_items=int(os.getenv('IMAGE_CACHE_MEMORY_ITEMS', 64)),
+        disk_dir=os.getenv('IMAGE_CACHE_DIR') or None,
+        disk_max_bytes=int(os.getenv('IMAGE_CACHE_MAX_MB', 1024)) * 1024 * 1024,
+    )
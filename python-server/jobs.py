@@ -0,0 +1,210 @@
+"""
+Background job manager for comic generation
+Runs pipelines on a bounded executor and tracks per-stage progress
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from pipeline import STAGES
+from tracing import logger, submit_with_context
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+
+
+class JobManager:
+    def __init__(self, max_workers: int, max_queued: int, result_ttl: int = 3600,
+                 stages: Optional[List[str]] = None, state_dir: Optional[str] = None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.stages = stages or STAGES
+        # Optional directory shared by server processes so any worker can answer status polls
+        self.state_dir = state_dir
+        if self.state_dir:
+            os.makedirs(self.state_dir, exist_ok=True)
+        self.jobs: Dict[str, dict] = {}
+        self.active = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="comic-job")
+        # Jobs run as coroutines on an event loop (see asubmit)
+        self.tasks = set()
+
+        logger.info(f"🧵 Initialized job manager with {max_workers} workers and {max_queued} queue slots")
+
+    def submit(self, fn: Callable, *args, **kwargs) -> str:
+        """Queue fn(*args, progress=..., **kwargs) and return its job id.
+
+        Raises QueueFullError when running plus queued jobs reach capacity.
+        """
+        job_id = self._create()
+
+        # Run with the submitting request's trace id so job logs can be correlated
+        submit_with_context(self.executor, self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def asubmit(self, fn: Callable, *args, **kwargs) -> str:
+        """Like submit, but fn is a coroutine function run as a task on the running loop"""
+        job_id = self._create()
+        task = asyncio.get_running_loop().create_task(self._arun(job_id, fn, args, kwargs))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job_id
+
+    def _create(self) -> str:
+        with self.lock:
+            self._prune()
+            if self.active >= self.max_workers + self.max_queued:
+                raise QueueFullError(f"Job queue is full ({self.active} jobs pending)")
+
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "stages": {stage: {"status": "pending"} for stage in self.stages},
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            self.active += 1
+            self._persist(job_id)
+        return job_id
+
+    def _run(self, job_id: str, fn: Callable, args, kwargs):
+        self._update(job_id, status="running", started_at=time.time())
+        try:
+            result = fn(*args, progress=self._progress(job_id), **kwargs)
+            self._update(job_id, status="completed", result=result)
+        except Exception as e:
+            logger.error(f"❌ Job {job_id} failed: {e}")
+            self._update(job_id, status="failed", error=str(e))
+        finally:
+            self._finish(job_id)
+
+    async def _arun(self, job_id: str, fn: Callable, args, kwargs):
+        self._update(job_id, status="running", started_at=time.time())
+        try:
+            result = await fn(*args, progress=self._progress(job_id), **kwargs)
+            self._update(job_id, status="completed", result=result)
+        except Exception as e:
+            logger.error(f"❌ Job {job_id} failed: {e}")
+            self._update(job_id, status="failed", error=str(e))
+        finally:
+            self._finish(job_id)
+
+    def _progress(self, job_id: str) -> Callable:
+        def progress(stage, status, **details):
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is not None:
+                    job["stages"][stage] = {"status": status, **details}
+                    self._persist(job_id)
+        return progress
+
+    def _finish(self, job_id: str):
+        with self.lock:
+            self.active -= 1
+            if job_id in self.jobs:
+                self.jobs[job_id]["finished_at"] = time.time()
+                self._persist(job_id)
+
+    def _update(self, job_id: str, **fields):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields)
+                self._persist(job_id)
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _persist(self, job_id: str):
+        """Mirror the job to state_dir (lock must be held)"""
+        if not self.state_dir:
+            return
+        path = self._state_path(job_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.jobs[job_id], f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"⚠️ Could not persist job {job_id}: {e}")
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        """Read a job mirrored by another server process"""
+        if not self.state_dir or not job_id.isalnum():
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _prune(self):
+        """Drop finished jobs older than result_ttl (lock must be held)"""
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["finished_at"] is not None and job["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+        if self.state_dir:
+            # Also covers jobs mirrored by other processes
+            for entry in os.scandir(self.state_dir):
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    continue
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return a snapshot of the job, or None if unknown or expired"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                snapshot = dict(job)
+                snapshot["stages"] = {stage: dict(info) for stage, info in job["stages"].items()}
+                return snapshot
+        return self._load(job_id)
+
+    def get_status(self) -> dict:
+        """Get current load of the job manager"""
+        with self.lock:
+            return {
+                'workers': self.max_workers,
+                'queue_slots': self.max_queued,
+                'active': self.active,
+                'tracked': len(self.jobs),
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting jobs and optionally wait for in-flight ones"""
+        self.executor.shutdown(wait=wait)
+
+    async def ashutdown(self):
+        """Wait for coroutine jobs of the running loop, then for thread jobs"""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        await asyncio.to_thread(self.shutdown, True)
+
+
+def initialize_job_manager() -> JobManager:
+    """Initialize comic job manager from environment"""
+    return JobManager(
+        max_workers=int(os.getenv('COMIC_JOB_WORKERS', 4)),
+        max_queued=int(os.getenv('COMIC_JOB_QUEUE_SIZE', 200)),
+        result_ttl=int(os.getenv('COMIC_JOB_RESULT_TTL', 3600)),
+        state_dir=os.getenv('COMIC_JOB_STATE_DIR') or None,
+    )
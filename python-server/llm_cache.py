@@ -0,0 +1,150 @@
+"""
+Memoization layer for LLM completions
+In-memory LRU with TTL, optionally backed by a SQLite file shared across processes
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+from tracing import logger
+
+
+class LLMCache:
+    def __init__(self, max_items: int = 512, ttl: float = 86400, db_path: Optional[str] = None,
+                 max_db_items: int = 10000):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_db_items = max_db_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+        if self.db_path:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as db:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, content TEXT NOT NULL, latency REAL NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection, committing on success"""
+        db = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def make_key(model: str, temperature: float, prompt: str) -> str:
+        """Hash the model settings and rendered prompt into a cache key"""
+        payload = f"{model}\x00{temperature}\x00{prompt}"
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached completion, or None when missing or expired"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                content, latency, created_at = entry
+                if now - created_at < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    self.latency_saved += latency
+                    return content
+                del self.memory[key]
+
+        if self.db_path:
+            try:
+                with self._connect() as db:
+                    row = db.execute(
+                        "SELECT content, latency, created_at FROM llm_cache WHERE key = ? AND created_at > ?",
+                        (key, now - self.ttl),
+                    ).fetchone()
+                    if row is not None:
+                        db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ LLM cache read failed: {e}")
+                row = None
+
+            if row is not None:
+                content, latency, created_at = row
+                with self.lock:
+                    self.hits += 1
+                    self.latency_saved += latency
+                    self._remember(key, (content, latency, created_at))
+                return content
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, content: str, latency: float):
+        """Store a completion along with how long it took to produce"""
+        now = time.time()
+        with self.lock:
+            self._remember(key, (content, latency, now))
+
+        if self.db_path:
+            try:
+                with self._connect() as db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO llm_cache (key, content, latency, created_at, accessed_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (key, content, latency, now, now),
+                    )
+                    db.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl,))
+                    db.execute(
+                        "DELETE FROM llm_cache WHERE key IN ("
+                        "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_db_items,),
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ LLM cache write failed: {e}")
+
+    def _remember(self, key: str, entry: tuple):
+        """Insert into the memory tier (lock must be held)"""
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def get_status(self) -> dict:
+        """Get hit rate and latency saved"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'latency_saved_seconds': round(self.latency_saved, 3),
+                'memory_items': len(self.memory),
+            }
+
+
+def initialize_llm_cache() -> Optional[LLMCache]:
+    """Initialize LLM cache from environment, or None when disabled"""
+    if os.getenv('LLM_CACHE_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    return LLMCache(
+        max_items=int(os.getenv('LLM_CACHE_MAX_ITEMS', 512)),
+        ttl=float(os.getenv('LLM_CACHE_TTL', 86400)),
+        db_path=os.getenv('LLM_CACHE_DB') or None,
+        max_db_items=int(os.getenv('LLM_CACHE_MAX_DB_ITEMS', 10000)),
+    )
@@ -0,0 +1,294 @@
+"""
+Minimal Prometheus-style metrics for the comic generation server
+Counters, gauges and histograms with labels, rendered in the text exposition format.
+With several worker processes, each one dumps its samples to METRICS_MULTIPROC_DIR
+and a scrape of any worker sums them, so /metrics covers the whole server.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from tracing import logger
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Shared by the worker processes of one server (set by start.py when WEB_WORKERS > 1)
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+# How often each worker dumps its samples; gauges of a worker silent for three intervals are dropped
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(_escape(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, "", value) for key, value in self.values.items()]
+
+    def render(self) -> str:
+        return _render(self.name, self.help, self.type, self.label_names, self.samples())
+
+
+def _render(name: str, help: str, type: str, label_names, samples) -> str:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+    for sample_name, key, extra, value in samples:
+        lines.append(f"{sample_name}{_format_labels(label_names, key, extra)} {value}")
+    return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        """Increment the gauge for the duration of the block"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [c + (1 if value <= bound else 0) for c, bound in zip(counts, self.buckets)]
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key, f'le="{bound}"', bucket_count))
+                samples.append((f"{self.name}_bucket", key, 'le="+Inf"', count))
+                samples.append((f"{self.name}_sum", key, "", round(total, 6)))
+                samples.append((f"{self.name}_count", key, "", count))
+        return samples
+
+
+class CallbackMetric(_Metric):
+    """Metric whose values are read from fn() at scrape time.
+
+    fn returns either a number or a dict mapping label-value tuples to numbers.
+    """
+
+    def __init__(self, name: str, help: str, type: str, fn: Callable, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.type = type
+        self.fn = fn
+
+    def samples(self):
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.warning(f"⚠️ Metric {self.name} collection failed: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, tuple(_escape(v) for v in key), "", value) for key, value in values.items()]
+
+
+class Registry:
+    def __init__(self, multiproc_dir: Optional[str] = None):
+        self.metrics: Dict[str, _Metric] = {}
+        self.lock = threading.Lock()
+        self.multiproc_dir = multiproc_dir
+        if multiproc_dir:
+            os.makedirs(multiproc_dir, exist_ok=True)
+            threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+            atexit.register(self.flush, exited=True)
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name: str, help: str, type: str, fn: Callable, labels=()) -> CallbackMetric:
+        """Register (or replace) a metric computed at scrape time"""
+        metric = CallbackMetric(name, help, type, fn, labels)
+        with self.lock:
+            self.metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        if self.multiproc_dir:
+            return self._render_all_processes()
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def snapshot(self, exited: bool = False) -> dict:
+        """This process's samples, as stored in METRICS_MULTIPROC_DIR"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {
+            "updated_at": time.time(),
+            "exited": exited,
+            "metrics": {
+                metric.name: {
+                    "help": metric.help,
+                    "type": metric.type,
+                    "labels": list(metric.label_names),
+                    "samples": [[name, list(key), extra, value] for name, key, extra, value in metric.samples()],
+                }
+                for metric in metrics
+            },
+        }
+
+    def flush(self, exited: bool = False):
+        """Dump this process's samples for the other workers' scrapes"""
+        path = os.path.join(self.multiproc_dir, f"metrics-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.snapshot(exited), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not write metrics snapshot: {e}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def _render_all_processes(self) -> str:
+        """Sum the samples of every worker process.
+
+        Counters and histograms of exited workers still count; gauges only
+        count for live workers that flushed recently.
+        """
+        self.flush()
+        now = time.time()
+        merged = {}
+        for entry in os.scandir(self.multiproc_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            live = not snapshot["exited"] and now - snapshot["updated_at"] < 3 * METRICS_FLUSH_INTERVAL
+            for name, metric in snapshot["metrics"].items():
+                if metric["type"] == "gauge" and not live:
+                    continue
+                target = merged.setdefault(name, {**metric, "values": {}})
+                for sample_name, key, extra, value in metric["samples"]:
+                    sample = (sample_name, tuple(key), extra)
+                    target["values"][sample] = target["values"].get(sample, 0) + value
+        return "\n".join(
+            _render(name, metric["help"], metric["type"], metric["labels"], [
+                (sample_name, key, extra, round(value, 6))
+                for (sample_name, key, extra), value in metric["values"].items()
+            ])
+            for name, metric in merged.items()
+        ) + "\n"
+
+
+REGISTRY = Registry(METRICS_MULTIPROC_DIR)
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "comic_stage_duration_seconds", "Wall time of each pipeline stage", labels=("stage",)
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "comic_stage_errors_total", "Pipeline stage invocations that raised", labels=("stage",)
+)
+COMICS_TOTAL = REGISTRY.counter(
+    "comic_requests_total", "Comic pipelines run, by outcome", labels=("status",)
+)
+COMICS_IN_FLIGHT = REGISTRY.gauge("comic_requests_in_flight", "Comic pipelines currently running")
+PANEL_FAILURES = REGISTRY.counter("comic_panel_failures_total", "Panels replaced by a placeholder")
+STABILITY_IN_FLIGHT = REGISTRY.gauge("stability_requests_in_flight", "Stability generation requests in flight")
+
+
+def register_status(prefix: str, status_fn: Callable, fields: Dict[str, str]):
+    """Expose numeric fields of a component's get_status() as scrape-time metrics.
+
+    fields maps status keys to metric types, e.g. {'hits': 'counter'}.
+    """
+    for field, type in fields.items():
+        suffix = "_total" if type == "counter" else ""
+        REGISTRY.callback(
+            f"{prefix}_{field}{suffix}", f"{prefix} {field.replace('_', ' ')}", type,
+            lambda field=field: status_fn()[field],
+        )
+
+
+@contextmanager
+def timed(stage: str):
+    """Record the duration of the block in STAGE_SECONDS, counting failures"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        logger.debug(f"⏱️ {stage} took {elapsed:.3f}s")
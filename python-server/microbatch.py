@@ -0,0 +1,133 @@
+"""
+Micro-batching of concurrent requests to a backend that accepts batches
+Requests arriving within a short window are collected into one batch (up to
+a maximum size), sent in a single call and the results fanned back to each
+caller. The batch is scheduled for all of its callers, like a coalesced flight.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from scheduler import RequestExpired, SharedRequest, current_request
+from tracing import logger
+
+
+class _Item:
+    __slots__ = ("payload", "context", "future", "arrived")
+
+    def __init__(self, payload, context):
+        self.payload = payload
+        self.context = context
+        self.future = Future()
+        self.arrived = time.monotonic()
+
+
+class MicroBatcher:
+    """Collects concurrent submissions into batches of up to max_size.
+
+    A batch is sent once it is full or max_wait seconds after its first
+    item arrived. send(payloads, context) returns one result per payload, in
+    order; context is a SharedRequest of the batch's callers. Up to
+    concurrency batches are sent at once.
+    """
+
+    def __init__(self, send: Callable, max_size: int = 4, max_wait: float = 0.05, concurrency: int = 8,
+                 label: str = "request"):
+        self.send = send
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self.label = label
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.senders = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix=f"{label}-batch")
+        self.batches = 0
+        self.batched = 0
+        self.full = 0
+        threading.Thread(target=self._collect, name=f"{label}-batcher", daemon=True).start()
+
+    def submit(self, payload) -> Future:
+        """Queue payload for the next batch; the future holds its result"""
+        item = _Item(payload, current_request())
+        with self.condition:
+            self.queue.append(item)
+            self.condition.notify()
+        return item.future
+
+    def run(self, payload):
+        return self.submit(payload).result()
+
+    async def arun(self, payload):
+        """Async run; the caller's event loop is not blocked while the batch fills"""
+        return await asyncio.shield(asyncio.wrap_future(self.submit(payload)))
+
+    def _collect(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                # The window opens with the oldest waiting item
+                deadline = self.queue[0].arrived + self.max_wait
+                while len(self.queue) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = [self.queue.popleft() for _ in range(min(self.max_size, len(self.queue)))]
+            self.senders.submit(self._send, batch)
+
+    def _send(self, batch: List[_Item]):
+        live = []
+        for item in batch:
+            if item.context.expired:
+                item.future.set_exception(RequestExpired(f"Request expired before its {self.label} batch was sent"))
+            else:
+                live.append(item)
+        if not live:
+            return
+
+        context = SharedRequest()
+        for item in live:
+            context.add(item.context)
+        with self.condition:
+            self.batches += 1
+            self.batched += len(live)
+            self.full += len(live) == self.max_size
+        try:
+            results = self.send([item.payload for item in live], context)
+            if len(results) != len(live):
+                raise Exception(f"{self.label} batch returned {len(results)} results for {len(live)} requests")
+        except BaseException as e:
+            logger.error(f"❌ {self.label.capitalize()} batch of {len(live)} failed: {e}")
+            for item in live:
+                item.future.set_exception(e)
+            return
+        for item, result in zip(live, results):
+            item.future.set_result(result)
+
+    def get_status(self) -> dict:
+        with self.condition:
+            return {
+                'waiting': len(self.queue),
+                'batches': self.batches,
+                'batched': self.batched,
+                'full_batches': self.full,
+                'max_size': self.max_size,
+            }
+
+
+def initialize_image_batcher(send: Callable, concurrency: int) -> Optional[MicroBatcher]:
+    """Initialize Stability micro-batching from environment, or None without a batch endpoint"""
+    if not os.getenv('STABILITY_BATCH_URL'):
+        return None
+    return MicroBatcher(
+        send,
+        max_size=int(os.getenv('STABILITY_BATCH_MAX_SIZE', 4)),
+        max_wait=float(os.getenv('STABILITY_BATCH_MAX_WAIT', 0.05)),
+        concurrency=concurrency,
+        label="image",
+    )
@@ -0,0 +1,905 @@
+"""
+Comic generation pipeline shared by the synchronous route and the job API
+"""
+import asyncio
+import atexit
+import base64
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from io import BytesIO
+from compositing import IncrementalStripBuilder, PANEL_SIZE, strip_layout
+from generation import (
+    REFINE_MODE, generate_characters_description, generate_comic_script, get_panels, get_panel_stream, generate_comic,
+    agenerate_characters_description, agenerate_comic_script, aget_panels, aget_panel_stream, agenerate_comic,
+    refine_request, refine_image_gen_prompt, arefine_image_gen_prompt, render_panel_image, arender_panel_image,
+    place_panel, place_placeholder,
+)
+from encoding import OUTPUT_FORMAT, encode_image
+from metrics import timed, register_status, COMICS_TOTAL, COMICS_IN_FLIGHT
+from sessions import SessionBusyError, SessionNotFoundError, initialize_session_store
+from singleflight import initialize_single_flight
+from stability_ai import MAX_SEED, ImageSettings, use_image_settings
+from storage import initialize_storage
+from tracing import logger, submit_with_context
+from utils import aclose_async_http_client
+
+# Fixed parameters for comic generation
+FIXED_NUM_CHARACTERS = 2
+FIXED_STYLE = "manga, black and white"
+AUTO_GENERATE_CHARACTERS = True
+
+# How characters and panels are scripted: "separate" (two LLM calls) or "combined" (one)
+SCRIPT_MODE = os.getenv("SCRIPT_MODE", "separate")
+SCRIPT_MODES = ("separate", "combined")
+
+# "threads" runs the blocking pipeline, "asyncio" runs the async pipeline on
+# one long-lived event loop (see PipelineLoop) behind the same synchronous run_comic_pipeline API
+PIPELINE_RUNTIME = os.getenv("PIPELINE_RUNTIME", "threads")
+
+# Pipeline stages reported to progress callbacks, in execution order
+STAGES = ["characters", "panels", "images", "strip", "upload"]
+
+# Where finished strips go: imgbb, local directory or S3-compatible bucket
+storage = initialize_storage()
+register_status("storage", storage.get_status, {
+    'uploads': 'counter', 'failures': 'counter', 'retries': 'counter', 'pending': 'gauge',
+    'background_failures': 'counter',
+})
+
+# Identical concurrent requests share one run; results are reused for COMIC_DEDUP_TTL.
+# Every caller but the first gets its own copy of the comic's session (see share_comic)
+comic_flights = initialize_single_flight(share=lambda result: share_comic(result))
+if comic_flights:
+    register_status("comic_dedup", comic_flights.get_status, {
+        'in_flight': 'gauge', 'leaders': 'counter', 'coalesced': 'counter', 'cache_hits': 'counter', 'cached': 'gauge',
+    })
+
+# Script, prompts, seeds and panel images of every comic, for single-panel edits
+comic_sessions = initialize_session_store()
+if comic_sessions:
+    register_status("comic_sessions", comic_sessions.get_status, {
+        'created': 'counter', 'edits': 'counter', 'editing': 'gauge',
+    })
+
+# Also upload every captioned panel and a thumbnail (per request: "panel_uploads")
+PANEL_UPLOADS = os.getenv("PANEL_UPLOADS", "false").lower() in ('1', 'true', 'yes')
+PANEL_THUMBNAIL_WIDTH = int(os.getenv("PANEL_THUMBNAIL_WIDTH", 256))
+PANEL_THUMBNAIL_QUALITY = int(os.getenv("PANEL_THUMBNAIL_QUALITY", 70))
+# Upload threads of each comic; panel uploads run while the remaining panels render
+PANEL_UPLOAD_WORKERS = int(os.getenv("PANEL_UPLOAD_WORKERS", 4))
+# Longest the response waits for panel uploads still running once the strip is uploaded
+PANEL_UPLOAD_WAIT = float(os.getenv("PANEL_UPLOAD_WAIT", 10))
+
+
+def upload_comic(image, api_key, output_format=None):
+    """Encode the image and store it with the configured backend, returning the URL"""
+    try:
+        encoded = encode_image(image, output_format)
+        with timed("upload"):
+            return storage.store(encoded, api_key=api_key)
+    except Exception as e:
+        logger.error(f"Error uploading to {storage.backend.name}: {e}")
+        raise
+
+
+async def aupload_comic(image, api_key, output_format=None):
+    """Async upload_comic; encoding runs in a worker thread"""
+    try:
+        encoded = await asyncio.to_thread(encode_image, image, output_format)
+        with timed("upload"):
+            return await storage.astore(encoded, api_key=api_key)
+    except Exception as e:
+        logger.error(f"Error uploading to {storage.backend.name}: {e}")
+        raise
+
+
+def report(progress, stage, status, **details):
+    """Forward a stage update to the progress callback, if any"""
+    if progress:
+        progress(stage, status, **details)
+
+
+def emit(on_event, event, payload):
+    """Forward a pipeline event to the event callback, if any"""
+    if on_event:
+        on_event(event, payload)
+
+
+def parse_flag(value):
+    """Boolean request option; None when the client did not set it"""
+    if value is None:
+        return None
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def thumbnail(image, width=PANEL_THUMBNAIL_WIDTH):
+    """RGB copy of image scaled down to width"""
+    preview = image.convert('RGB')
+    preview.thumbnail((width, width * image.height // image.width))
+    return preview
+
+
+def thumbnail_data_uri(image, width=PANEL_THUMBNAIL_WIDTH):
+    """Encode a small JPEG preview of a panel as a data URI"""
+    buffer = BytesIO()
+    thumbnail(image, width).save(buffer, format='JPEG', quality=PANEL_THUMBNAIL_QUALITY)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def store_panel_image(image, api_key, output_format, preview=False):
+    """Encode and store one panel, or its JPEG thumbnail when preview is set"""
+    if preview:
+        encoded = encode_image(thumbnail(image), "jpeg", PANEL_THUMBNAIL_QUALITY, max_bytes=0)
+    else:
+        encoded = encode_image(image, output_format)
+    with timed("panel_upload"):
+        return storage.store(encoded, api_key=api_key)
+
+
+class PanelUploads:
+    """Uploads each captioned panel and its thumbnail as soon as the panel is composed.
+
+    on_panel is an on_panel callback for generate_comic; urls() collects the
+    results once the strip is done. Each comic has its own upload threads,
+    so its uploads never queue behind other comics', and urls() waits at
+    most PANEL_UPLOAD_WAIT: a failed or late upload only drops that URL.
+    """
+
+    def __init__(self, api_key, output_format):
+        self.api_key = api_key
+        self.output_format = output_format
+        self.futures = {}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, PANEL_UPLOAD_WORKERS), thread_name_prefix="panel-upload")
+
+    def on_panel(self, index, image):
+        self.futures[index] = {
+            key: submit_with_context(
+                self.executor, store_panel_image, image, self.api_key, self.output_format, preview,
+            )
+            for key, preview in (("imageUrl", False), ("thumbnailUrl", True))
+        }
+
+    def _pending(self):
+        return [future for futures in self.futures.values() for future in futures.values()]
+
+    def _collect(self, index, key, future):
+        if not future.done():
+            logger.warning(f"⚠️ Upload of panel {index + 1} {key} not done after {PANEL_UPLOAD_WAIT}s, skipped")
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            logger.warning(f"⚠️ Upload of panel {index + 1} {key} failed: {e}")
+            return None
+
+    def _results(self):
+        # Late uploads still finish, but nothing waits for them
+        self.executor.shutdown(wait=False)
+        return {
+            index: {key: self._collect(index, key, future) for key, future in futures.items()}
+            for index, futures in self.futures.items()
+        }
+
+    def urls(self):
+        """Wait for the uploads; {index: {"imageUrl": ..., "thumbnailUrl": ...}}"""
+        pending = self._pending()
+        if pending:
+            wait_futures(pending, timeout=PANEL_UPLOAD_WAIT)
+        return self._results()
+
+    async def aurls(self):
+        """Async urls(): awaits the uploads without blocking the loop"""
+        pending = self._pending()
+        if pending:
+            await asyncio.wait([asyncio.wrap_future(future) for future in pending], timeout=PANEL_UPLOAD_WAIT)
+        return self._results()
+
+
+def build_panel_data(panels, panel_urls=None):
+    """Prepare panel data for response"""
+    panel_data = []
+    for i, panel in enumerate(panels):
+        panel_data.append({
+            "panelNumber": i + 1,
+            "description": panel.get("description", ""),
+            "text": panel.get("text", ""),
+        })
+        if panel_urls is not None:
+            urls = panel_urls.get(i, {})
+            panel_data[-1]["imageUrl"] = urls.get("imageUrl")
+            panel_data[-1]["thumbnailUrl"] = urls.get("thumbnailUrl")
+    return panel_data
+
+
+class ScriptStream:
+    """Panels of a script the LLM is still writing, kept as they are iterated.
+
+    on_complete(panels) runs once the script is finished, usually while the
+    first panels are already rendering.
+    """
+
+    def __init__(self, stream, on_complete):
+        self.stream = stream
+        self.on_complete = on_complete
+        self.panels = []
+
+    def __iter__(self):
+        for panel in self.stream:
+            self.panels.append(panel)
+            yield panel
+        self.on_complete(self.panels)
+
+    async def __aiter__(self):
+        async for panel in self.stream:
+            self.panels.append(panel)
+            yield panel
+        self.on_complete(self.panels)
+
+
+def script_panels(script):
+    """The panel list of a generate_script result, once it has been rendered"""
+    return script.panels if isinstance(script, ScriptStream) else script
+
+
+def script_done(progress, on_event):
+    """Report a finished script: the panels stage and the script event"""
+    def on_complete(panels):
+        logger.info(f"📋 Generated {len(panels)} panels")
+        report(progress, "panels", "done", total=len(panels))
+        emit(on_event, "script", {"panels": build_panel_data(panels), "streaming": False})
+    return on_complete
+
+
+def generate_script(story, script_mode, progress=None, on_event=None):
+    """Produce (characters_description, panels) for the story.
+
+    Emits the characters and script events. With REFINE_MODE "stream" and
+    separate scripting, panels is a ScriptStream that yields each panel as
+    soon as the LLM has written it: a provisional script event (no panels,
+    "streaming" true) goes out before the first panel event, and the
+    panels stage and the complete script event follow when it is exhausted.
+    """
+    if script_mode == "combined":
+        report(progress, "characters", "running")
+        report(progress, "panels", "running")
+        try:
+            characters_description, panels = generate_comic_script(story)
+            logger.info(f"📝 Generated characters: {characters_description}")
+            report(progress, "characters", "done")
+            emit(on_event, "characters", {"characters_description": characters_description})
+            logger.info(f"📋 Generated {len(panels)} panels in one call")
+            report(progress, "panels", "done", total=len(panels))
+            emit(on_event, "script", {"panels": build_panel_data(panels), "streaming": False})
+            return characters_description, panels
+        except Exception as e:
+            logger.warning(f"⚠️ Combined script generation failed, using separate calls: {e}")
+
+    # Generate character descriptions automatically
+    report(progress, "characters", "running")
+    characters_description = generate_characters_description(story)
+    logger.info(f"📝 Generated characters: {characters_description}")
+    report(progress, "characters", "done")
+    emit(on_event, "characters", {"characters_description": characters_description})
+
+    # Create scenario with characters
+    scenario = f"Characters: {characters_description}\nStory: {story}"
+
+    # Generate panels
+    report(progress, "panels", "running")
+    if REFINE_MODE == "stream":
+        # Keeps the script event ahead of the panel events; the full script follows
+        emit(on_event, "script", {"panels": [], "streaming": True})
+        return characters_description, ScriptStream(
+            get_panel_stream(scenario, FIXED_STYLE), script_done(progress, on_event),
+        )
+    panels = get_panels(scenario, FIXED_STYLE)
+    script_done(progress, on_event)(panels)
+    return characters_description, panels
+
+
+async def agenerate_script(story, script_mode, progress=None, on_event=None):
+    """Async generate_script"""
+    if script_mode == "combined":
+        report(progress, "characters", "running")
+        report(progress, "panels", "running")
+        try:
+            characters_description, panels = await agenerate_comic_script(story)
+            logger.info(f"📝 Generated characters: {characters_description}")
+            report(progress, "characters", "done")
+            emit(on_event, "characters", {"characters_description": characters_description})
+            logger.info(f"📋 Generated {len(panels)} panels in one call")
+            report(progress, "panels", "done", total=len(panels))
+            emit(on_event, "script", {"panels": build_panel_data(panels), "streaming": False})
+            return characters_description, panels
+        except Exception as e:
+            logger.warning(f"⚠️ Combined script generation failed, using separate calls: {e}")
+
+    report(progress, "characters", "running")
+    characters_description = await agenerate_characters_description(story)
+    logger.info(f"📝 Generated characters: {characters_description}")
+    report(progress, "characters", "done")
+    emit(on_event, "characters", {"characters_description": characters_description})
+
+    scenario = f"Characters: {characters_description}\nStory: {story}"
+
+    report(progress, "panels", "running")
+    if REFINE_MODE == "stream":
+        emit(on_event, "script", {"panels": [], "streaming": True})
+        return characters_description, ScriptStream(
+            aget_panel_stream(scenario, FIXED_STYLE), script_done(progress, on_event),
+        )
+    panels = await aget_panels(scenario, FIXED_STYLE)
+    script_done(progress, on_event)(panels)
+    return characters_description, panels
+
+
+def comic_key(story, script_mode, output_format, panel_uploads, image_settings):
+    """Single-flight key: the normalized story plus everything that changes the result"""
+    return comic_flights.make_key(
+        story,
+        style=FIXED_STYLE,
+        script_mode=script_mode or SCRIPT_MODE,
+        output_format=output_format or OUTPUT_FORMAT,
+        panel_uploads=PANEL_UPLOADS if panel_uploads is None else panel_uploads,
+        storage=storage.backend.name,
+        profile=image_settings.profile.name,
+        seed=image_settings.seed,
+    )
+
+
+def run_comic_pipeline(story, imgbb_api_key, progress=None, script_mode=None, on_event=None, output_format=None,
+                       panel_uploads=None, profile=None, seed=None):
+    """Run the whole comic pipeline and return the response payload.
+
+    progress is an optional callable(stage, status, **details) notified
+    when each stage in STAGES starts and finishes. on_event is an optional
+    callable(event, payload) receiving intermediate results (characters,
+    script, panel, strip). script_mode, output_format and panel_uploads
+    override SCRIPT_MODE, OUTPUT_FORMAT and PANEL_UPLOADS for this request.
+    profile and seed pick the generation profile (see stability_ai.py) and
+    image seed; the result reports both, so a draft (fewer steps, same size)
+    can be re-run later at full quality with the same seed.
+
+    Identical concurrent requests share one run (see singleflight.py).
+    """
+    image_settings = ImageSettings(profile, seed)
+
+    def run(progress, on_event):
+        # Read by stability_ai; panel threads and the pipeline loop inherit it
+        with use_image_settings(image_settings):
+            if PIPELINE_RUNTIME == "asyncio":
+                return pipeline_loop.run(_arun_counted(
+                    story, imgbb_api_key, progress, script_mode, on_event, output_format, panel_uploads,
+                    image_settings,
+                ))
+            return _run_counted(
+                story, imgbb_api_key, progress, script_mode, on_event, output_format, panel_uploads, image_settings,
+            )
+
+    if comic_flights is None:
+        return run(progress, on_event)
+    key = comic_key(story, script_mode, output_format, panel_uploads, image_settings)
+    return comic_flights.run(key, run, progress, on_event)
+
+
+async def arun_comic_pipeline(story, imgbb_api_key, progress=None, script_mode=None, on_event=None,
+                              output_format=None, panel_uploads=None, profile=None, seed=None):
+    """Async run_comic_pipeline; callbacks are invoked from the event loop"""
+    image_settings = ImageSettings(profile, seed)
+
+    async def run(progress, on_event):
+        with use_image_settings(image_settings):
+            return await _arun_counted(
+                story, imgbb_api_key, progress, script_mode, on_event, output_format, panel_uploads, image_settings,
+            )
+
+    if comic_flights is None:
+        return await run(progress, on_event)
+    key = comic_key(story, script_mode, output_format, panel_uploads, image_settings)
+    return await comic_flights.arun(key, run, progress, on_event)
+
+
+def _run_counted(*args):
+    with COMICS_IN_FLIGHT.track_in_progress():
+        try:
+            result = _run_comic_pipeline(*args)
+        except Exception:
+            COMICS_TOTAL.inc(status="failure")
+            raise
+    COMICS_TOTAL.inc(status="success")
+    return result
+
+
+async def _arun_counted(*args):
+    with COMICS_IN_FLIGHT.track_in_progress():
+        try:
+            result = await _arun_comic_pipeline(*args)
+        except Exception:
+            COMICS_TOTAL.inc(status="failure")
+            raise
+    COMICS_TOTAL.inc(status="success")
+    return result
+
+
+class PipelineLoop:
+    """Long-lived event loop on a daemon thread running the async pipeline
+    behind the synchronous API (PIPELINE_RUNTIME=asyncio).
+
+    The HTTP and LLM clients bound to the loop live as long as it does, so
+    connections to Groq, Stability and storage are reused across comics.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.lock = threading.Lock()
+
+    def _get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="pipeline-loop", daemon=True).start()
+                atexit.register(self.close)
+            return self.loop
+
+    def run(self, coroutine):
+        """Run coroutine on the loop and block until it finishes.
+
+        The coroutine sees the caller's context variables (trace id,
+        request context, image settings), like a thread started with
+        submit_with_context.
+        """
+        loop = self._get_loop()
+        context = contextvars.copy_context()
+
+        async def run_in_context():
+            return await loop.create_task(coroutine, context=context)
+
+        return asyncio.run_coroutine_threadsafe(run_in_context(), loop).result()
+
+    def close(self):
+        """Close the loop's HTTP clients and stop it"""
+        with self.lock:
+            loop, self.loop = self.loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(aclose_async_http_client(), loop).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not close pipeline loop clients: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+pipeline_loop = PipelineLoop()
+
+
+def stage_tracker(progress):
+    """Wrap a progress callback so it also records the wall time of each finished stage"""
+    timings = {}
+    started = {}
+
+    def track(stage, status, **details):
+        now = time.perf_counter()
+        if status == "running":
+            started.setdefault(stage, now)
+        elif status == "done" and stage in started:
+            timings[stage] = round(now - started[stage], 3)
+        report(progress, stage, status, **details)
+
+    return track, timings
+
+
+def panel_emitter(on_event, uploads=None):
+    """on_panel callback forwarding panel thumbnails as events and starting
+    panel uploads, or None when neither is wanted"""
+    if not on_event and not uploads:
+        return None
+
+    def on_panel(index, image):
+        if uploads:
+            uploads.on_panel(index, image)
+        if on_event:
+            emit(on_event, "panel", {
+                "panelNumber": index + 1,
+                "thumbnail": thumbnail_data_uri(image),
+            })
+
+    return on_panel
+
+
+def build_result(comic_url, panels, characters_description, script_mode, output_format, timings, panel_urls=None,
+                 image_settings=None, session_id=None):
+    image_settings = image_settings or ImageSettings()
+    return {
+        "success": True,
+        "comic_url": comic_url,
+        "session_id": session_id,
+        "panels": build_panel_data(panels, panel_urls),
+        "characters_description": characters_description,
+        "style": FIXED_STYLE,
+        "script_mode": script_mode,
+        "output_format": output_format,
+        "profile": image_settings.profile.name,
+        "seed": image_settings.seed,
+        "timings": timings,
+    }
+
+
+def _run_comic_pipeline(story, imgbb_api_key, progress, script_mode, on_event, output_format, panel_uploads,
+                        image_settings):
+    script_mode = script_mode or SCRIPT_MODE
+    output_format = output_format or OUTPUT_FORMAT
+    panel_uploads = PANEL_UPLOADS if panel_uploads is None else panel_uploads
+    logger.info(f"🎨 Starting comic generation for story: {story[:100]}...")
+
+    # Wall time of each finished stage, returned with the result
+    track, timings = stage_tracker(progress)
+
+    # With a streamed script, panels start rendering while later ones are still being written
+    characters_description, script = generate_script(story, script_mode, track, on_event)
+
+    # Captioned panels start uploading as soon as they are composed
+    uploads = PanelUploads(imgbb_api_key, output_format) if panel_uploads else None
+    session = start_session(story, characters_description, script_mode, output_format, image_settings)
+
+    # Generate comic images (returns PIL Image directly)
+    comic_image = generate_comic(
+        script, FIXED_STYLE, characters_description,
+        progress=track, on_panel=panel_emitter(on_event, uploads), on_render=session_recorder(session),
+    )
+    panels = script_panels(script)
+
+    if not comic_image:
+        raise Exception("Comic generation failed - no image generated")
+
+    # Upload the comic strip straight from memory (no local file needed)
+    track("upload", "running")
+    comic_url = upload_comic(comic_image, imgbb_api_key, output_format)
+    track("upload", "done")
+
+    logger.info(f"✅ Comic uploaded to: {comic_url}")
+    emit(on_event, "strip", {"comic_url": comic_url})
+
+    panel_urls = None
+    if uploads:
+        # Usually finished already: they ran while later panels rendered and the strip uploaded
+        track("panel_uploads", "running")
+        panel_urls = uploads.urls()
+        track("panel_uploads", "done")
+
+    return build_result(
+        comic_url, panels, characters_description, script_mode, output_format, timings, panel_urls, image_settings,
+        session_id=finish_session(session, panels, comic_url, panel_urls),
+    )
+
+
+async def _arun_comic_pipeline(story, imgbb_api_key, progress, script_mode, on_event, output_format, panel_uploads,
+                               image_settings):
+    script_mode = script_mode or SCRIPT_MODE
+    output_format = output_format or OUTPUT_FORMAT
+    panel_uploads = PANEL_UPLOADS if panel_uploads is None else panel_uploads
+    logger.info(f"🎨 Starting comic generation for story: {story[:100]}...")
+
+    track, timings = stage_tracker(progress)
+
+    characters_description, script = await agenerate_script(story, script_mode, track, on_event)
+
+    uploads = PanelUploads(imgbb_api_key, output_format) if panel_uploads else None
+    session = await asyncio.to_thread(
+        start_session, story, characters_description, script_mode, output_format, image_settings,
+    )
+    comic_image = await agenerate_comic(
+        script, FIXED_STYLE, characters_description,
+        progress=track, on_panel=panel_emitter(on_event, uploads), on_render=session_recorder(session),
+    )
+    panels = script_panels(script)
+
+    if not comic_image:
+        raise Exception("Comic generation failed - no image generated")
+
+    track("upload", "running")
+    comic_url = await aupload_comic(comic_image, imgbb_api_key, output_format)
+    track("upload", "done")
+
+    logger.info(f"✅ Comic uploaded to: {comic_url}")
+    emit(on_event, "strip", {"comic_url": comic_url})
+
+    panel_urls = None
+    if uploads:
+        track("panel_uploads", "running")
+        panel_urls = await uploads.aurls()
+        track("panel_uploads", "done")
+
+    session_id = await asyncio.to_thread(finish_session, session, panels, comic_url, panel_urls)
+    return build_result(
+        comic_url, panels, characters_description, script_mode, output_format, timings, panel_urls, image_settings,
+        session_id=session_id,
+    )
+
+
+def start_session(story, characters_description, script_mode, output_format, image_settings):
+    """Session record for a comic about to be rendered, or None when sessions are off.
+
+    The panels are only known once the script has been fully streamed, so
+    finish_session adds them.
+    """
+    if comic_sessions is None:
+        return None
+    try:
+        return comic_sessions.new_session(
+            story=story,
+            style=FIXED_STYLE,
+            characters_description=characters_description,
+            panels=None,
+            script_mode=script_mode,
+            output_format=output_format,
+            profile=image_settings.profile.name,
+            seed=image_settings.seed,
+            # Per panel: refined prompt, seed and profile of the stored image (None if it failed);
+            # keyed by panel index until finish_session
+            renders={},
+            comic_url=None,
+            panel_urls=None,
+        )
+    except OSError as e:
+        logger.warning(f"⚠️ Could not start comic session: {e}")
+        return None
+
+
+def session_recorder(session):
+    """on_render callback storing each uncaptioned panel in the session, or None"""
+    if session is None:
+        return None
+
+    layout = strip_layout(PANEL_SIZE)
+
+    def on_render(index, image, refined_prompt):
+        if index >= len(layout.slots):
+            return
+        try:
+            # Only ever shown at slot size, so that is all that is kept
+            comic_sessions.save_panel(session["session_id"], index, layout.fit_image(index, image))
+        except OSError as e:
+            logger.warning(f"⚠️ Could not store panel {index + 1} of session {session['session_id']}: {e}")
+            return
+        session["renders"][index] = {"prompt": refined_prompt, "seed": session["seed"], "profile": session["profile"]}
+
+    return on_render
+
+
+def finish_session(session, panels, comic_url, panel_urls):
+    """Store the finished comic; returns its session id, or None if it was not stored"""
+    if session is None:
+        return None
+    session["panels"] = [dict(panel) for panel in panels]
+    session["renders"] = [session["renders"].get(i) for i in range(len(panels))]
+    session["comic_url"] = comic_url
+    session["panel_urls"] = panel_urls
+    try:
+        comic_sessions.save(session)
+    except OSError as e:
+        logger.warning(f"⚠️ Could not store comic session {session['session_id']}: {e}")
+        return None
+    return session["session_id"]
+
+
+def share_comic(result):
+    """A coalesced or recent comic for another caller, with its own session to edit"""
+    session_id = result.get("session_id")
+    if session_id is None:
+        return result
+    try:
+        # An edited session no longer matches the comic being handed out
+        session_id = comic_sessions.fork(session_id, lambda session: session["comic_url"] == result["comic_url"])
+    except (SessionNotFoundError, SessionBusyError, OSError) as e:
+        logger.warning(f"⚠️ Could not copy comic session {session_id} for another request: {e}")
+        session_id = None
+    return {**result, "session_id": session_id}
+
+
+def session_store():
+    """The comic session store; raises SessionNotFoundError when sessions are off"""
+    if comic_sessions is None:
+        raise SessionNotFoundError("Comic sessions are disabled")
+    return comic_sessions
+
+
+def load_session(session_id):
+    session = session_store().load(session_id)
+    # JSON turned the panel indexes into strings
+    if session["panel_urls"] is not None:
+        session["panel_urls"] = {int(index): urls for index, urls in session["panel_urls"].items()}
+    return session
+
+
+def session_result(session, timings=None):
+    """Response payload for a stored comic, shaped like run_comic_pipeline's"""
+    return build_result(
+        session["comic_url"], session["panels"], session["characters_description"], session["script_mode"],
+        session["output_format"], timings or {}, session["panel_urls"],
+        ImageSettings(session["profile"], session["seed"]), session_id=session["session_id"],
+    )
+
+
+def get_session(session_id):
+    """Stored comic of a session; raises SessionNotFoundError"""
+    return session_result(load_session(session_id))
+
+
+def apply_panel_edit(session, panel_number, text, description, seed, profile, regenerate):
+    """Apply an edit to the session record.
+
+    Returns (index, image_settings, refine): image_settings is None when
+    only the caption changes, refine whether the prompt must be refined
+    again. Raises ValueError for an unknown panel or an empty edit.
+    """
+    panels = session["panels"]
+    try:
+        index = int(panel_number) - 1
+    except (TypeError, ValueError):
+        raise ValueError("panel must be an integer")
+    # Panels beyond the last slot are not on the strip and have no image to edit
+    on_strip = min(len(panels), len(strip_layout(PANEL_SIZE).slots))
+    if not 0 <= index < on_strip:
+        raise ValueError(f"panel must be between 1 and {on_strip}")
+    if text is None and description is None and seed is None and profile is None and not regenerate:
+        raise ValueError("Nothing to change: give text, description, seed, profile or regenerate")
+
+    render = session["renders"][index]
+    previous = render or {"seed": session["seed"], "profile": session["profile"]}
+    if regenerate and seed is None and description is None and profile is None:
+        # Same prompt and seed would give the same image
+        seed = random.randint(0, MAX_SEED)
+    image_settings = ImageSettings(profile or previous["profile"], previous["seed"] if seed is None else seed)
+
+    if text is not None:
+        panels[index]["text"] = str(text)
+    if description is not None:
+        panels[index]["description"] = str(description)
+    if render is not None and description is None and seed is None and profile is None:
+        return index, None, False
+    return index, image_settings, render is None or description is not None
+
+
+def reassemble_strip(session, index, image):
+    """Strip builder holding the new panel image at index and the stored images elsewhere.
+
+    Stored panels are already at slot size, so they are pasted without scaling.
+    """
+    panels = session["panels"]
+    builder = IncrementalStripBuilder(len(panels))
+    for i in range(builder.count):
+        panel_image = image if i == index else comic_sessions.load_panel(session["session_id"], i)
+        if panel_image is None:
+            place_placeholder(builder, i, panels[i])
+        else:
+            place_panel(builder, i, panels[i], panel_image)
+    return builder
+
+
+def stage_render(session, index, image, refined_prompt, image_settings):
+    """Record a re-rendered panel; its image is staged until the edit commits with the session"""
+    staged_path = comic_sessions.stage_panel(
+        session["session_id"], index, strip_layout(PANEL_SIZE).fit_image(index, image),
+    )
+    session["renders"][index] = {
+        "prompt": refined_prompt, "seed": image_settings.seed, "profile": image_settings.profile.name,
+    }
+    return staged_path
+
+
+def edit_panel(session_id, panel_number, imgbb_api_key, text=None, description=None, seed=None, profile=None,
+               regenerate=False):
+    """Re-render or re-caption one panel of a stored comic and upload the updated strip.
+
+    text alone only re-captions the stored image. description refines a
+    new prompt and re-renders with the panel's seed; seed or profile
+    re-render the stored prompt; regenerate alone re-renders it with a new
+    seed. The other panels come from the session, already at slot size,
+    so reassembling the strip costs no rendering or rescaling. Returns the
+    response payload like run_comic_pipeline. Raises SessionNotFoundError,
+    SessionBusyError or ValueError.
+    """
+    if PIPELINE_RUNTIME == "asyncio":
+        return pipeline_loop.run(aedit_panel(
+            session_id, panel_number, imgbb_api_key, text, description, seed, profile, regenerate,
+        ))
+    with session_store().editing(session_id):
+        session = load_session(session_id)
+        track, timings = stage_tracker(None)
+        index, image_settings, refine = apply_panel_edit(
+            session, panel_number, text, description, seed, profile, regenerate,
+        )
+        panel = session["panels"][index]
+        # The new image replaces the stored one only together with the session record
+        staged = {}
+        try:
+            track("images", "running")
+            if image_settings is None:
+                image = comic_sessions.load_panel(session_id, index)
+            else:
+                refined_prompt = session["renders"][index]["prompt"] if not refine else refine_image_gen_prompt(
+                    refine_request(panel, session["style"], session["characters_description"]),
+                )
+                with use_image_settings(image_settings):
+                    image = render_panel_image(
+                        panel, session["style"], session["characters_description"], refined_prompt,
+                    )
+                staged[index] = stage_render(session, index, image, refined_prompt, image_settings)
+            track("images", "done")
+
+            track("strip", "running")
+            builder = reassemble_strip(session, index, image)
+            track("strip", "done")
+
+            uploads = None
+            if session["panel_urls"] is not None:
+                uploads = PanelUploads(imgbb_api_key, session["output_format"])
+                uploads.on_panel(index, builder.slot_image(index))
+
+            track("upload", "running")
+            session["comic_url"] = upload_comic(builder.result(), imgbb_api_key, session["output_format"])
+            track("upload", "done")
+            if uploads:
+                session["panel_urls"].update(uploads.urls())
+
+            comic_sessions.commit(session, staged)
+        except BaseException:
+            comic_sessions.discard(staged)
+            raise
+        logger.info(f"✏️ Updated panel {index + 1} of session {session_id}: {session['comic_url']}")
+        return session_result(session, timings)
+
+
+async def aedit_panel(session_id, panel_number, imgbb_api_key, text=None, description=None, seed=None,
+                      profile=None, regenerate=False):
+    """Async edit_panel; disk I/O and compositing run in worker threads"""
+    with session_store().editing(session_id):
+        session = await asyncio.to_thread(load_session, session_id)
+        track, timings = stage_tracker(None)
+        index, image_settings, refine = apply_panel_edit(
+            session, panel_number, text, description, seed, profile, regenerate,
+        )
+        panel = session["panels"][index]
+        staged = {}
+        try:
+            track("images", "running")
+            if image_settings is None:
+                image = await asyncio.to_thread(comic_sessions.load_panel, session_id, index)
+            else:
+                refined_prompt = session["renders"][index]["prompt"] if not refine else await arefine_image_gen_prompt(
+                    refine_request(panel, session["style"], session["characters_description"]),
+                )
+                with use_image_settings(image_settings):
+                    image = await arender_panel_image(
+                        panel, session["style"], session["characters_description"], refined_prompt,
+                    )
+                staged[index] = await asyncio.to_thread(
+                    stage_render, session, index, image, refined_prompt, image_settings,
+                )
+            track("images", "done")
+
+            track("strip", "running")
+            builder = await asyncio.to_thread(reassemble_strip, session, index, image)
+            track("strip", "done")
+
+            uploads = None
+            if session["panel_urls"] is not None:
+                uploads = PanelUploads(imgbb_api_key, session["output_format"])
+                uploads.on_panel(index, builder.slot_image(index))
+
+            track("upload", "running")
+            session["comic_url"] = await aupload_comic(builder.result(), imgbb_api_key, session["output_format"])
+            track("upload", "done")
+            if uploads:
+                session["panel_urls"].update(await uploads.aurls())
+
+            await asyncio.to_thread(comic_sessions.commit, session, staged)
+        except BaseException:
+            comic_sessions.discard(staged)
+            raise
+        logger.info(f"✏️ Updated panel {index + 1} of session {session_id}: {session['comic_url']}")
+        return session_result(session, timings)
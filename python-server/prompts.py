@@ -74,4 +74,71 @@ Adrien, a blonde hair guy wearing glasses, sitting at the office, working on his
 Input: {characters_description}
 
 Panel Description:
-"""
\ No newline at end of file
+"""
+IMAGE_PROMPT_REFINE_BATCH = """
+You are provided with several cartoon panel descriptions and description of all the characters involved in the comic
+For EACH panel, generate a cartoon panel description using only the description of the characters involved in that panel.
+DONOT add description of those characters that are not involved in the panel.
+
+You MUST answer with a JSON array of strings, one string per panel, in the same order as the panels.
+Do not write anything before or after the JSON array.
+
+Example input:
+Characters: Adrien is a guy with blond hair wearing glasses. Vincent is a guy with black hair wearing a hat.
+Panel 1: Adrien is sitting alone in his office, working on his computer.
+Panel 2: Vincent opens the door, holding two coffees.
+
+Example output:
+["Adrien, a blonde hair guy wearing glasses, sitting at the office, working on his computer", "Vincent, a black hair guy wearing a hat, opening an office door, holding two coffees"]
+
+Characters: {characters_description}
+{panels}
+
+Panel Descriptions:
+"""
+
+COMIC_SCRIPT_PROMPT = """
+Your role is of a Cartoonist who is responsible for creating a comic strip based on a short scenario.
+
+First, describe the characters in the scenario.
+The description MUST be precise and short, and only about the physical appearance of the characters.
+Include descriptions of ALL the IMPORTANT characters in the scenario, one line per character as "Name: description".
+
+Then split the scenario in 6 parts, each part being a different cartoon panel.
+For each cartoon panel, write a description of it with:
+ - the characters in the panel, they must be described precisely each time
+ - the background of the panel
+
+You MUST follow these instructions else you will be penalized:
+Instructions:
+- The description should be only word or group of word delimited by a comma, no sentence.
+- Always use the characters descriptions instead of their name in the cartoon panel description.
+- You can not use the same description twice.
+- You will also write the text of the panel.
+- The text should not be more than 2 small sentences.
+- Each sentence should start by the character name
+
+You MUST answer with a single JSON object following this schema, and nothing else:
+{{
+  "characters": "Name: description\\nName: description",
+  "panels": [
+    {{"description": "...", "text": "Name: sentence\\nName: sentence"}}
+  ]
+}}
+
+Example input:
+Adrien and Vincent want to start a new product, and they create it in one night before presenting it to the board.
+
+Example output:
+{{
+  "characters": "Adrien: A tall guy with blond hair wearing glasses.\\nVincent: A short guy with black hair wearing a hat.",
+  "panels": [
+    {{"description": "2 guys, a blond hair guy wearing glasses, a dark hair guy wearing hat, sitting at the office, with computers", "text": "Vincent: I think Generative AI are the future of the company.\\nAdrien: Let's create a new product with it."}}
+  ]
+}}
+
+Short Scenario:
+{scenario}
+
+JSON with the characters and the 6 panels:
+"""
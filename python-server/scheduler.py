@@ -0,0 +1,356 @@
+"""
+Priority and fair-share scheduling of Stability requests
+Slots are granted by priority class, then round-robin across tenants, and
+requests whose comic has timed out or been cancelled are dropped while they
+wait. The request context travels in a context variable, like the trace id.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from tracing import logger
+
+# Served in this order; interactive requests go ahead of background work
+PRIORITIES = ("interactive", "batch")
+
+# How long a comic stays worth finishing, per priority class (0 = no deadline)
+DEFAULT_TIMEOUTS = {
+    "interactive": float(os.getenv("COMIC_INTERACTIVE_TIMEOUT", 600)),
+    "batch": float(os.getenv("COMIC_BATCH_TIMEOUT", 3600)),
+}
+
+# Waiters re-check cancellation at least this often (seconds)
+CANCEL_POLL_INTERVAL = 1.0
+
+
+class RequestExpired(Exception):
+    """The request was cancelled or passed its deadline before it got a slot"""
+
+
+class RequestContext:
+    """Who a comic is for, how urgent it is and until when it is worth finishing"""
+
+    def __init__(self, tenant: str = "default", priority: str = "interactive", timeout: Optional[float] = None):
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        self.tenant = tenant
+        self.priority = priority
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None without one"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return self.cancelled or (remaining is not None and remaining <= 0)
+
+    def check(self):
+        if self.cancelled:
+            raise RequestExpired("Request was cancelled")
+        if self.expired:
+            raise RequestExpired("Request deadline passed")
+
+    def watch(self, fn):
+        """Priority and tenant never change; returns a no-op unwatch"""
+        return lambda: None
+
+
+class SharedRequest:
+    """Context of work done once for several requests, such as a coalesced flight
+
+    It stays live while any of its requests does and is as urgent as the most
+    urgent live one, so no request inherits the deadline, cancellation or
+    priority of whichever request happened to start the work.
+    """
+
+    def __init__(self):
+        self.contexts = []
+        self.watchers = []
+        self.lock = threading.Lock()
+
+    def add(self, context):
+        with self.lock:
+            self.contexts.append(context)
+        # Nested shared work (a panel flight inside a comic flight) follows its requests too
+        context.watch(self._changed)
+        self._changed()
+
+    def watch(self, fn):
+        """Call fn when priority or tenant may have changed; returns the function that stops watching"""
+        with self.lock:
+            self.watchers.append(fn)
+
+        def unwatch():
+            with self.lock:
+                if fn in self.watchers:
+                    self.watchers.remove(fn)
+        return unwatch
+
+    def _changed(self):
+        with self.lock:
+            watchers = list(self.watchers)
+        for fn in watchers:
+            fn()
+
+    def _live(self) -> list:
+        with self.lock:
+            contexts = list(self.contexts)
+        return [context for context in contexts if not context.expired] or contexts
+
+    def _leading(self):
+        contexts = self._live()
+        if not contexts:
+            return DEFAULT_CONTEXT
+        return min(contexts, key=lambda context: PRIORITIES.index(context.priority))
+
+    @property
+    def tenant(self) -> str:
+        return self._leading().tenant
+
+    @property
+    def priority(self) -> str:
+        return self._leading().priority
+
+    @property
+    def cancelled(self) -> bool:
+        with self.lock:
+            return bool(self.contexts) and all(context.cancelled for context in self.contexts)
+
+    def cancel(self):
+        with self.lock:
+            contexts = list(self.contexts)
+        for context in contexts:
+            context.cancel()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the last live request's deadline, or None if one has none"""
+        remaining = [context.remaining() for context in self._live()]
+        if not remaining or None in remaining:
+            return None
+        return max(remaining)
+
+    @property
+    def expired(self) -> bool:
+        with self.lock:
+            contexts = list(self.contexts)
+        return bool(contexts) and all(context.expired for context in contexts)
+
+    def check(self):
+        if self.expired:
+            raise RequestExpired("Every request sharing this work was cancelled or timed out")
+
+
+DEFAULT_CONTEXT = RequestContext()
+request_context_var = contextvars.ContextVar("request_context", default=DEFAULT_CONTEXT)
+
+
+def current_request() -> RequestContext:
+    return request_context_var.get()
+
+
+def set_request_context(context: RequestContext):
+    """Set the request context for the current context and return the reset token"""
+    return request_context_var.set(context)
+
+
+class _Waiter:
+    __slots__ = ("context", "priority", "tenant", "wake", "granted", "dropped")
+
+    def __init__(self, context, wake):
+        self.context = context
+        # Where the waiter is queued; a shared context may move it later
+        self.priority = context.priority
+        self.tenant = context.tenant
+        self.wake = wake
+        self.granted = False
+        self.dropped = False
+
+
+class SlotScheduler:
+    """Process-wide pool of Stability slots shared by threads and event loops"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        # priority -> tenant -> FIFO of waiters; tenants rotate after each grant
+        self.queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self.lock = threading.Lock()
+        self.granted = {priority: 0 for priority in PRIORITIES}
+        self.dropped = 0
+
+    def _waiting(self) -> int:
+        return sum(len(waiters) for queue in self.queues.values() for waiters in queue.values())
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            while queue:
+                tenant, waiters = next(iter(queue.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    queue.move_to_end(tenant)
+                else:
+                    del queue[tenant]
+                if waiter.context.expired:
+                    waiter.dropped = True
+                    self.dropped += 1
+                    waiter.wake()
+                    continue
+                return waiter
+        return None
+
+    def _dispatch(self):
+        """Hand free slots to the next waiters (lock must be held)"""
+        while self.in_use < self.capacity:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self.in_use += 1
+            self.granted[waiter.priority] += 1
+            waiter.granted = True
+            waiter.wake()
+
+    def _enqueue(self, context, wake) -> Optional[_Waiter]:
+        """Take a slot right away (returns None) or queue a waiter"""
+        context.check()
+        with self.lock:
+            if self.in_use < self.capacity and not self._waiting():
+                self.in_use += 1
+                self.granted[context.priority] += 1
+                return None
+            waiter = _Waiter(context, wake)
+            self.queues[waiter.priority].setdefault(waiter.tenant, deque()).append(waiter)
+            return waiter
+
+    def _remove(self, waiter) -> bool:
+        """Take a waiter out of its queue (lock must be held); False if it was not queued"""
+        waiters = self.queues[waiter.priority].get(waiter.tenant)
+        if not waiters or waiter not in waiters:
+            return False
+        waiters.remove(waiter)
+        if not waiters:
+            del self.queues[waiter.priority][waiter.tenant]
+        return True
+
+    def _requeue(self, waiter):
+        """Move a waiter whose shared context became more urgent or changed tenant"""
+        with self.lock:
+            priority, tenant = waiter.context.priority, waiter.context.tenant
+            if (priority, tenant) == (waiter.priority, waiter.tenant) or not self._remove(waiter):
+                return
+            waiter.priority, waiter.tenant = priority, tenant
+            self.queues[priority].setdefault(tenant, deque()).append(waiter)
+
+    def _abandon(self, waiter) -> bool:
+        """Stop waiting; True if the slot was granted meanwhile and is now held"""
+        with self.lock:
+            if waiter.granted:
+                return True
+            if self._remove(waiter) and not waiter.dropped:
+                self.dropped += 1
+            return False
+
+    @staticmethod
+    def _wait_time(context) -> float:
+        remaining = context.remaining()
+        if remaining is None:
+            return CANCEL_POLL_INTERVAL
+        return max(0.0, min(remaining, CANCEL_POLL_INTERVAL))
+
+    def release(self):
+        with self.lock:
+            self.in_use -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, context: Optional[RequestContext] = None):
+        """Hold one slot for the current request, blocking the calling thread"""
+        context = context or current_request()
+        event = threading.Event()
+        waiter = self._enqueue(context, event.set)
+        unwatch = context.watch(lambda: self._requeue(waiter)) if waiter else None
+        try:
+            while waiter is not None and not event.is_set():
+                event.wait(self._wait_time(context))
+                if not event.is_set() and context.expired:
+                    break
+        finally:
+            if unwatch:
+                unwatch()
+        if waiter is not None and not waiter.granted:
+            if not self._abandon(waiter):
+                logger.warning(f"⏭️ Dropped Stability request for tenant {context.tenant}: request expired")
+                raise RequestExpired("Request expired while waiting for a Stability slot")
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, context: Optional[RequestContext] = None):
+        """Async slot(); waits without blocking the event loop"""
+        context = context or current_request()
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: ready.done() or ready.set_result(None))
+
+        waiter = self._enqueue(context, wake)
+        unwatch = context.watch(lambda: self._requeue(waiter)) if waiter else None
+        try:
+            while waiter is not None and not ready.done():
+                await asyncio.wait({ready}, timeout=self._wait_time(context))
+                if not ready.done() and context.expired:
+                    break
+        except asyncio.CancelledError:
+            if waiter is not None and self._abandon(waiter):
+                self.release()
+            raise
+        finally:
+            if unwatch:
+                unwatch()
+        if waiter is not None and not waiter.granted:
+            if not self._abandon(waiter):
+                logger.warning(f"⏭️ Dropped Stability request for tenant {context.tenant}: request expired")
+                raise RequestExpired("Request expired while waiting for a Stability slot")
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                'capacity': self.capacity,
+                'in_use': self.in_use,
+                'waiting': self._waiting(),
+                'tenants': len(set(itertools.chain.from_iterable(self.queues.values()))),
+                'granted_interactive': self.granted['interactive'],
+                'granted_batch': self.granted['batch'],
+                'dropped': self.dropped,
+            }
+
+
+def request_context_from(tenant: Optional[str], priority: Optional[str], timeout, default_priority: str):
+    """Build a RequestContext from request fields; raises ValueError on bad input"""
+    priority = priority or default_priority
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+    timeout = DEFAULT_TIMEOUTS[priority] if timeout is None else float(timeout)
+    return RequestContext(tenant=str(tenant or "default"), priority=priority, timeout=timeout or None)
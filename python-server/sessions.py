@@ -0,0 +1,196 @@
+"""
+Persisted comic sessions for single-panel edits
+Each comic keeps its script, refined prompts, seeds and uncaptioned panel
+images (at strip slot size) on disk, so one panel can be re-rendered or
+re-captioned and the strip reassembled without redoing the others
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from PIL import Image
+
+from tracing import logger
+
+# Session files are scratch data: fast, light compression is enough
+PNG_COMPRESS_LEVEL = 1
+
+
+class SessionNotFoundError(Exception):
+    """The session id is unknown or the session has expired"""
+
+
+class SessionBusyError(Exception):
+    """Another edit of the same session is still running"""
+
+
+class ComicSessionStore:
+    """One directory per comic: session.json and panel-<index>.png"""
+
+    def __init__(self, directory: str, ttl: float = 86400):
+        self.directory = os.path.abspath(directory)
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = threading.Lock()
+        # Session ids with an edit in progress in this process
+        self.editing_ids = set()
+        self.created = 0
+        self.edits = 0
+
+        logger.info(f"🗂️ Initialized comic session store in {self.directory}")
+
+    def _path(self, session_id: str, name: str = "") -> str:
+        if not session_id.isalnum():
+            raise SessionNotFoundError(f"Unknown session {session_id}")
+        return os.path.join(self.directory, session_id, name)
+
+    def _panel_path(self, session_id: str, index: int) -> str:
+        return self._path(session_id, f"panel-{index}.png")
+
+    @staticmethod
+    def _write(path, write):
+        """Write through a temporary file so readers never see a partial file"""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def new_session(self, **fields) -> dict:
+        """Start a session record; it is only stored by save()"""
+        self._prune()
+        session_id = uuid.uuid4().hex
+        os.makedirs(self._path(session_id), exist_ok=True)
+        with self.lock:
+            self.created += 1
+        return {"session_id": session_id, "created_at": time.time(), "updated_at": None, **fields}
+
+    def save(self, session: dict):
+        session["updated_at"] = time.time()
+
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(session, f)
+        self._write(self._path(session["session_id"], "session.json"), write)
+
+    def save_panel(self, session_id: str, index: int, image: Image.Image):
+        """Store the uncaptioned image of a panel"""
+        self._write(
+            self._panel_path(session_id, index),
+            lambda tmp_path: image.save(tmp_path, format="PNG", compress_level=PNG_COMPRESS_LEVEL),
+        )
+
+    def stage_panel(self, session_id: str, index: int, image: Image.Image) -> str:
+        """Write a new panel image beside the current one; commit() puts it in place"""
+        staged_path = f"{self._panel_path(session_id, index)}.{uuid.uuid4().hex}.staged"
+        image.save(staged_path, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+        return staged_path
+
+    def commit(self, session: dict, staged: dict):
+        """Put staged panel images (index -> staged path) in place and save the session describing them"""
+        for index, staged_path in staged.items():
+            os.replace(staged_path, self._panel_path(session["session_id"], index))
+        self.save(session)
+
+    @staticmethod
+    def discard(staged: dict):
+        """Remove staged panel images of an edit that failed"""
+        for staged_path in staged.values():
+            try:
+                os.remove(staged_path)
+            except OSError:
+                pass
+
+    def fork(self, session_id: str, check: Optional[Callable] = None) -> str:
+        """Copy a session under a new id, so another caller edits its own copy.
+
+        check(session) can refuse the copy (SessionNotFoundError), e.g. when the
+        session has been edited since. Raises SessionBusyError during an edit.
+        """
+        with self._held(session_id):
+            session = self.load(session_id)
+            if check is not None and not check(session):
+                raise SessionNotFoundError(f"Session {session_id} has changed")
+            session["session_id"] = uuid.uuid4().hex
+            # Files are only ever replaced, never rewritten, so both sessions can share them
+            shutil.copytree(
+                self._path(session_id), self._path(session["session_id"]), copy_function=os.link,
+                ignore=shutil.ignore_patterns("*.tmp", "*.staged", "session.json"),
+            )
+            self.save(session)
+        with self.lock:
+            self.created += 1
+        return session["session_id"]
+
+    def load(self, session_id: str) -> dict:
+        try:
+            with open(self._path(session_id, "session.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise SessionNotFoundError(f"Unknown session {session_id}")
+
+    def load_panel(self, session_id: str, index: int) -> Optional[Image.Image]:
+        """Uncaptioned panel image, or None for a panel that failed to render"""
+        try:
+            with Image.open(self._panel_path(session_id, index)) as stored:
+                return stored.copy()
+        except (OSError, ValueError):
+            return None
+
+    @contextmanager
+    def _held(self, session_id: str):
+        with self.lock:
+            if session_id in self.editing_ids:
+                raise SessionBusyError(f"Session {session_id} is being edited")
+            self.editing_ids.add(session_id)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.editing_ids.discard(session_id)
+
+    @contextmanager
+    def editing(self, session_id: str):
+        """Hold the session for one edit; raises SessionBusyError if it is already held.
+
+        Only guards edits within this process. Load the session inside the
+        block, so the edit starts from the last one committed.
+        """
+        with self._held(session_id):
+            with self.lock:
+                self.edits += 1
+            yield
+
+    def _prune(self):
+        """Drop sessions not updated within ttl"""
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path)
+            except OSError as e:
+                logger.warning(f"⚠️ Could not remove expired session {entry.name}: {e}")
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                'created': self.created,
+                'edits': self.edits,
+                'editing': len(self.editing_ids),
+            }
+
+
+def initialize_session_store() -> Optional[ComicSessionStore]:
+    """Initialize the comic session store from environment, or None when disabled"""
+    if os.getenv('COMIC_SESSIONS_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    return ComicSessionStore(
+        os.getenv('COMIC_SESSION_DIR', os.path.join('cache', 'sessions')),
+        ttl=float(os.getenv('COMIC_SESSION_TTL', 86400)),
+    )
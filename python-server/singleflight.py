@@ -0,0 +1,225 @@
+"""
+Single-flight coalescing for identical comic requests
+Concurrent callers with the same key share one pipeline run, and finished
+results are kept for a short TTL to absorb immediate retries. The run is
+scheduled for all of its callers: it lives while any of them does, at the
+most urgent caller's priority, and a caller whose leader gave up takes over.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from scheduler import RequestExpired, SharedRequest, current_request, request_context_var, set_request_context
+from tracing import logger
+
+
+class Flight:
+    """One in-progress run; fans its progress and events out to every caller"""
+
+    def __init__(self):
+        self.future = Future()
+        self.lock = threading.Lock()
+        # Replayed to callers that attach late, so they see every stage
+        self.history = []
+        self.subscribers = []
+        # Request contexts of every caller; the run is scheduled under this
+        self.request = SharedRequest()
+
+    def attach(self, progress: Optional[Callable], on_event: Optional[Callable]):
+        with self.lock:
+            for kind, args, kwargs in self.history:
+                self._deliver((progress, on_event), kind, args, kwargs)
+            self.subscribers.append((progress, on_event))
+
+    def replay(self, progress: Optional[Callable], on_event: Optional[Callable]):
+        """Deliver the recorded history of a finished run"""
+        with self.lock:
+            for kind, args, kwargs in self.history:
+                self._deliver((progress, on_event), kind, args, kwargs)
+
+    def close(self):
+        with self.lock:
+            self.subscribers = []
+
+    @staticmethod
+    def _deliver(subscriber, kind, args, kwargs):
+        callback = subscriber[0] if kind == "progress" else subscriber[1]
+        if callback:
+            try:
+                callback(*args, **kwargs)
+            except Exception as e:
+                logger.warning(f"⚠️ Subscriber callback failed: {e}")
+
+    def _publish(self, kind, args, kwargs):
+        with self.lock:
+            self.history.append((kind, args, kwargs))
+            for subscriber in self.subscribers:
+                self._deliver(subscriber, kind, args, kwargs)
+
+    def progress(self, stage, status, **details):
+        self._publish("progress", (stage, status), details)
+
+    def on_event(self, event, payload):
+        self._publish("event", (event, payload), {})
+
+
+class SingleFlight:
+    def __init__(self, ttl: float = 60.0, max_results: int = 256, label: str = "comic",
+                 share: Optional[Callable] = None):
+        self.ttl = ttl
+        self.label = label
+        # Applied to results handed to followers, e.g. to copy mutable images
+        self.share = share or (lambda result: result)
+        self.max_results = max_results
+        self.flights = {}
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+
+    @staticmethod
+    def make_key(story: str, **config) -> str:
+        """Hash the normalized story (case and whitespace folded) with its config"""
+        normalized = " ".join(story.split()).casefold()
+        payload = json.dumps({"story": normalized, **config}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _join(self, key, progress, on_event):
+        """Returns (cached_result, flight, is_leader); flight is None on a cache hit"""
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self.results[key]
+                entry = None
+            if entry is not None:
+                self.results.move_to_end(key)
+                self.cache_hits += 1
+            else:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = Flight()
+                    self.leaders += 1
+                else:
+                    self.coalesced += 1
+        if entry is not None:
+            # Replay the finished run so job stages and streams look the same as a live one
+            entry[1].replay(progress, on_event)
+            return entry[2], None, False
+        flight.request.add(current_request())
+        flight.attach(progress, on_event)
+        return None, flight, leader
+
+    def _finish(self, key, flight, result=None, error=None):
+        with self.lock:
+            self.flights.pop(key, None)
+            if error is None and self.ttl > 0:
+                self.results[key] = (time.monotonic() + self.ttl, flight, result)
+                while len(self.results) > self.max_results:
+                    self.results.popitem(last=False)
+        flight.close()
+        if error is None:
+            flight.future.set_result(result)
+        else:
+            flight.future.set_exception(error)
+
+    def _take_over(self, error) -> bool:
+        """Whether a follower should rerun the work its leader gave up on"""
+        if not isinstance(error, RequestExpired) or current_request().expired:
+            return False
+        logger.info(f"🔁 Leading {self.label} request gave up; taking over its run")
+        return True
+
+    def _lead(self, key, flight, error):
+        """Record how the leader's run ended; a cancelled leader hands the work to its followers"""
+        if isinstance(error, asyncio.CancelledError):
+            error = RequestExpired(f"Leading {self.label} request was cancelled")
+        self._finish(key, flight, error=error)
+
+    def run(self, key: str, fn: Callable, progress=None, on_event=None):
+        """Return fn(progress, on_event) for key, running it at most once at a time.
+
+        Callers that join an in-flight run receive its progress and events,
+        including those reported before they joined.
+        """
+        while True:
+            cached, flight, leader = self._join(key, progress, on_event)
+            if flight is None:
+                logger.info(f"♻️ Returning recent result for identical {self.label} request")
+                return self.share(cached)
+            if leader:
+                break
+            logger.info(f"🔗 Attached to identical in-flight {self.label} request")
+            try:
+                return self.share(flight.future.result())
+            except RequestExpired as e:
+                if not self._take_over(e):
+                    raise
+
+        token = set_request_context(flight.request)
+        try:
+            result = fn(flight.progress, flight.on_event)
+        except BaseException as e:
+            self._lead(key, flight, e)
+            raise
+        finally:
+            request_context_var.reset(token)
+        self._finish(key, flight, result=result)
+        return result
+
+    async def arun(self, key: str, fn: Callable, progress=None, on_event=None):
+        """Async run; fn is a coroutine function and followers await without blocking the loop"""
+        while True:
+            cached, flight, leader = self._join(key, progress, on_event)
+            if flight is None:
+                logger.info(f"♻️ Returning recent result for identical {self.label} request")
+                return self.share(cached)
+            if leader:
+                break
+            logger.info(f"🔗 Attached to identical in-flight {self.label} request")
+            try:
+                # Shielded so a cancelled follower does not cancel the shared future
+                return self.share(await asyncio.shield(asyncio.wrap_future(flight.future)))
+            except RequestExpired as e:
+                if not self._take_over(e):
+                    raise
+
+        token = set_request_context(flight.request)
+        try:
+            result = await fn(flight.progress, flight.on_event)
+        except BaseException as e:
+            self._lead(key, flight, e)
+            raise
+        finally:
+            request_context_var.reset(token)
+        self._finish(key, flight, result=result)
+        return result
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                'in_flight': len(self.flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'cache_hits': self.cache_hits,
+                'cached': len(self.results),
+            }
+
+
+def initialize_single_flight(share: Optional[Callable] = None) -> Optional[SingleFlight]:
+    """Initialize request coalescing from environment, or None when disabled"""
+    if os.getenv('COMIC_DEDUP_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    return SingleFlight(
+        ttl=float(os.getenv('COMIC_DEDUP_TTL', 60)),
+        max_results=int(os.getenv('COMIC_DEDUP_MAX_RESULTS', 256)),
+        share=share,
+    )
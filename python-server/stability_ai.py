@@ -1,8 +1,12 @@
+import asyncio
 import base64
+import contextvars
+import hashlib
 import io
 import os
 import warnings
 import random
+from contextlib import contextmanager
 
 import requests
 from PIL import Image
@@ -10,68 +14,358 @@ from stability_sdk import client
 import stability_sdk.interfaces.gooseai.generation.generation_pb2 as generation
 from dotenv import load_dotenv
 from api_key_manager import initialize_stability_key_manager
+from stability_pool import initialize_stability_client_pool
+from image_cache import ImageCache, initialize_image_cache
+from metrics import STABILITY_IN_FLIGHT, register_status
+from scheduler import SlotScheduler
+from singleflight import SingleFlight
+from microbatch import initialize_image_batcher
+from utils import get_async_http_client, get_http_client
+from tracing import logger
 
 load_dotenv()
-os.environ['STABILITY_HOST'] = 'grpc.stability.ai:443'
+os.environ.setdefault('STABILITY_HOST', 'grpc.stability.ai:443')
 
-seed = random.randint(0, 1000000000)
+# Pin STABILITY_SEED to make cached images reusable across restarts
+seed = int(os.getenv("STABILITY_SEED") or random.randint(0, 1000000000))
+
+# Text-to-image generation parameters
+ENGINE_ID = "stable-diffusion-xl-1024-v1-0"
+STEPS = 30
+CFG_SCALE = 8.0
+WIDTH = 1024
+HEIGHT = 1024
+SAMPLER = generation.SAMPLER_K_DPMPP_2M
+
+
+class GenerationProfile:
+    """Step count of one quality level"""
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = steps
+
+
+# Quality levels selectable per request. Every level renders on the same engine
+# at the same size and differs only in steps, so a seed keeps its composition:
+# re-running a draft with the same seed and another profile refines that image.
+# SDXL only accepts its fixed ~1MP sizes, so a draft is not smaller, only shorter:
+# sampling time scales with steps, about half of a standard render by default.
+GENERATION_PROFILES = {profile.name: profile for profile in (
+    GenerationProfile("draft", int(os.getenv("DRAFT_STEPS", 15))),
+    GenerationProfile("standard", STEPS),
+    GenerationProfile("high", int(os.getenv("HIGH_STEPS", 50))),
+)}
+DEFAULT_PROFILE = os.getenv("GENERATION_PROFILE", "standard")
+if DEFAULT_PROFILE not in GENERATION_PROFILES:
+    raise ValueError(f"GENERATION_PROFILE must be one of {', '.join(GENERATION_PROFILES)}")
+
+# Largest seed the Stability API accepts
+MAX_SEED = 4294967295
+
+
+class ImageSettings:
+    """Profile and seed used for every panel of one comic"""
+
+    def __init__(self, profile=None, seed_value=None):
+        if profile is not None and profile not in GENERATION_PROFILES:
+            raise ValueError(f"profile must be one of {', '.join(GENERATION_PROFILES)}")
+        if seed_value is not None:
+            try:
+                seed_value = int(seed_value)
+            except (TypeError, ValueError):
+                raise ValueError("seed must be an integer")
+            if not 0 <= seed_value <= MAX_SEED:
+                raise ValueError(f"seed must be between 0 and {MAX_SEED}")
+        self.profile = GENERATION_PROFILES[profile or DEFAULT_PROFILE]
+        self.seed = seed if seed_value is None else seed_value
+
+
+# Set by the pipeline for the comic being generated; panel threads and tasks
+# inherit it like the trace id and request context
+image_settings_var = contextvars.ContextVar("image_settings", default=None)
+
+
+def current_image_settings() -> ImageSettings:
+    return image_settings_var.get() or ImageSettings()
+
+
+@contextmanager
+def use_image_settings(settings: ImageSettings):
+    """Generate images with settings within this block"""
+    token = image_settings_var.set(settings)
+    try:
+        yield
+    finally:
+        image_settings_var.reset(token)
+
+# Stability REST API used by the asyncio pipeline
+STABILITY_API_HOST = os.getenv("STABILITY_API_HOST", "https://api.stability.ai")
+STABILITY_TIMEOUT = float(os.getenv("STABILITY_TIMEOUT", 120))
+REST_SAMPLER = "K_DPMPP_2M"
+# Endpoint taking several text-to-image requests per call ({"requests": [...]} ->
+# {"results": [{"artifacts": [...]}, ...]}); the v1 API has none, so this is a
+# batching inference backend (or the benchmark's stand-in)
+STABILITY_BATCH_URL = os.getenv("STABILITY_BATCH_URL")
+
+# Image-to-image edit parameters
+EDIT_SEED = 123463446
+EDIT_STEPS = 50
+EDIT_START_SCHEDULE = 0.6
+EDIT_SIZE = (512, 512)
+
+# Repeated prompts with the same parameters produce the same image
+image_cache = initialize_image_cache()
+
+# Global cap on Stability requests in flight across all comics of this process.
+# Slots are shared by threads and event loops and handed out by priority, then
+# round-robin across tenants (see scheduler.py)
+STABILITY_MAX_IN_FLIGHT = int(os.getenv("STABILITY_MAX_IN_FLIGHT", 8))
+stability_scheduler = SlotScheduler(STABILITY_MAX_IN_FLIGHT)
+
+# Identical text-to-image requests from concurrent comics share one API call.
+# Different prompts can only share a call through a batch endpoint (below)
+STABILITY_COALESCE = os.getenv("STABILITY_COALESCE", "true").lower() in ('1', 'true', 'yes')
+image_flights = SingleFlight(
+    ttl=0, label="image", share=lambda img: img.copy() if img is not None else None,
+) if STABILITY_COALESCE else None
 
 # Initialize Stability API key manager
 try:
     stability_key_manager = initialize_stability_key_manager()
 except Exception as e:
-    print(f"⚠️ Stability API key manager initialization failed: {e}")
+    logger.warning(f"⚠️ Stability API key manager initialization failed: {e}")
     stability_key_manager = None
 
-# Global variable to hold current API client
-stability_api = None
-
 def create_stability_client(api_key):
     """Create a Stability API client with the given key"""
     return client.StabilityInference(
+        host=os.environ['STABILITY_HOST'],
         key=api_key,
-        verbose=True,
-        engine="stable-diffusion-xl-1024-v1-0",
+        verbose=False,
+        engine=ENGINE_ID,
     )
 
-def text_to_image_with_key(api_key, prompt):
+# Long-lived gRPC clients shared by all request threads, one per API key
+stability_pool = initialize_stability_client_pool(create_stability_client)
+
+if stability_key_manager:
+    register_status("stability_keys", stability_key_manager.get_status, {
+        'available': 'gauge', 'failed': 'gauge', 'in_flight': 'gauge',
+        'rotations': 'counter', 'failures': 'counter',
+    })
+if image_cache:
+    register_status("image_cache", image_cache.get_status, {
+        'hits': 'counter', 'disk_hits': 'counter', 'misses': 'counter', 'disk_bytes': 'gauge',
+    })
+register_status("stability_pool", stability_pool.get_status, {'channels': 'gauge', 'healthy': 'gauge'})
+register_status("stability_scheduler", stability_scheduler.get_status, {
+    'in_use': 'gauge', 'waiting': 'gauge', 'tenants': 'gauge',
+    'granted_interactive': 'counter', 'granted_batch': 'counter', 'dropped': 'counter',
+})
+if image_flights:
+    register_status("image_coalesce", image_flights.get_status, {
+        'in_flight': 'gauge', 'leaders': 'counter', 'coalesced': 'counter',
+    })
+
+def text_to_image_with_key(api_key, prompt, settings=None):
     """Generate image using specific API key"""
-    stability_client = create_stability_client(api_key)
-    
-    # Set up our initial generation parameters.
-    answers = stability_client.generate(
-        prompt=prompt,
-        seed=seed,
-        steps=30,
-        cfg_scale=8.0,
-        width=1024,
-        height=1024,
-        sampler=generation.SAMPLER_K_DPMPP_2M
-    )
-    
-    for resp in answers:
-        for artifact in resp.artifacts:
-            if artifact.finish_reason == generation.FILTER:
-                warnings.warn(
-                    "Your request activated the API's safety filters and could not be processed."
-                    "Please modify the prompt and try again.")
-            if artifact.type == generation.ARTIFACT_IMAGE:
-                img = Image.open(io.BytesIO(artifact.binary))
-                return img
-    
+    settings = settings or current_image_settings()
+    profile = settings.profile
+    with stability_pool.acquire(api_key) as stability_client:
+        # Set up our initial generation parameters.
+        answers = stability_client.generate(
+            prompt=prompt,
+            seed=settings.seed,
+            steps=profile.steps,
+            cfg_scale=CFG_SCALE,
+            width=WIDTH,
+            height=HEIGHT,
+            sampler=SAMPLER
+        )
+
+        for resp in answers:
+            for artifact in resp.artifacts:
+                if artifact.finish_reason == generation.FILTER:
+                    warnings.warn(
+                        "Your request activated the API's safety filters and could not be processed."
+                        "Please modify the prompt and try again.")
+                if artifact.type == generation.ARTIFACT_IMAGE:
+                    # Decoded eagerly: coalesced callers copy it from several threads
+                    return decode_image(artifact.binary)
+
     return None
 
+def text_to_image_key(prompt, settings=None):
+    """Every parameter that determines the generated image"""
+    settings = settings or current_image_settings()
+    profile = settings.profile
+    return ImageCache.make_key(
+        engine=ENGINE_ID, prompt=prompt, seed=settings.seed, steps=profile.steps,
+        cfg_scale=CFG_SCALE, sampler=SAMPLER, size=(WIDTH, HEIGHT),
+    )
+
+def text_to_image_cache_key(prompt, settings=None):
+    if not image_cache:
+        return None
+    return text_to_image_key(prompt, settings)
+
 def text_to_image(prompt):
-    """Generate image with automatic API key fallback"""
+    """Generate image with automatic API key fallback, using the current image settings"""
+    settings = current_image_settings()
+    cache_key = text_to_image_cache_key(prompt, settings)
+    if cache_key:
+        cached = image_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"♻️ Image cache hit for prompt: {prompt[:60]}...")
+            return cached
+
+    def generate(*_):
+        if image_batcher:
+            return image_batcher.run((prompt, settings))
+        with stability_scheduler.slot(), STABILITY_IN_FLIGHT.track_in_progress():
+            return _text_to_image(prompt, settings)
+
+    if image_flights:
+        img = image_flights.run(cache_key or text_to_image_key(prompt, settings), generate)
+    else:
+        img = generate()
+
+    if img is not None and cache_key:
+        image_cache.put(cache_key, img)
+    return img
+
+def _text_to_image(prompt, settings):
     if not stability_key_manager:
         # Fallback to single key if manager not available
         single_key = os.getenv("STABILITY_KEY")
         if not single_key:
             raise Exception("No Stability API keys configured")
-        return text_to_image_with_key(single_key, prompt)
+        return text_to_image_with_key(single_key, prompt, settings)
     
     # Use key manager with fallback
-    return stability_key_manager.execute_with_fallback(text_to_image_with_key, prompt)
+    return stability_key_manager.execute_with_fallback(text_to_image_with_key, prompt, settings)
+
+def decode_image(data):
+    """Decode image bytes eagerly so callers can run it off the event loop"""
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return img
+
+def rest_request_body(prompt, settings):
+    """JSON body of a REST text-to-image request"""
+    return {
+        "text_prompts": [{"text": prompt}],
+        "cfg_scale": CFG_SCALE,
+        "seed": settings.seed,
+        "steps": settings.profile.steps,
+        "width": WIDTH,
+        "height": HEIGHT,
+        "samples": 1,
+        "sampler": REST_SAMPLER,
+    }
+
+def rest_image_data(artifacts):
+    """Image bytes of the first REST artifact that has any, or None"""
+    for artifact in artifacts:
+        if artifact.get("finishReason") == "CONTENT_FILTERED":
+            warnings.warn(
+                "Your request activated the API's safety filters and could not be processed."
+                "Please modify the prompt and try again.")
+        if artifact.get("base64"):
+            return base64.b64decode(artifact["base64"])
+    return None
+
+async def atext_to_image_with_key(api_key, prompt, settings=None):
+    """Generate image through the Stability REST API using specific API key"""
+    settings = settings or current_image_settings()
+    response = await get_async_http_client().post(
+        f"{STABILITY_API_HOST}/v1/generation/{ENGINE_ID}/text-to-image",
+        headers={
+            "Accept": "application/json",
+            "Authorization": f"Bearer {api_key}",
+        },
+        json=rest_request_body(prompt, settings),
+        timeout=STABILITY_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise Exception(f"Non-200 response: {response.status_code} {response.text}")
+
+    data = rest_image_data(response.json().get("artifacts", []))
+    if data is None:
+        return None
+    return await asyncio.to_thread(decode_image, data)
+
+def text_to_images_with_key(api_key, batch):
+    """Generate one image per (prompt, settings) in a single call to the batch endpoint"""
+    response = get_http_client().post(
+        STABILITY_BATCH_URL,
+        headers={
+            "Accept": "application/json",
+            "Authorization": f"Bearer {api_key}",
+        },
+        json={"requests": [rest_request_body(prompt, settings) for prompt, settings in batch]},
+        timeout=STABILITY_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise Exception(f"Non-200 response: {response.status_code} {response.text}")
+
+    images = []
+    for result in response.json().get("results", []):
+        data = rest_image_data(result.get("artifacts", []))
+        images.append(decode_image(data) if data is not None else None)
+    return images
+
+def send_image_batch(batch, context):
+    """MicroBatcher send: one Stability slot and one API call for the whole batch"""
+    with stability_scheduler.slot(context), STABILITY_IN_FLIGHT.track_in_progress():
+        if stability_key_manager:
+            return stability_key_manager.execute_with_fallback(text_to_images_with_key, batch)
+        single_key = os.getenv("STABILITY_KEY")
+        if not single_key:
+            raise Exception("No Stability API keys configured")
+        return text_to_images_with_key(single_key, batch)
+
+# Panels of concurrent comics are collected for up to STABILITY_BATCH_MAX_WAIT and
+# sent together, STABILITY_BATCH_MAX_SIZE per call, when a batch endpoint is set
+image_batcher = initialize_image_batcher(send_image_batch, STABILITY_MAX_IN_FLIGHT)
+if image_batcher:
+    register_status("image_batches", image_batcher.get_status, {
+        'waiting': 'gauge', 'batches': 'counter', 'batched': 'counter', 'full_batches': 'counter',
+    })
+
+async def atext_to_image(prompt):
+    """Async text_to_image; cache disk I/O and image decoding run in worker threads"""
+    settings = current_image_settings()
+    cache_key = text_to_image_cache_key(prompt, settings)
+    if cache_key:
+        cached = await asyncio.to_thread(image_cache.get, cache_key)
+        if cached is not None:
+            logger.info(f"♻️ Image cache hit for prompt: {prompt[:60]}...")
+            return cached
+
+    if image_flights:
+        img = await image_flights.arun(
+            cache_key or text_to_image_key(prompt, settings), lambda *_: _atext_to_image(prompt, settings),
+        )
+    else:
+        img = await _atext_to_image(prompt, settings)
+
+    if img is not None and cache_key:
+        await asyncio.to_thread(image_cache.put, cache_key, img)
+    return img
+
+async def _atext_to_image(prompt, settings):
+    if image_batcher:
+        return await image_batcher.arun((prompt, settings))
+    async with stability_scheduler.aslot():
+        with STABILITY_IN_FLIGHT.track_in_progress():
+            if stability_key_manager:
+                return await stability_key_manager.aexecute_with_fallback(atext_to_image_with_key, prompt, settings)
+            single_key = os.getenv("STABILITY_KEY")
+            if not single_key:
+                raise Exception("No Stability API keys configured")
+            return await atext_to_image_with_key(single_key, prompt, settings)
 
     # using newer api for sdxl v1.6
     # load_dotenv()
@@ -122,37 +416,58 @@ def text_to_image(prompt):
 def edit_image_with_key(api_key, input_image_path, prompt, output_image_name):
     """Edit image using specific API key"""
     img = Image.open(input_image_path)
-    stability_client = create_stability_client(api_key)
-
-    # Set up our initial generation parameters.
-    answers = stability_client.generate(
-        prompt=prompt,
-        init_image=img,
-        start_schedule=0.6,
-        seed=123463446,
-        steps=50,
-        cfg_scale=8.0,
-        width=512,
-        height=512,
-        sampler=generation.SAMPLER_K_DPMPP_2M
-    )
 
-    # Set up our warning to print to the console if the adult content classifier is tripped.
-    # If adult content classifier is not tripped, save generated image.
-    for resp in answers:
-        for artifact in resp.artifacts:
-            if artifact.finish_reason == generation.FILTER:
-                warnings.warn(
-                    "Your request activated the API's safety filters and could not be processed."
-                    "Please modify the prompt and try again.")
-            if artifact.type == generation.ARTIFACT_IMAGE:
-                img2 = Image.open(io.BytesIO(artifact.binary))
-                img2.save(output_image_name + ".png")
-                return img2
+    with stability_pool.acquire(api_key) as stability_client:
+        # Set up our initial generation parameters.
+        answers = stability_client.generate(
+            prompt=prompt,
+            init_image=img,
+            start_schedule=EDIT_START_SCHEDULE,
+            seed=EDIT_SEED,
+            steps=EDIT_STEPS,
+            cfg_scale=CFG_SCALE,
+            width=EDIT_SIZE[0],
+            height=EDIT_SIZE[1],
+            sampler=SAMPLER
+        )
+
+        # Set up our warning to print to the console if the adult content classifier is tripped.
+        # If adult content classifier is not tripped, save generated image.
+        for resp in answers:
+            for artifact in resp.artifacts:
+                if artifact.finish_reason == generation.FILTER:
+                    warnings.warn(
+                        "Your request activated the API's safety filters and could not be processed."
+                        "Please modify the prompt and try again.")
+                if artifact.type == generation.ARTIFACT_IMAGE:
+                    img2 = Image.open(io.BytesIO(artifact.binary))
+                    img2.save(output_image_name + ".png")
+                    return img2
     return None
 
 def edit_image(input_image_path, prompt, output_image_name):
     """Edit image with automatic API key fallback"""
+    cache_key = None
+    if image_cache:
+        with open(input_image_path, "rb") as f:
+            init_digest = hashlib.sha256(f.read()).hexdigest()
+        cache_key = ImageCache.make_key(
+            engine=ENGINE_ID, prompt=prompt, init_image=init_digest, start_schedule=EDIT_START_SCHEDULE,
+            seed=EDIT_SEED, steps=EDIT_STEPS, cfg_scale=CFG_SCALE, sampler=SAMPLER, size=EDIT_SIZE,
+        )
+        cached = image_cache.get(cache_key)
+        if cached is not None:
+            cached.save(output_image_name + ".png")
+            return cached
+
+    with stability_scheduler.slot(), STABILITY_IN_FLIGHT.track_in_progress():
+        img = _edit_image(input_image_path, prompt, output_image_name)
+
+    if img is not None and cache_key:
+        image_cache.put(cache_key, img)
+    return img
+
+def _edit_image(input_image_path, prompt, output_image_name):
     if not stability_key_manager:
         # Fallback to single key if manager not available
         single_key = os.getenv("STABILITY_KEY")
@@ -0,0 +1,92 @@
+"""
+Pool of long-lived Stability gRPC clients, one per API key
+Reuses channels across requests, caps concurrent streams per key
+and rebuilds channels that break or grow too old
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+import grpc
+
+from tracing import logger
+
+# gRPC status codes that indicate the channel itself is unusable
+CHANNEL_FAILURE_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.UNKNOWN,
+}
+
+
+class PooledClient:
+    def __init__(self, client, max_streams: int):
+        self.client = client
+        self.created_at = time.time()
+        self.streams = threading.BoundedSemaphore(max_streams)
+        self.healthy = True
+
+
+class StabilityClientPool:
+    def __init__(self, factory: Callable, max_streams_per_key: int = 4, max_age: float = 3600):
+        self.factory = factory
+        self.max_streams_per_key = max_streams_per_key
+        self.max_age = max_age
+        self.entries: Dict[str, PooledClient] = {}
+        self.lock = threading.Lock()
+
+    def _entry(self, api_key: str) -> PooledClient:
+        """Return a healthy pooled client for the key, reconnecting if needed"""
+        with self.lock:
+            entry = self.entries.get(api_key)
+            if entry is not None and entry.healthy and time.time() - entry.created_at < self.max_age:
+                return entry
+
+            if entry is not None:
+                logger.info(f"♻️ Reconnecting Stability channel for key {api_key[:8]}...")
+            entry = PooledClient(self.factory(api_key), self.max_streams_per_key)
+            self.entries[api_key] = entry
+            return entry
+
+    @contextmanager
+    def acquire(self, api_key: str):
+        """Borrow the client for api_key, waiting for a free stream slot.
+
+        Channels that fail with a transport-level gRPC error are marked
+        unhealthy and rebuilt on the next acquire.
+        """
+        entry = self._entry(api_key)
+        with entry.streams:
+            try:
+                yield entry.client
+            except grpc.RpcError as e:
+                code = e.code() if callable(getattr(e, "code", None)) else None
+                if code in CHANNEL_FAILURE_CODES:
+                    entry.healthy = False
+                raise
+
+    def invalidate(self, api_key: str):
+        """Drop the channel for a key so the next request reconnects"""
+        with self.lock:
+            self.entries.pop(api_key, None)
+
+    def get_status(self) -> dict:
+        """Get current status of pooled channels"""
+        with self.lock:
+            return {
+                'channels': len(self.entries),
+                'healthy': sum(1 for entry in self.entries.values() if entry.healthy),
+                'max_streams_per_key': self.max_streams_per_key,
+            }
+
+
+def initialize_stability_client_pool(factory: Callable) -> StabilityClientPool:
+    """Initialize Stability client pool from environment"""
+    return StabilityClientPool(
+        factory,
+        max_streams_per_key=int(os.getenv('STABILITY_MAX_STREAMS_PER_KEY', 4)),
+        max_age=float(os.getenv('STABILITY_CHANNEL_MAX_AGE', 3600)),
+    )
@@ -1,47 +1,169 @@
 #!/usr/bin/env python3
 """
 Startup script for the Comic Generation Server
+
+Modes (SERVER_MODE env var or --mode):
+  production   gunicorn with multiple worker processes and threads (default)
+  async        uvicorn serving the asyncio pipeline (asgi_app.py)
+  development  Flask's built-in server with the debugger and reloader
 """
+import argparse
 import os
+import shutil
 import sys
-from app import app
+from dotenv import load_dotenv
+
+load_dotenv()
 
 def check_environment():
     """Check if all required environment variables are set"""
     required_vars = [
         'GROQ_API_KEY',
-        'STABILITY_KEY', 
-        'IMGBB_API_KEY'
+        'STABILITY_KEY',
     ]
-    
+    if os.getenv('STORAGE_BACKEND', 'imgbb') == 'imgbb':
+        required_vars.append('IMGBB_API_KEY')
+    elif os.getenv('STORAGE_BACKEND') == 's3':
+        required_vars.append('S3_BUCKET')
+
     missing_vars = []
     for var in required_vars:
         if not os.getenv(var):
             missing_vars.append(var)
-    
+
     if missing_vars:
         print("❌ Missing required environment variables:")
         for var in missing_vars:
             print(f"   - {var}")
         print("\nPlease set these variables in your .env file")
         return False
-    
+
     return True
 
+def web_workers():
+    """Worker processes to run; one unless WEB_WORKERS says otherwise.
+
+    Every limit (STABILITY_MAX_IN_FLIGHT and the Stability slot scheduler,
+    the per-key rate limits and cooldowns, the LLM and image cache memory
+    tiers, the job queue) is enforced per process, so each extra worker
+    multiplies those budgets.
+    """
+    return max(1, int(os.getenv('WEB_WORKERS', 1)))
+
+def prepare_workers(workers):
+    """Shared state for several worker processes: job status and metrics directories"""
+    if workers <= 1:
+        return
+    print(f"⚠️ {workers} workers: per-process limits (STABILITY_MAX_IN_FLIGHT, STABILITY_KEY_RATE, "
+          f"COMIC_JOB_QUEUE_SIZE, cache sizes...) apply to each worker; divide them by WEB_WORKERS")
+    # Job status must be visible from every worker process
+    os.environ.setdefault('COMIC_JOB_STATE_DIR', os.path.join('cache', 'jobs'))
+    # /metrics sums the samples of every worker; drop the ones of a previous run
+    metrics_dir = os.environ.setdefault('METRICS_MULTIPROC_DIR', os.path.join('cache', 'metrics'))
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+def gunicorn_options(host, port):
+    """Gunicorn settings sized for long, I/O-bound comic requests.
+
+    Each request spends minutes waiting on Groq, Stability and imgbb, so
+    the worker process runs many threads. More processes spread the
+    CPU-bound image compositing across cores, but see web_workers.
+    """
+    workers = web_workers()
+    return {
+        'bind': f"{host}:{port}",
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': int(os.getenv('WEB_THREADS', 32)),
+        # A synchronous /generate-comic call can legitimately take minutes
+        'timeout': int(os.getenv('WEB_TIMEOUT', 600)),
+        # On shutdown, give in-flight comics this long to finish
+        'graceful_timeout': int(os.getenv('WEB_GRACEFUL_TIMEOUT', 300)),
+        'keepalive': int(os.getenv('WEB_KEEPALIVE', 75)),
+        'backlog': int(os.getenv('WEB_BACKLOG', 2048)),
+        'max_requests': int(os.getenv('WEB_MAX_REQUESTS', 0)),
+        'max_requests_jitter': int(os.getenv('WEB_MAX_REQUESTS_JITTER', 0)),
+        'accesslog': '-',
+        'worker_exit': drain_jobs,
+    }
+
+def drain_jobs(server, worker):
+    """Let queued and running background jobs, then background uploads, finish before a worker exits"""
+    from app import job_manager
+    from pipeline import storage
+    status = job_manager.get_status()
+    if status['active']:
+        print(f"⏳ Draining {status['active']} comic jobs before worker exit...")
+    job_manager.shutdown(wait=True)
+    pending = storage.get_status()['pending']
+    if pending:
+        print(f"⏳ Draining {pending} background uploads before worker exit...")
+    storage.shutdown()
+
+def run_production(host, port):
+    from gunicorn.app.base import BaseApplication
+
+    options = gunicorn_options(host, port)
+    prepare_workers(options['workers'])
+
+    class ComicServer(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+    print(f"🏭 Production mode: {options['workers']} workers x {options['threads']} threads")
+    ComicServer().run()
+
+def run_async(host, port):
+    """One event loop per worker process; comics are coroutines, not threads"""
+    import uvicorn
+
+    workers = web_workers()
+    prepare_workers(workers)
+
+    print(f"⚡ Async mode: {workers} workers with one event loop each")
+    uvicorn.run(
+        'asgi_app:app',
+        host=host,
+        port=port,
+        workers=workers,
+        backlog=int(os.getenv('WEB_BACKLOG', 2048)),
+        timeout_keep_alive=int(os.getenv('WEB_KEEPALIVE', 75)),
+        timeout_graceful_shutdown=int(os.getenv('WEB_GRACEFUL_TIMEOUT', 300)),
+    )
+
+def run_development(host, port):
+    from app import app
+    app.run(debug=True, port=port, host=host)
+
 def main():
+    parser = argparse.ArgumentParser(description="Comic Generation Server")
+    parser.add_argument('--mode', choices=['production', 'async', 'development'],
+                        default=os.getenv('SERVER_MODE', 'production'))
+    args = parser.parse_args()
+
     print("🎨 Starting Comic Generation Server...")
-    
+
     if not check_environment():
         sys.exit(1)
-    
+
     # Get port and host from environment variables
     port = int(os.getenv('PORT', 5001))
     host = os.getenv('HOST', '0.0.0.0')
-    
+
     print("✅ Environment check passed")
     print(f"🚀 Server starting on http://{host}:{port}")
-    
-    app.run(debug=True, port=port, host=host)
+
+    if args.mode == 'development':
+        run_development(host, port)
+    elif args.mode == 'async':
+        run_async(host, port)
+    else:
+        run_production(host, port)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
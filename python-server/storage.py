@@ -0,0 +1,342 @@
+"""
+Storage backends for finished comics
+imgbb, local filesystem (served by the app) and S3-compatible object storage
+behind one interface, with pooled connections, timeouts, jittered retries
+and optional background uploads for backends that know the URL up front
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from tracing import logger, submit_with_context
+from utils import get_async_http_client
+
+STORAGE_BACKENDS = ("imgbb", "local", "s3")
+
+
+class StorageError(Exception):
+    """Upload failure; retryable marks transient errors worth another attempt"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, StorageError):
+        return error.retryable
+    # requests.RequestException is an IOError, so OSError would retry every HTTP and local-disk error
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, httpx.TransportError))
+
+
+def new_object_name(extension: str) -> str:
+    return f"{uuid.uuid4().hex}.{extension}"
+
+
+def imgbb_files(encoded, name: Optional[str] = None):
+    """Multipart file field for an encoded image (no base64 copy of the bytes)"""
+    return {"image": (name or f"comic.{encoded.extension}", encoded.data, encoded.mime_type)}
+
+
+class StorageBackend:
+    """Base class: upload(encoded, name, api_key) returns the public URL"""
+
+    name = "base"
+    # Whether url_for(name) is known before the upload finishes
+    preassigns_urls = False
+    # Whether uploads need the per-request imgbb API key
+    requires_api_key = False
+
+    def upload(self, encoded, name: str, api_key: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    async def aupload(self, encoded, name: str, api_key: Optional[str] = None) -> str:
+        return await asyncio.to_thread(self.upload, encoded, name, api_key)
+
+    def url_for(self, name: str) -> str:
+        raise NotImplementedError
+
+
+class ImgbbStorage(StorageBackend):
+    name = "imgbb"
+    requires_api_key = True
+
+    def __init__(self, upload_url: str, api_key: Optional[str] = None, timeout=(5.0, 60.0), pool_size: int = 20):
+        self.upload_url = upload_url
+        self.api_key = api_key
+        self.timeout = timeout
+        # One keep-alive pool shared by every upload thread
+        self.session = requests.Session()
+        self.session.mount(upload_url.split("://")[0] + "://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    @staticmethod
+    def _parse(status_code, result) -> str:
+        if result.get("success"):
+            return result["data"]["url"]
+        message = result.get("error", {}).get("message", "Unknown error")
+        raise StorageError(f"imgbb upload failed ({status_code}): {message}",
+                           retryable=status_code == 429 or status_code >= 500)
+
+    def upload(self, encoded, name, api_key=None):
+        response = self.session.post(
+            self.upload_url, data={"key": api_key or self.api_key}, files=imgbb_files(encoded, name),
+            timeout=self.timeout,
+        )
+        try:
+            result = response.json()
+        except ValueError:
+            result = {}
+        return self._parse(response.status_code, result)
+
+    async def aupload(self, encoded, name, api_key=None):
+        response = await get_async_http_client().post(
+            self.upload_url, data={"key": api_key or self.api_key}, files=imgbb_files(encoded, name),
+            timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+        )
+        try:
+            result = response.json()
+        except ValueError:
+            result = {}
+        return self._parse(response.status_code, result)
+
+
+class LocalStorage(StorageBackend):
+    """Files in a local directory, served by the app under /comics/"""
+
+    name = "local"
+    preassigns_urls = True
+
+    def __init__(self, directory: str, public_base_url: str):
+        self.directory = os.path.abspath(directory)
+        self.public_base_url = public_base_url.rstrip("/")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def url_for(self, name):
+        return f"{self.public_base_url}/comics/{name}"
+
+    def upload(self, encoded, name, api_key=None):
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encoded.data)
+        os.replace(tmp_path, path)
+        return self.url_for(name)
+
+
+class S3Storage(StorageBackend):
+    """S3-compatible bucket (AWS, MinIO, R2...); needs the optional boto3 package"""
+
+    name = "s3"
+    preassigns_urls = True
+
+    def __init__(self, bucket: str, prefix: str = "comics/", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, public_base_url: Optional[str] = None,
+                 addressing_style: str = "auto", timeout=(5.0, 60.0), pool_size: int = 20):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise ImportError("S3 storage requires boto3 (pip install boto3)")
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(
+                connect_timeout=timeout[0],
+                read_timeout=timeout[1],
+                max_pool_connections=pool_size,
+                # MinIO and most self-hosted stores need "path"
+                s3={"addressing_style": addressing_style},
+                # Retries are handled by ComicStorage with jittered backoff
+                retries={"total_max_attempts": 1, "mode": "standard"},
+            ),
+        )
+        if public_base_url:
+            self.public_base_url = public_base_url.rstrip("/")
+        elif endpoint_url:
+            self.public_base_url = f"{endpoint_url.rstrip('/')}/{bucket}"
+        else:
+            self.public_base_url = f"https://{bucket}.s3.{region or 'us-east-1'}.amazonaws.com"
+
+    def url_for(self, name):
+        return f"{self.public_base_url}/{self.prefix}{name}"
+
+    def upload(self, encoded, name, api_key=None):
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            self.client.put_object(
+                Bucket=self.bucket, Key=f"{self.prefix}{name}", Body=encoded.data, ContentType=encoded.mime_type,
+            )
+        except ClientError as e:
+            status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+            raise StorageError(f"S3 upload failed ({status}): {e}", retryable=status == 429 or status >= 500)
+        except BotoCoreError as e:
+            raise StorageError(f"S3 upload failed: {e}", retryable=True)
+        return self.url_for(name)
+
+
+class ComicStorage:
+    """Uploads with retry and, for backends that pre-assign URLs, in the background"""
+
+    def __init__(self, backend: StorageBackend, retries: int = 3, backoff: float = 0.5,
+                 max_backoff: float = 8.0, background: bool = False, background_workers: int = 4):
+        self.backend = backend
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.background = background and backend.preassigns_urls
+        self.executor = ThreadPoolExecutor(max_workers=background_workers, thread_name_prefix="upload") \
+            if self.background else None
+        self.lock = threading.Lock()
+        self.uploads = 0
+        self.failures = 0
+        self.retried = 0
+        self.pending = 0
+        # Background uploads that gave up after the client already got the URL
+        self.background_failures = 0
+
+        logger.info(f"📦 Initialized {backend.name} storage"
+                    f"{' with background uploads' if self.background else ''}")
+
+    def _delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _record(self, **counts):
+        with self.lock:
+            for name, amount in counts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def _failed(self, error, attempt, name) -> bool:
+        """Count a failed attempt; True when it should be retried"""
+        if attempt < self.retries and is_retryable(error):
+            self._record(retried=1)
+            logger.warning(f"⚠️ Upload of {name} failed (attempt {attempt + 1}), retrying: {error}")
+            return True
+        self._record(failures=1)
+        return False
+
+    def _upload(self, encoded, name, api_key):
+        for attempt in range(self.retries + 1):
+            try:
+                url = self.backend.upload(encoded, name, api_key)
+                self._record(uploads=1)
+                return url
+            except Exception as e:
+                if not self._failed(e, attempt, name):
+                    raise
+            time.sleep(self._delay(attempt))
+
+    async def _aupload(self, encoded, name, api_key):
+        for attempt in range(self.retries + 1):
+            try:
+                url = await self.backend.aupload(encoded, name, api_key)
+                self._record(uploads=1)
+                return url
+            except Exception as e:
+                if not self._failed(e, attempt, name):
+                    raise
+            await asyncio.sleep(self._delay(attempt))
+
+    def _background(self, encoded, name, api_key):
+        self._record(pending=1)
+
+        def run():
+            try:
+                self._upload(encoded, name, api_key)
+            except Exception as e:
+                self._record(background_failures=1)
+                logger.error(
+                    f"❌ Background upload of {name} failed, {self.backend.url_for(name)} will not resolve: {e}"
+                )
+            finally:
+                self._record(pending=-1)
+
+        submit_with_context(self.executor, run)
+        return self.backend.url_for(name)
+
+    def store(self, encoded, name: Optional[str] = None, api_key: Optional[str] = None) -> str:
+        """Upload an EncodedImage and return its public URL"""
+        name = name or new_object_name(encoded.extension)
+        if self.background:
+            return self._background(encoded, name, api_key)
+        return self._upload(encoded, name, api_key)
+
+    async def astore(self, encoded, name: Optional[str] = None, api_key: Optional[str] = None) -> str:
+        """Async store"""
+        name = name or new_object_name(encoded.extension)
+        if self.background:
+            return self._background(encoded, name, api_key)
+        return await self._aupload(encoded, name, api_key)
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return {
+                'backend': self.backend.name,
+                'uploads': self.uploads,
+                'failures': self.failures,
+                'retries': self.retried,
+                'pending': self.pending,
+                'background_failures': self.background_failures,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Wait for background uploads"""
+        if self.executor:
+            self.executor.shutdown(wait=wait)
+
+
+def _timeout():
+    return float(os.getenv('STORAGE_CONNECT_TIMEOUT', 5)), float(os.getenv('STORAGE_READ_TIMEOUT', 60))
+
+
+def initialize_storage() -> ComicStorage:
+    """Initialize comic storage from environment"""
+    backend_name = os.getenv('STORAGE_BACKEND', 'imgbb')
+    pool_size = int(os.getenv('STORAGE_POOL_SIZE', 20))
+    if backend_name == 'imgbb':
+        backend = ImgbbStorage(
+            os.getenv('IMGBB_UPLOAD_URL', 'https://api.imgbb.com/1/upload'),
+            api_key=os.getenv('IMGBB_API_KEY'), timeout=_timeout(), pool_size=pool_size,
+        )
+    elif backend_name == 'local':
+        backend = LocalStorage(
+            os.getenv('STORAGE_LOCAL_DIR', os.path.join('cache', 'comics')),
+            os.getenv('PUBLIC_BASE_URL', f"http://localhost:{os.getenv('PORT', 5001)}"),
+        )
+    elif backend_name == 's3':
+        backend = S3Storage(
+            os.environ['S3_BUCKET'],
+            prefix=os.getenv('S3_PREFIX', 'comics/'),
+            endpoint_url=os.getenv('S3_ENDPOINT_URL') or None,
+            region=os.getenv('S3_REGION') or None,
+            public_base_url=os.getenv('S3_PUBLIC_BASE_URL') or None,
+            addressing_style=os.getenv('S3_ADDRESSING_STYLE', 'auto'),
+            timeout=_timeout(),
+            pool_size=pool_size,
+        )
+    else:
+        raise ValueError(f"STORAGE_BACKEND must be one of {', '.join(STORAGE_BACKENDS)}")
+
+    return ComicStorage(
+        backend,
+        retries=int(os.getenv('STORAGE_RETRIES', 3)),
+        backoff=float(os.getenv('STORAGE_BACKOFF', 0.5)),
+        max_backoff=float(os.getenv('STORAGE_MAX_BACKOFF', 8)),
+        background=os.getenv('STORAGE_BACKGROUND_UPLOAD', 'false').lower() in ('1', 'true', 'yes'),
+        background_workers=int(os.getenv('STORAGE_BACKGROUND_WORKERS', 4)),
+    )
@@ -4,6 +4,8 @@ Test script for comic generation
 """
 import requests
 import json
+import sys
+import time
 
 def test_comic_generation():
     """Test the comic generation endpoint"""
@@ -48,6 +50,45 @@ def test_comic_generation():
     except Exception as e:
         print(f"❌ Error: {e}")
 
+def test_async_comic_generation():
+    """Test the job-submission mode of the comic generation endpoint"""
+    base_url = "http://localhost:5001"
+
+    test_story = "Two friends discover a magical portal in their backyard that leads to a world where animals can talk and they must help save the forest from an evil wizard."
+
+    print("🧪 Testing async comic generation...")
+    print(f"📖 Story: {test_story}")
+
+    try:
+        response = requests.post(f"{base_url}/generate-comic", json={"story": test_story, "async": True}, timeout=10)
+        if response.status_code != 202:
+            print(f"❌ HTTP Error: {response.status_code}")
+            print(f"Response: {response.text}")
+            return
+
+        job_id = response.json()["job_id"]
+        print(f"📥 Job queued: {job_id}")
+
+        deadline = time.time() + 300
+        while time.time() < deadline:
+            status = requests.get(f"{base_url}/jobs/{job_id}", timeout=10).json()
+            stages = ", ".join(f"{name}={info['status']}" for name, info in status["stages"].items())
+            print(f"⏳ {status['status']}: {stages}")
+            if status["status"] in ("completed", "failed"):
+                break
+            time.sleep(5)
+
+        result = requests.get(f"{base_url}/jobs/{job_id}/result", timeout=10)
+        if result.status_code == 200:
+            print(f"✅ Comic URL: {result.json()['comic_url']}")
+        else:
+            print(f"❌ Job did not complete: {result.status_code} {result.text}")
+
+    except requests.exceptions.ConnectionError:
+        print("🔌 Connection error - make sure the server is running on localhost:5001")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+
 def test_health_check():
     """Test the health check endpoint"""
     url = "http://localhost:5001/health"
@@ -72,6 +113,9 @@ if __name__ == "__main__":
     # Test health check first
     if test_health_check():
         print()
-        test_comic_generation()
+        if "--async" in sys.argv:
+            test_async_comic_generation()
+        else:
+            test_comic_generation()
     else:
         print("❌ Server is not running. Start it with: python start.py")
\ No newline at end of file
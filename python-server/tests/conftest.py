@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the server modules the way start.py does, from python-server/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,20 @@
+from PIL import Image
+
+from compositing import IncrementalStripBuilder
+
+
+def test_long_caption_stays_inside_its_slot():
+    builder = IncrementalStripBuilder(2)
+    builder.add_panel(0, Image.new("RGB", (1024, 1024), "white"), "")
+    builder.add_panel(1, Image.new("RGB", (1024, 1024), "white"), "a very long caption " * 20)
+
+    left, top, right, bottom = builder.layout.caption_box(0)
+    neighbour = builder.result().crop((left, top, right, bottom)).convert("L")
+    assert neighbour.getextrema() == (255, 255)
+
+
+def test_slot_image_is_none_beyond_the_grid():
+    builder = IncrementalStripBuilder(7)
+    assert builder.count == 6
+    assert builder.slot_image(5).size == builder.result().crop(builder.layout.slots[5]).size
+    assert builder.slot_image(6) is None
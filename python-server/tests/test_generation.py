@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+import generation
+
+
+@pytest.fixture
+def fake_backends(monkeypatch):
+    renders = []
+
+    def render(panel, *_):
+        renders.append(panel["number"])
+        return Image.new("RGB", (1024, 1024), "blue")
+
+    async def arender(panel, *args):
+        return render(panel, *args)
+
+    async def arefine(*_):
+        return "prompt"
+
+    monkeypatch.setattr(generation, "REFINE_MODE", "panel")
+    monkeypatch.setattr(generation, "render_panel_image", render)
+    monkeypatch.setattr(generation, "arender_panel_image", arender)
+    monkeypatch.setattr(generation, "refine_image_gen_prompt", lambda *_: "prompt")
+    monkeypatch.setattr(generation, "arefine_image_gen_prompt", arefine)
+    return renders
+
+
+def script(count):
+    return [{"number": str(i + 1), "description": "a scene", "text": "a caption"} for i in range(count)]
+
+
+@pytest.mark.parametrize("panels", [script(7), iter(script(7))], ids=["list", "stream"])
+def test_panels_beyond_the_grid_are_not_rendered(fake_backends, panels):
+    previews = []
+
+    strip = generation.generate_comic(panels, "style", "characters", on_panel=lambda i, image: previews.append(i))
+
+    assert strip.size == (1024, 1536)
+    assert sorted(previews) == [0, 1, 2, 3, 4, 5]
+    assert len(fake_backends) == 6
+
+
+def test_async_panels_beyond_the_grid_are_not_rendered(fake_backends):
+    previews = []
+
+    strip = asyncio.run(generation.agenerate_comic(
+        script(7), "style", "characters", on_panel=lambda i, image: previews.append(i),
+    ))
+
+    assert strip.size == (1024, 1536)
+    assert sorted(previews) == [0, 1, 2, 3, 4, 5]
+    assert len(fake_backends) == 6
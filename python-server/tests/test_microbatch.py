@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from microbatch import MicroBatcher
+from scheduler import RequestContext, RequestExpired, request_context_var, set_request_context
+
+
+def recording_batcher(max_size, max_wait=0.2, send=None):
+    batches = []
+
+    def record(payloads, context):
+        batches.append(payloads)
+        return send(payloads) if send else [payload * 2 for payload in payloads]
+
+    return MicroBatcher(record, max_size=max_size, max_wait=max_wait), batches
+
+
+def submit_all(batcher, payloads):
+    return [batcher.submit(payload) for payload in payloads]
+
+
+def test_collects_submissions_within_the_window_into_one_batch():
+    batcher, batches = recording_batcher(max_size=8)
+
+    futures = submit_all(batcher, [1, 2, 3])
+
+    assert [future.result(timeout=5) for future in futures] == [2, 4, 6]
+    assert batches == [[1, 2, 3]]
+    assert batcher.get_status()['batches'] == 1
+
+
+def test_splits_batches_at_max_size():
+    release = threading.Event()
+    batcher, batches = recording_batcher(max_size=2, max_wait=5, send=lambda payloads: release.wait() and payloads)
+
+    futures = submit_all(batcher, [1, 2, 3, 4])
+    release.set()
+
+    assert [future.result(timeout=5) for future in futures] == [1, 2, 3, 4]
+    assert sorted(batches) == [[1, 2], [3, 4]]
+    assert batcher.get_status()['full_batches'] == 2
+
+
+def test_drops_items_whose_request_expired():
+    batcher, batches = recording_batcher(max_size=8)
+
+    cancelled = RequestContext()
+    cancelled.cancel()
+    token = set_request_context(cancelled)
+    try:
+        expired = batcher.submit(1)
+    finally:
+        request_context_var.reset(token)
+    live = batcher.submit(2)
+
+    assert live.result(timeout=5) == 4
+    with pytest.raises(RequestExpired):
+        expired.result(timeout=5)
+    assert batches == [[2]]
+
+
+def test_a_failed_batch_fails_every_item():
+    def fail(payloads):
+        raise ValueError("backend down")
+
+    batcher, _ = recording_batcher(max_size=8, send=fail)
+
+    futures = submit_all(batcher, [1, 2])
+
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from scheduler import RequestContext, RequestExpired, SharedRequest, SlotScheduler
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def queue_waiter(scheduler, context, order, label):
+    """Start a thread that takes a slot as context, records label and releases it"""
+    waiting = scheduler.get_status()['waiting']
+
+    def take():
+        try:
+            with scheduler.slot(context):
+                order.append(label)
+        except RequestExpired:
+            order.append(f"{label}:expired")
+
+    thread = threading.Thread(target=take)
+    thread.start()
+    wait_for(lambda: scheduler.get_status()['waiting'] == waiting + 1)
+    return thread
+
+
+def test_grants_by_priority_then_round_robin_across_tenants():
+    scheduler = SlotScheduler(1)
+    order = []
+    with scheduler.slot(RequestContext()):
+        threads = [
+            queue_waiter(scheduler, RequestContext("a", "batch"), order, "a1"),
+            queue_waiter(scheduler, RequestContext("a", "batch"), order, "a2"),
+            queue_waiter(scheduler, RequestContext("a", "batch"), order, "a3"),
+            queue_waiter(scheduler, RequestContext("b", "batch"), order, "b1"),
+            queue_waiter(scheduler, RequestContext("b", "batch"), order, "b2"),
+            queue_waiter(scheduler, RequestContext("c", "interactive"), order, "c1"),
+        ]
+    for thread in threads:
+        thread.join()
+
+    assert order == ["c1", "a1", "b1", "a2", "b2", "a3"]
+    status = scheduler.get_status()
+    assert status['in_use'] == 0 and status['waiting'] == 0
+    assert status['granted_interactive'] == 2 and status['granted_batch'] == 5
+
+
+def test_waiter_past_its_deadline_is_dropped():
+    scheduler = SlotScheduler(1)
+    order = []
+    with scheduler.slot(RequestContext()):
+        thread = queue_waiter(scheduler, RequestContext(timeout=0.2), order, "late")
+        thread.join(timeout=2)
+        assert order == ["late:expired"]
+
+    status = scheduler.get_status()
+    assert status['dropped'] == 1 and status['waiting'] == 0 and status['in_use'] == 0
+
+
+def test_expired_request_is_rejected_before_queueing():
+    context = RequestContext()
+    context.cancel()
+    with pytest.raises(RequestExpired):
+        with SlotScheduler(1).slot(context):
+            pass
+
+
+def test_cancelled_waiter_gives_up_without_leaking_a_slot():
+    scheduler = SlotScheduler(1)
+    order = []
+    context = RequestContext()
+    with scheduler.slot(RequestContext()):
+        thread = queue_waiter(scheduler, context, order, "cancelled")
+        context.cancel()
+        thread.join(timeout=3)
+        assert order == ["cancelled:expired"]
+
+    with scheduler.slot(RequestContext()):
+        assert scheduler.get_status()['in_use'] == 1
+    assert scheduler.get_status()['in_use'] == 0
+
+
+def test_async_waiter_abandons_its_place_when_cancelled():
+    scheduler = SlotScheduler(1)
+
+    async def scenario():
+        async with scheduler.aslot(RequestContext()):
+            task = asyncio.ensure_future(scheduler.aslot(RequestContext()).__aenter__())
+            await asyncio.sleep(0.05)
+            assert scheduler.get_status()['waiting'] == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        async with scheduler.aslot(RequestContext()):
+            pass
+
+    asyncio.run(scenario())
+    status = scheduler.get_status()
+    assert status['in_use'] == 0 and status['waiting'] == 0
+
+
+def test_shared_request_follows_its_most_urgent_live_request():
+    shared = SharedRequest()
+    batch = RequestContext("a", "batch", timeout=0.1)
+    shared.add(batch)
+    assert (shared.tenant, shared.priority) == ("a", "batch")
+
+    interactive = RequestContext("b", "interactive")
+    shared.add(interactive)
+    assert (shared.tenant, shared.priority) == ("b", "interactive")
+    assert shared.remaining() is None
+
+    interactive.cancel()
+    assert shared.priority == "batch" and not shared.expired
+    time.sleep(0.15)
+    assert shared.expired
+    with pytest.raises(RequestExpired):
+        shared.check()
+
+
+def test_waiter_moves_up_when_an_interactive_request_joins_shared_work():
+    scheduler = SlotScheduler(1)
+    order = []
+    shared = SharedRequest()
+    shared.add(RequestContext("a", "batch"))
+    with scheduler.slot(RequestContext()):
+        threads = [
+            queue_waiter(scheduler, RequestContext("b", "batch"), order, "other"),
+            queue_waiter(scheduler, shared, order, "shared"),
+        ]
+        shared.add(RequestContext("c", "interactive"))
+    for thread in threads:
+        thread.join()
+
+    assert order == ["shared", "other"]
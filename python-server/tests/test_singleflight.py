@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+from scheduler import RequestContext, RequestExpired, SlotScheduler, set_request_context
+from singleflight import SingleFlight
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_follower_without_deadline_outlives_expired_leader():
+    scheduler = SlotScheduler(1)
+    flights = SingleFlight(ttl=0, label="image")
+    results = {}
+
+    def generate(*_):
+        with scheduler.slot():
+            return "image"
+
+    def request(name, context):
+        set_request_context(context)
+        try:
+            results[name] = flights.run("panel", generate)
+        except RequestExpired as e:
+            results[name] = e
+
+    with scheduler.slot(RequestContext()):
+        leader = threading.Thread(target=request, args=("leader", RequestContext("a", "batch", timeout=0.5)))
+        leader.start()
+        wait_for(lambda: scheduler.get_status()['waiting'] == 1)
+        follower = threading.Thread(target=request, args=("follower", RequestContext("b", "interactive")))
+        follower.start()
+        wait_for(lambda: flights.get_status()['coalesced'] == 1)
+        time.sleep(0.7)
+    leader.join(timeout=3)
+    follower.join(timeout=3)
+
+    assert results == {"leader": "image", "follower": "image"}
+    assert scheduler.get_status()['granted_interactive'] == 2
+
+
+def test_shared_run_is_dropped_once_every_caller_expired():
+    scheduler = SlotScheduler(1)
+    flights = SingleFlight(ttl=0)
+    errors = []
+
+    def generate(*_):
+        with scheduler.slot():
+            return "comic"
+
+    def request(context):
+        set_request_context(context)
+        try:
+            flights.run("comic", generate)
+        except RequestExpired as e:
+            errors.append(e)
+
+    with scheduler.slot(RequestContext()):
+        threads = [threading.Thread(target=request, args=(RequestContext(timeout=0.3),)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=3)
+
+    assert len(errors) == 2
+    assert flights.get_status()['leaders'] == 1
+
+
+def test_follower_takes_over_when_leader_is_cancelled():
+    scheduler = SlotScheduler(1)
+    flights = SingleFlight(ttl=0)
+    runs = []
+
+    async def render(*_):
+        runs.append(1)
+        async with scheduler.aslot():
+            await asyncio.sleep(0.05)
+            return "comic"
+
+    async def request(context):
+        set_request_context(context)
+        try:
+            return await flights.arun("comic", render)
+        except asyncio.CancelledError:
+            # What the Quart route does when the client disconnects
+            context.cancel()
+            raise
+
+    async def scenario():
+        leader_context = RequestContext("a")
+        async with scheduler.aslot(RequestContext()):
+            leader = asyncio.ensure_future(request(leader_context))
+            await asyncio.sleep(0.05)
+            follower = asyncio.ensure_future(request(RequestContext("b")))
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            await asyncio.sleep(0.05)
+        return await follower, leader.cancelled()
+
+    result, leader_cancelled = asyncio.run(scenario())
+    assert result == "comic" and leader_cancelled
+    assert len(runs) == 2
+    assert scheduler.get_status()['in_use'] == 0
@@ -0,0 +1,36 @@
+import io
+
+from PIL import Image
+import stability_sdk.interfaces.gooseai.generation.generation_pb2 as generation
+
+import stability_ai
+from stability_pool import StabilityClientPool
+
+
+class FakeClient:
+    def __init__(self):
+        self.requests = []
+
+    def generate(self, **params):
+        self.requests.append(params)
+        buffer = io.BytesIO()
+        Image.new("RGB", stability_ai.EDIT_SIZE, "red").save(buffer, format="PNG")
+        yield generation.Answer(artifacts=[
+            generation.Artifact(type=generation.ARTIFACT_IMAGE, binary=buffer.getvalue()),
+        ])
+
+
+def test_edit_image_goes_through_the_client_pool(tmp_path, monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(stability_ai, "stability_pool", StabilityClientPool(lambda api_key: fake))
+    monkeypatch.setattr(stability_ai, "stability_key_manager", None)
+    monkeypatch.setattr(stability_ai, "image_cache", None)
+    monkeypatch.setenv("STABILITY_KEY", "key-a")
+    source = tmp_path / "source.png"
+    Image.new("RGB", stability_ai.EDIT_SIZE).save(source)
+
+    image = stability_ai.edit_image(str(source), "a red panel", str(tmp_path / "edited"))
+
+    assert image.size == stability_ai.EDIT_SIZE
+    assert (tmp_path / "edited.png").exists()
+    assert fake.requests[0]["prompt"] == "a red panel" and fake.requests[0]["seed"] == stability_ai.EDIT_SEED
@@ -0,0 +1,35 @@
+import grpc
+import pytest
+
+from stability_pool import StabilityClientPool
+
+
+class FailingRpc(grpc.RpcError):
+    def code(self):
+        return grpc.StatusCode.UNAVAILABLE
+
+
+def test_reconnects_channels_that_grew_too_old():
+    created = []
+    pool = StabilityClientPool(lambda api_key: created.append(api_key) or object(), max_age=0)
+
+    with pool.acquire("key-a") as first:
+        pass
+    with pool.acquire("key-a") as second:
+        pass
+
+    assert created == ["key-a", "key-a"] and first is not second
+
+
+def test_reconnects_after_a_channel_failure():
+    pool = StabilityClientPool(lambda api_key: object())
+
+    with pytest.raises(FailingRpc):
+        with pool.acquire("key-a") as first:
+            raise FailingRpc()
+    assert pool.get_status()['healthy'] == 0
+    with pool.acquire("key-a") as second:
+        pass
+
+    assert first is not second
+    assert pool.get_status() == {'channels': 1, 'healthy': 1, 'max_streams_per_key': 4}
@@ -0,0 +1,18 @@
+import httpx
+import requests
+
+from storage import StorageError, is_retryable
+
+
+def test_retries_transport_failures_and_retryable_statuses():
+    assert is_retryable(requests.ConnectionError("reset"))
+    assert is_retryable(requests.Timeout("slow"))
+    assert is_retryable(httpx.ConnectError("refused"))
+    assert is_retryable(StorageError("imgbb upload failed (503)", retryable=True))
+
+
+def test_does_not_retry_other_request_or_disk_errors():
+    assert not is_retryable(requests.HTTPError("404"))
+    assert not is_retryable(requests.exceptions.InvalidURL("bad url"))
+    assert not is_retryable(PermissionError("read-only storage directory"))
+    assert not is_retryable(StorageError("imgbb upload failed (400)"))
@@ -0,0 +1,52 @@
+"""
+Per-request trace ids for logs
+The current trace id lives in a context variable, is stamped on every log
+record and follows work handed to thread pools via submit_with_context
+"""
+
+import contextvars
+import logging
+import os
+import uuid
+
+trace_id_var = contextvars.ContextVar("trace_id", default="-")
+
+logger = logging.getLogger("comic")
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def get_trace_id() -> str:
+    return trace_id_var.get()
+
+
+def set_trace_id(trace_id: str = None):
+    """Set the trace id for the current context and return the reset token"""
+    return trace_id_var.set(trace_id or new_trace_id())
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """Submit fn to an executor so it runs with the caller's trace id"""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
+
+
+def configure_logging():
+    """Stamp every log record with the current trace id and set the log format"""
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, "traced", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        record.trace_id = trace_id_var.get()
+        return record
+
+    record_factory.traced = True
+    logging.setLogRecordFactory(record_factory)
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s",
+    )
@@ -1,33 +1,230 @@
 from langchain_groq import ChatGroq
 from dotenv import load_dotenv
+import asyncio
+import httpx
 import os
+import threading
+import time
+import weakref
+
+from llm_cache import LLMCache, initialize_llm_cache
+from metrics import register_status
+
+load_dotenv()
 
 models_dict = {
     "Groq": "openai/gpt-oss-20b"
 }
 
+# Process-wide LLM clients keyed by (provider, model, temperature)
+_llm_clients = {}
+_llm_lock = threading.Lock()
+
+# Shared HTTP connection pool used by every LLM client
+_http_client = None
+
+# Async clients are bound to the event loop that created them, so they are kept per loop
+_async_llm_clients = weakref.WeakKeyDictionary()
+
+# Memoized completions for identical (model, temperature, prompt) calls
+llm_cache = initialize_llm_cache()
+if llm_cache:
+    register_status("llm_cache", llm_cache.get_status, {
+        'hits': 'counter', 'misses': 'counter', 'latency_saved_seconds': 'counter',
+    })
+
+
+def _http_limits():
+    return httpx.Limits(
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 20)),
+        max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", 10)),
+        keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60)),
+    )
+
+
+def _http_timeout():
+    return httpx.Timeout(float(os.getenv("LLM_TIMEOUT", 60)), connect=10.0)
 
-def load_llm_model(name="Groq", model_id="openai/gpt-oss-20b"):
-    load_dotenv()
-    llm = None
+
+def get_http_client():
+    """Return the shared keep-alive HTTP client, creating it on first use"""
+    global _http_client
+    if _http_client is None:
+        with _llm_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(limits=_http_limits(), timeout=_http_timeout())
+    return _http_client
+
+
+def get_async_http_client():
+    """Return the keep-alive async HTTP client of the running event loop"""
+    loop = asyncio.get_running_loop()
+    clients = _async_llm_clients.get(loop)
+    if clients is None:
+        clients = {"http": httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout())}
+        _async_llm_clients[loop] = clients
+    return clients["http"]
+
+
+async def aclose_async_http_client():
+    """Close the async HTTP client of the running event loop and drop its LLM clients"""
+    clients = _async_llm_clients.pop(asyncio.get_running_loop(), None)
+    if clients is not None:
+        await clients["http"].aclose()
+
+
+def _create_llm(name, model_id, temperature, http_async_client=None):
     if name == "Groq":
-        llm = ChatGroq(
+        return ChatGroq(
             model=model_id,
-            temperature=0.2,
-            groq_api_key=os.getenv("GROQ_API_KEY")
+            temperature=temperature,
+            groq_api_key=os.getenv("GROQ_API_KEY"),
+            http_client=get_http_client(),
+            http_async_client=http_async_client,
         )
-    else:
-        raise ValueError(f"Model {name} not found.")
+    raise ValueError(f"Model {name} not found.")
+
+
+def load_llm_model(name="Groq", model_id="openai/gpt-oss-20b", temperature=0.2):
+    """Return the shared client for (name, model_id, temperature), creating it lazily"""
+    key = (name, model_id, temperature)
+    llm = _llm_clients.get(key)
     if llm is None:
-        raise ValueError(f"Model {name} not found.")
+        # Build outside the lock so the shared HTTP client can be created
+        candidate = _create_llm(name, model_id, temperature)
+        with _llm_lock:
+            llm = _llm_clients.setdefault(key, candidate)
     return llm
 
 
+def load_async_llm_model(name="Groq", model_id="openai/gpt-oss-20b", temperature=0.2):
+    """Return the client for (name, model_id, temperature) bound to the running event loop"""
+    http_client = get_async_http_client()
+    clients = _async_llm_clients[asyncio.get_running_loop()]
+    key = (name, model_id, temperature)
+    if key not in clients:
+        clients[key] = _create_llm(name, model_id, temperature, http_async_client=http_client)
+    return clients[key]
+
+
 def invoke_llm(llm, prompt, stop=None):
     return llm.invoke(prompt, stop=stop)
 
 
+def render_prompt(prompt):
+    """Flatten a string or list of chat messages into the text sent to the model"""
+    if isinstance(prompt, str):
+        return prompt
+    return "\n".join(f"{message.type}: {message.content}" for message in prompt)
+
+
+def cacheable(content, validate=None):
+    """Whether a completion may be memoized: non-empty and accepted by validate.
+
+    validate is an optional callable(content) returning a falsy value or
+    raising for answers the caller cannot use, so a malformed answer is
+    retried instead of being replayed from the cache.
+    """
+    if not content:
+        return False
+    if validate is None:
+        return True
+    try:
+        return bool(validate(content))
+    except Exception:
+        return False
+
+
+def invoke_llm_cached(prompt, name="Groq", model_id="openai/gpt-oss-20b", temperature=0.2, json_mode=False,
+                      validate=None):
+    """Invoke the shared LLM client and return the completion text, memoized by prompt.
+
+    json_mode asks the provider for a JSON object response. Only answers
+    accepted by validate (see cacheable) are memoized or served from the memo.
+    """
+    key = None
+    if llm_cache:
+        model_key = f"{name}/{model_id}" + ("/json" if json_mode else "")
+        key = LLMCache.make_key(model_key, temperature, render_prompt(prompt))
+        content = llm_cache.get(key)
+        if content is not None and cacheable(content, validate):
+            return content
+
+    llm = load_llm_model(name, model_id, temperature)
+    if json_mode:
+        llm = llm.bind(response_format={"type": "json_object"})
+    started = time.perf_counter()
+    content = llm.invoke(prompt).content
+    if key and cacheable(content, validate):
+        llm_cache.put(key, content, time.perf_counter() - started)
+    return content
+
+
+async def ainvoke_llm_cached(prompt, name="Groq", model_id="openai/gpt-oss-20b", temperature=0.2, json_mode=False,
+                             validate=None):
+    """Async counterpart of invoke_llm_cached; the SQLite cache tier runs in a thread"""
+    key = None
+    if llm_cache:
+        model_key = f"{name}/{model_id}" + ("/json" if json_mode else "")
+        key = LLMCache.make_key(model_key, temperature, render_prompt(prompt))
+        content = await asyncio.to_thread(llm_cache.get, key)
+        if content is not None and cacheable(content, validate):
+            return content
+
+    llm = load_async_llm_model(name, model_id, temperature)
+    if json_mode:
+        llm = llm.bind(response_format={"type": "json_object"})
+    started = time.perf_counter()
+    content = (await llm.ainvoke(prompt)).content
+    if key and cacheable(content, validate):
+        await asyncio.to_thread(llm_cache.put, key, content, time.perf_counter() - started)
+    return content
+
+
+def stream_llm_cached(prompt, name="Groq", model_id="openai/gpt-oss-20b", temperature=0.2, validate=None):
+    """Yield the completion text in chunks as the model produces it.
+
+    Shares the memo with invoke_llm_cached: a cached completion is yielded
+    in one piece, and a streamed one is cached once it is complete and
+    accepted by validate.
+    """
+    key = None
+    if llm_cache:
+        key = LLMCache.make_key(f"{name}/{model_id}", temperature, render_prompt(prompt))
+        content = llm_cache.get(key)
+        if content is not None and cacheable(content, validate):
+            yield content
+            return
 
+    llm = load_llm_model(name, model_id, temperature)
+    started = time.perf_counter()
+    parts = []
+    for chunk in llm.stream(prompt):
+        if chunk.content:
+            parts.append(chunk.content)
+            yield chunk.content
+    content = "".join(parts)
+    if key and cacheable(content, validate):
+        llm_cache.put(key, content, time.perf_counter() - started)
 
 
+async def astream_llm_cached(prompt, name="Groq", model_id="openai/gpt-oss-20b", temperature=0.2, validate=None):
+    """Async stream_llm_cached"""
+    key = None
+    if llm_cache:
+        key = LLMCache.make_key(f"{name}/{model_id}", temperature, render_prompt(prompt))
+        content = await asyncio.to_thread(llm_cache.get, key)
+        if content is not None and cacheable(content, validate):
+            yield content
+            return
 
+    llm = load_async_llm_model(name, model_id, temperature)
+    started = time.perf_counter()
+    parts = []
+    async for chunk in llm.astream(prompt):
+        if chunk.content:
+            parts.append(chunk.content)
+            yield chunk.content
+    content = "".join(parts)
+    if key and cacheable(content, validate):
+        await asyncio.to_thread(llm_cache.put, key, content, time.perf_counter() - started)
@@ -177,7 +177,7 @@ router.post("/", authenticateToken, async (req, res) => {
       generateMusicAsync(dream.id, title, description);
     }
     if (generateComic) {
-      generateComicAsync(dream.id, title, description);
+      generateComicAsync(dream.id, title, description, req.userId);
     }
 
     res.status(201).json({
@@ -239,11 +239,11 @@ async function generateStoryAsync(dreamId, title, description) {
 }
 
 // Async function to generate comic
-async function generateComicAsync(dreamId, title, description) {
+async function generateComicAsync(dreamId, title, description, userId) {
   try {
     console.log(`🎨 Starting comic generation for dream ${dreamId}`);
 
-    const comicContent = await generateComic(title, description);
+    const comicContent = await generateComic(title, description, userId);
 
     // Create comic record
     const comic = await prisma.comic.create({
@@ -609,10 +609,15 @@ const determineMusicGenre = (description) => {
 };
 
 // Generate comic using Python comic generation service
-export const generateComic = async (title, description) => {
+// Submits a job and polls for the result instead of holding the request open.
+// A user waits on the result, so the job is scheduled as interactive work for
+// that user (tenant) and only for as long as we keep polling.
+export const generateComic = async (title, description, userId) => {
   try {
     const comicServiceUrl =
       process.env.COMIC_SERVICE_URL || "http://localhost:5001";
+    const pollInterval = parseInt(process.env.COMIC_POLL_INTERVAL_MS || "3000");
+    const timeout = parseInt(process.env.COMIC_TIMEOUT_MS || "600000");
 
     console.log(`🎨 Generating comic for: ${title}`);
 
@@ -620,9 +625,13 @@ export const generateComic = async (title, description) => {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
+        ...(userId ? { "X-Tenant-ID": String(userId) } : {}),
       },
       body: JSON.stringify({
         story: `${title}: ${description}`,
+        async: true,
+        priority: "interactive",
+        timeout: timeout / 1000,
       }),
     });
 
@@ -634,7 +643,31 @@ export const generateComic = async (title, description) => {
       );
     }
 
-    const data = await response.json();
+    const job = await response.json();
+    console.log(`📥 Comic job queued: ${job.job_id}`);
+
+    let data;
+    const deadline = Date.now() + timeout;
+    while (Date.now() < deadline) {
+      await new Promise((resolve) => setTimeout(resolve, pollInterval));
+
+      const resultResponse = await fetch(
+        `${comicServiceUrl}/jobs/${job.job_id}/result`
+      );
+      if (resultResponse.status === 202) {
+        continue;
+      }
+
+      data = await resultResponse.json();
+      if (!resultResponse.ok) {
+        throw new Error(data.error || "Comic generation failed");
+      }
+      break;
+    }
+
+    if (!data) {
+      throw new Error(`Comic job ${job.job_id} timed out`);
+    }
 
     if (!data.success) {
       throw new Error(data.error || "Comic generation failed");